@@ -0,0 +1,116 @@
+"""
+Offline analysis worker processes.
+
+Kept out of app.py on purpose: a spawned worker imports only this module and
+vision.py - not Flask, the DB pool/writer or the camera and face stacks.
+"""
+import sys
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+import vision
+from vision import YOLO, ObjectTracker, LineCounter, OnnxDetector, detect_batch
+
+# Per-worker state, set by init()
+_weights = None     # (backend, weights file) resolved by the parent
+_cancel = None      # multiprocessing.Event - set when the job is cancelled
+_model = None
+
+
+def start(workers, threads, weights, segments):
+    """Start a spawn pool and submit analyze_segment(*args) for every args
+    tuple in segments. Returns (executor, futures, cancel event).
+
+    spawn re-runs the parent's __main__ in every child - when the server is
+    started as `python app.py` that is the whole web app with its DB writer,
+    registries and threads. The children are launched from submit(), so
+    __main__ points at this module while they start."""
+    context = multiprocessing.get_context('spawn')
+    cancel = context.Event()
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                   initializer=init, initargs=(threads, weights, cancel))
+    main = sys.modules['__main__']
+    sys.modules['__main__'] = sys.modules[__name__]
+    try:
+        futures = [executor.submit(analyze_segment, *args) for args in segments]
+    finally:
+        sys.modules['__main__'] = main
+    return executor, futures, cancel
+
+
+def init(threads, weights, cancel):
+    global _weights, _cancel
+    # Several workers share the box - keep each one's BLAS/OpenCV/ORT pools small
+    vision.ONNX_THREADS = threads
+    cv2.setNumThreads(1)
+    if vision.TORCH_AVAILABLE:
+        vision.torch.set_num_threads(threads)
+    _weights, _cancel = weights, cancel
+
+
+def _load(model_name):
+    global _model
+    if _model is None:
+        # Load exactly what the parent resolved - never export from here
+        backend, path = _weights
+        if backend == 'onnx':
+            _model = OnnxDetector(model_name, onnx_path=path)
+        elif YOLO is None:
+            raise RuntimeError('ultralytics not installed')
+        else:
+            _model = YOLO(path, task='detect')
+    return _model
+
+
+def analyze_segment(path, model_name, lines, warmup_start, start, end, fps, stride, batch_size):
+    """Decodes frames [warmup_start, end), infers every stride-th frame in
+    batches, tracks and counts line crossings. Crossings before `start`
+    belong to the previous segment - the warm-up only establishes which side
+    of the line each object is on. Stops early once the job is cancelled."""
+    t0 = time.time()
+    model = _load(model_name)
+    cap = cv2.VideoCapture(path)
+    if warmup_start:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, warmup_start)
+    tracker = ObjectTracker()
+    counter = LineCounter('offline', lines)
+    events = []
+    decoded = inferred = 0
+    batch = []
+
+    def flush():
+        nonlocal inferred
+        results = detect_batch(model, model_name, [frame for _, frame in batch])
+        for (index, frame), detections in zip(batch, results):
+            tracks = tracker.update(detections, index / fps)
+            for track, line, direction in counter.update(tracks, frame.shape):
+                if index >= start:
+                    events.append((index, track.cls, direction, round(track.score, 3)))
+        inferred += len(batch)
+        batch.clear()
+
+    index = warmup_start
+    while index < end:
+        if (index - warmup_start) % stride == 0:
+            ok, frame = cap.read()
+            if ok:
+                batch.append((index, frame))
+        else:
+            # Skipped frames still have to be demuxed, but not converted
+            ok = cap.grab()
+        if not ok:
+            break
+        decoded += 1
+        index += 1
+        if len(batch) >= batch_size:
+            flush()
+            if _cancel is not None and _cancel.is_set():
+                break
+    if batch:
+        flush()
+    cap.release()
+    return {'start': start, 'end': end, 'events': events, 'decoded': decoded,
+            'inferred': inferred, 'seconds': round(time.time() - t0, 2)}
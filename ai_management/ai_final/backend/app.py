@@ -3,44 +3,35 @@ AI CCTV - Flask Backend API
 Complete backend with SQLite database
 """
 import os
-os.environ['TORCH_FORCE_WEIGHTS_ONLY_LOAD'] = '0'
-
-# Make torch optional
-try:
-    import torch
-    _original_load = torch.load
-    def _patched_load(*args, **kwargs):
-        kwargs['weights_only'] = False
-        return _original_load(*args, **kwargs)
-    torch.load = _patched_load
-    TORCH_AVAILABLE = True
-except ImportError:
-    TORCH_AVAILABLE = False
-    print("⚠️ torch not available - some features disabled")
-
 import cv2
 import sqlite3
 import base64
+import io
+import json
 import uuid
 import subprocess
+import tempfile
+import hashlib
+from concurrent.futures import wait, FIRST_COMPLETED
 import numpy as np
-from datetime import datetime
+from datetime import datetime, timezone
 from pathlib import Path
 from functools import wraps
-from flask import Flask, jsonify, request, Response, send_file
+from flask import Flask, Request, jsonify, request, Response, send_file
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
 import threading
+import queue
 import time
 import jwt
+from collections import OrderedDict, deque
 
-# Try to load YOLO
-try:
-    from ultralytics import YOLO
-    YOLO_AVAILABLE = True
-except ImportError:
-    YOLO_AVAILABLE = False
-    print("⚠️ YOLO not available - detection disabled")
+# Model backends, tracker and count lines live in vision.py so the offline
+# analysis workers can use them without importing this module
+from vision import (YOLO, YOLO_AVAILABLE, ONNX_AVAILABLE, MODEL_DIR, TRACK_MIN_HITS, DEFAULT_COUNT_LINES,
+                    INFERENCE_CONF, box_iou, greedy_match, latency_summary, OnnxDetector, detect_raw,
+                    detect_batch, ObjectTracker, LineCounter)
+import analysis_worker
 
 # Try to load face_recognition
 try:
@@ -50,31 +41,152 @@ except ImportError:
     FACE_RECOGNITION_AVAILABLE = False
     print("⚠️ face_recognition not available - face search disabled")
 
+# Faster JPEG encoding if libjpeg-turbo's Python binding is installed
+try:
+    from turbojpeg import TurboJPEG
+    turbo_jpeg = TurboJPEG()
+    JPEG_ENCODER = 'turbojpeg'
+except (ImportError, OSError):
+    turbo_jpeg = None
+    JPEG_ENCODER = 'opencv'
+
 app = Flask(__name__)
-CORS(app, origins=['*'])
+CORS(app, origins=['*'], expose_headers=['ETag'])
 
 # Configuration
 DATABASE = 'aicctv.db'
+DB_POOL_SIZE = 8                # idle SQLite connections kept for reuse
+DB_BUSY_TIMEOUT_MS = 5000
+DB_WRITE_FLUSH_MS = 20          # background writer groups writes over this window
+DB_WRITE_MAX_BATCH = 500
+ROLLUP_MINUTE_RETENTION_DAYS = 7
 JWT_SECRET = 'ai-cctv-secret-key-change-in-production'
-MODEL_DIR = Path(__file__).parent.parent / 'models'
 UPLOAD_DIR = Path('uploads')
 UPLOAD_DIR.mkdir(exist_ok=True)
 FACE_DIR = Path('faces')
 FACE_DIR.mkdir(exist_ok=True)
 
+# Background jobs
+JOB_WORKERS = 2                 # concurrent ffmpeg/analysis jobs
+JOB_QUEUE_MAX = 50              # queued jobs before uploads are refused
+JOB_POLL_INTERVAL = 5.0
+JOB_TIMEOUT = 6 * 3600
+JOB_PROGRESS_SAVE_INTERVAL = 5.0
+UPLOAD_MAX_AGE_HOURS = 72
+UPLOAD_MAX_BYTES = 20 * 1024 ** 3
+UPLOAD_CLEANUP_INTERVAL = 3600
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024   # suggested client chunk size
+UPLOAD_IO_BLOCK = 1024 * 1024
+UPLOAD_STALL_TIMEOUT = 600      # seconds without new bytes before a streaming reader gives up
+
+# Offline analysis of recorded video
+ANALYSIS_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+ANALYSIS_SEGMENTS_PER_WORKER = 3   # more segments than workers keeps the pool busy to the end
+ANALYSIS_MIN_SEGMENT_SEC = 60
+ANALYSIS_WARMUP_SEC = 2.0       # decoded before each segment so tracks straddling the cut aren't recounted
+ANALYSIS_STRIDE = 2             # infer every Nth frame
+ANALYSIS_BATCH_SIZE = 8
+
+# Face matching
+FACE_MATCH_TOLERANCE = 0.5      # max encoding distance that counts as a match
+FACE_INDEX_MODE = 'auto'        # 'exact', 'ivf', or 'auto' (ivf above the threshold)
+FACE_INDEX_IVF_THRESHOLD = 100000
+FACE_INDEX_IVF_PROBES = 8       # clusters searched per query in ivf mode
+FACE_DETECTION_MAX_SIDE = 800    # images are downscaled to this before face_locations
+FACE_UPLOAD_MAX_BYTES = 20 * 1024 * 1024   # face uploads up to this size stay in memory
+FACE_CACHE_WARM_TIMEOUT = 30    # seconds a search waits for the startup load
+FACE_CACHE_CHECK_INTERVAL = 1.0 # seconds between faces_version checks
+
+# Live face recognition on camera streams
+LIVE_FACE_RECOGNITION = True
+FACE_STREAM_DETECT_EVERY = 5    # run face_locations on every Nth inferred frame
+FACE_STREAM_MAX_SIDE = 480      # live frames are downscaled to this for detection
+FACE_STREAM_REENCODE_EVERY = 10 # refresh a track's identity every K detections
+FACE_TRACK_IOU = 0.3
+FACE_TRACK_TTL = 2.0            # seconds a face track survives unseen
+FACE_LOG_WINDOW = 60            # seconds between face_detections rows per person/camera
+
+# Camera streams
+DEFAULT_CAMERA_ID = 'default'
+RECONNECT_BACKOFF_MIN = 1.0     # seconds before first reconnect attempt
+RECONNECT_BACKOFF_MAX = 30.0
+FRAME_BUFFER_SIZE = 4           # captured frames kept per camera (oldest dropped)
+
+# Motion gating - skip the model while the scene is static
+MOTION_GATE_ENABLED = True
+MOTION_GATE_WIDTH = 160         # thumbnail width used for frame differencing
+MOTION_PIXEL_DELTA = 25         # grey-level change that marks a pixel as moved
+MOTION_THRESHOLD = 0.004        # fraction of moved pixels that counts as motion
+INFERENCE_STRIDE = 1            # only consider every Nth frame for inference
+MOTION_MAX_SKIP = 50            # force an inference after this many skipped frames
+
+# Object tracking / line counting
+COUNT_EXCLUDE_CLASSES = {'person'}  # tracked but never booked into inventory
+
+# Person tracker
+PERSON_SEGMENT_GAP = 3.0        # seconds unseen before a stay on a camera is closed
+PERSON_SEGMENT_FLUSH = 30.0     # how often an open segment's end_at is persisted
+PERSON_REID_WINDOW = 30.0       # seconds a lost person can be re-identified on another camera
+PERSON_REID_MIN_SIMILARITY = 0.8
+PERSON_HIST_REFRESH = 25        # observations between appearance refreshes
+
+# Plate recognition (ANPR) on truck tracks
+ANPR_ENABLED = True
+ANPR_CLASSES = {'truck'}        # normalized class names whose tracks get their plate read
+ANPR_PLATE_REGION = (0.1, 0.55, 0.9, 1.0)   # where the plate sits inside the truck box (x1, y1, x2, y2 fractions)
+ANPR_MIN_WIDTH = 120            # px - narrower truck boxes are too far away to read
+ANPR_GOOD_WIDTH = 240           # plate-crop width that gets full quality credit
+ANPR_SETTLE_FRAMES = 5          # observations before a truck that crossed a line may be read while still in view
+ANPR_TRACK_GONE = 1.5           # seconds unseen before a truck counts as gone
+ANPR_MIN_CONFIDENCE = 0.5
+ANPR_PLATE_LENGTH = (4, 12)
+ANPR_DEDUP_WINDOW = 300         # seconds the same plate isn't logged again
+ANPR_QUEUE_SIZE = 32
+
+# Snapshots / MJPEG output
+SNAPSHOT_MAX_VARIANTS = 8       # resized / re-encoded variants kept per frame
+STREAM_JPEG_QUALITY = 80
+STREAM_ADAPTIVE_QUALITY = (70, 55, 40, 30)   # step-down levels under backpressure
+STREAM_ADAPTIVE_FPS_STEPS = 3   # after the lowest quality, halve fps this many times
+STREAM_ADAPTIVE_BASE_FPS = 25.0
+STREAM_MIN_FPS = 2.0
+STREAM_BACKPRESSURE_RATIO = 0.5 # blocked for more than this share of a frame interval -> step down
+STREAM_RECOVER_FRAMES = 50      # unblocked frames before stepping back up
+
+# Detection history (per camera, fixed memory)
+HISTORY_FRAMES = 3000           # inferred frames kept - about 2 minutes at 25 fps
+HISTORY_BOXES = 30000           # boxes kept across those frames
+HISTORY_QUERY_LIMIT = 500       # frames returned per history request
+HISTORY_FRAME_DTYPE = np.dtype([('seq', np.int64), ('ts', np.float64), ('box_start', np.int64), ('count', np.int32)])
+HISTORY_BOX_DTYPE = np.dtype([('bbox', np.int32, (4,)), ('score', np.float32), ('cls', np.int16), ('track_id', np.int32)])
+
+# Live events (SSE)
+EVENT_TOPICS = {'detections', 'counts', 'inventory', 'camera'}
+CAMERA_TOPICS = {'detections', 'counts', 'camera'}   # filterable by ?camera_id=
+EVENT_MIN_INTERVAL = 0.25       # default per-client coalescing window (seconds)
+EVENT_KEEPALIVE = 15.0
+EVENT_RETRY_MS = 3000
+
+# Model registry
+MODEL_MEMORY_BUDGET_MB = 1024   # resident weights before least recently used models are dropped
+MODEL_RETRY_BACKOFF = 60        # seconds a failed load is remembered before get() tries again
+
+# Inference backend
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'onnx')   # 'onnx' (falls back to torch) | 'torch'
+PARITY_RUNS = 5                 # timed calls per backend in the switch-model comparison
+
+# Inference scheduler
+INFER_SIZE_LIMITS = (160, 1280) # accepted per-camera infer_size range
+INFERENCE_MAX_BATCH = 4         # frames per model call
+INFERENCE_MAX_WAIT_MS = 15      # how long to hold a partial batch for more streams
+
 # Global state
-camera = None
-camera_lock = threading.Lock()
-latest_detections = []
-face_encodings_cache = {}
 
 # Session counters
 sugar_bag_count = 0
 last_sugar_update = 0
+counters_lock = threading.Lock()
 
-# Load YOLO models
-# Global dictionary to hold all loaded models
-loaded_models = {}
 active_model_name = 'best_dec20'  # Default to best_dec20 if available, else first available
 
 # Define available models
@@ -85,35 +197,395 @@ AVAILABLE_MODELS = {
     'sugar_bag_improved': 'sugar_bag_improved.pt'
 }
 
-if YOLO_AVAILABLE:
-    print("Loading YOLO models...")
-    for model_key, model_file in AVAILABLE_MODELS.items():
+# Models are known from AVAILABLE_MODELS + the files on disk; weights load on
+# first use (or /api/v1/models/switch) and stay in an LRU within the budget
+def process_rss_mb():
+    """Resident set size of this process in MB (Linux), or None."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class ModelRegistry:
+    """Lazy, LRU-bounded holder for the YOLO models.
+
+    get() loads a model on first use; concurrent callers wait for the one
+    load. After each load, least recently used models are dropped until the
+    resident weights fit MODEL_MEMORY_BUDGET_MB - the active model is never
+    evicted. A failed load is remembered for MODEL_RETRY_BACKOFF seconds (or
+    until get(name, retry=True)) so per-frame callers don't retry it."""
+    REFERENCE_SUFFIX = '@torch'     # "<name>@torch": PyTorch copy of an ONNX model, for parity checks
+
+    def __init__(self, specs):
+        self.specs = {name: MODEL_DIR / filename for name, filename in specs.items()}
+        self.models = OrderedDict()
+        self.info = {}
+        self.lock = threading.Lock()
+        self.loading = {}
+        self.errors = {}
+        self.failed = {}        # name -> time of the last failed load
+        self.evictions = 0
+
+    def available(self):
+        if not (YOLO_AVAILABLE or ONNX_AVAILABLE):
+            return []
+        return [name for name, path in self.specs.items() if path.exists()]
+
+    def __contains__(self, name):
+        return name in self.models or name in self.available()
+
+    def loaded(self):
+        return list(self.models)
+
+    def _path(self, name):
+        return self.specs.get(name.partition('@')[0])
+
+    def get(self, name, retry=False):
+        """The model, loading it if needed; None if unknown or it failed to load."""
+        with self.lock:
+            if name in self.models:
+                self.models.move_to_end(name)
+                self.info[name]['uses'] += 1
+                return self.models[name]
+            if self._path(name) is None or not (YOLO_AVAILABLE or ONNX_AVAILABLE):
+                return None
+            if retry:
+                self.failed.pop(name, None)
+            elif time.time() - self.failed.get(name, 0) < MODEL_RETRY_BACKOFF:
+                return None
+            event = self.loading.get(name)
+            owner = event is None
+            if owner:
+                event = self.loading[name] = threading.Event()
+        if not owner:
+            event.wait()
+            return self.models.get(name)
         try:
-            model_path = MODEL_DIR / model_file
-            if model_path.exists():
-                loaded_models[model_key] = YOLO(str(model_path), task='detect')
-                print(f"✅ Model loaded: {model_key} ({model_path})")
-            else:
-                print(f"⚠️ Model file not found: {model_file} (skipping)")
-        except Exception as e:
-            print(f"❌ Failed to load {model_key}: {e}")
+            return self._load(name)
+        finally:
+            with self.lock:
+                self.loading.pop(name, None)
+            event.set()
 
-    if loaded_models:
-        # Set default active model
-        if active_model_name not in loaded_models:
-            active_model_name = list(loaded_models.keys())[0]
-        print(f"📍 Active model: {active_model_name}")
-    else:
-        print("⚠️ No models loaded!")
+    def _load(self, name):
+        path = self._path(name)
+        rss_before = process_rss_mb()
+        t0 = time.time()
+        model = onnx_error = None
+        reference = name.endswith(self.REFERENCE_SUFFIX)
+        if INFERENCE_BACKEND == 'onnx' and ONNX_AVAILABLE and not reference:
+            try:
+                model = OnnxDetector(name, path)
+            except Exception as e:
+                onnx_error = str(e)
+                print(f"⚠️ ONNX backend unavailable for {name}, falling back to PyTorch: {e}")
+        if model is None:
+            try:
+                if not YOLO_AVAILABLE:
+                    raise RuntimeError(onnx_error or 'ultralytics not installed')
+                model = YOLO(str(path), task='detect')
+            except Exception as e:
+                with self.lock:
+                    self.errors[name] = str(e)
+                    self.failed[name] = time.time()
+                print(f"❌ Failed to load {name} (not retried for {MODEL_RETRY_BACKOFF}s): {e}")
+                return None
+        backend = getattr(model, 'backend', 'torch')
+        load_ms = (time.time() - t0) * 1000
+        rss_after = process_rss_mb()
+        with self.lock:
+            self.models[name] = model
+            self.errors.pop(name, None)
+            self.failed.pop(name, None)
+            self.info[name] = {
+                'load_ms': round(load_ms, 1),
+                'memory_mb': round(self._weights_mb(model, path), 1),
+                'backend': backend,
+                'provider': getattr(model, 'provider', None),
+                'onnx_error': onnx_error,
+                'rss_delta_mb': round(rss_after - rss_before, 1) if rss_before and rss_after else None,
+                'loaded_at': time.time(),
+                'uses': 1,
+                'loads': self.info.get(name, {}).get('loads', 0) + 1
+            }
+            self._evict()
+        print(f"✅ Model loaded: {name} ({path}, {backend}) in {load_ms:.0f} ms")
+        return model
+
+    @staticmethod
+    def _weights_mb(model, path):
+        if isinstance(model, OnnxDetector):
+            return model.path.stat().st_size / 1024 ** 2
+        try:
+            tensors = list(model.model.parameters()) + list(model.model.buffers())
+            return sum(t.numel() * t.element_size() for t in tensors) / 1024 ** 2
+        except Exception:
+            return path.stat().st_size / 1024 ** 2
+
+    def _evict(self):
+        def resident():
+            return sum(self.info[n]['memory_mb'] for n in self.models)
+        while resident() > MODEL_MEMORY_BUDGET_MB:
+            victim = next((n for n in self.models if n != active_model_name), None)
+            if victim is None or victim == next(reversed(self.models)):
+                break
+            del self.models[victim]
+            self.evictions += 1
+            print(f"♻️ Evicted model {victim} (memory budget {MODEL_MEMORY_BUDGET_MB} MB)")
+
+    def prepare(self, name):
+        """(backend, weights file) a model should run from, exporting the ONNX
+        copy here if needed - analysis workers get this instead of each
+        resolving (and exporting) the model on their own."""
+        path = self.specs[name]
+        if INFERENCE_BACKEND == 'onnx' and ONNX_AVAILABLE:
+            try:
+                return 'onnx', str(OnnxDetector.export(path))
+            except Exception as e:
+                print(f"⚠️ ONNX export failed for {name}, using PyTorch: {e}")
+        return 'torch', str(path)
+
+    def reference(self, name):
+        """PyTorch copy of a model for backend_parity - held, budget-counted
+        and evicted like any other entry."""
+        return self.get(name + self.REFERENCE_SUFFIX) if YOLO_AVAILABLE else None
+
+    def preload(self, name):
+        """Load in the background so the first frame doesn't pay for it."""
+        threading.Thread(target=self.get, args=(name,), daemon=True, name=f'preload-{name}').start()
+
+    def _entries(self):
+        """(name, weights) for every model, plus any parity references that
+        are resident or failed - they count against the budget too."""
+        references = sorted(n for n in set(self.models) | set(self.errors) if n.endswith(self.REFERENCE_SUFFIX))
+        return list(self.specs.items()) + [(n, self._path(n)) for n in references]
+
+    def stats(self):
+        with self.lock:
+            loaded = set(self.models)
+            return {
+                'budget_mb': MODEL_MEMORY_BUDGET_MB,
+                'resident_mb': round(sum(self.info[n]['memory_mb'] for n in loaded), 1),
+                'process_rss_mb': round(process_rss_mb() or 0, 1),
+                'evictions': self.evictions,
+                'models': {
+                    name: {
+                        'file_mb': round(path.stat().st_size / 1024 ** 2, 1) if path and path.exists() else None,
+                        'loaded': name in loaded,
+                        'loading': name in self.loading,
+                        'error': self.errors.get(name),
+                        **self.info.get(name, {})
+                    } for name, path in self._entries()
+                }
+            }
+
+
+model_registry = ModelRegistry(AVAILABLE_MODELS)
+if model_registry.available():
+    if active_model_name not in model_registry.available():
+        active_model_name = model_registry.available()[0]
+    print(f"📍 Active model: {active_model_name} ({len(model_registry.available())} available, loaded on demand)")
+else:
+    print("⚠️ No models available!")
 
 
 # ===== DATABASE =====
-def get_db():
-    conn = sqlite3.connect(DATABASE)
+def _connect():
+    conn = sqlite3.connect(DATABASE, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-16000')
+    conn.execute('PRAGMA mmap_size=134217728')
     return conn
 
 
+class PooledConnection:
+    """sqlite3 connection borrowed from the pool; close() hands it back."""
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            _db_pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+# Idle connections, most recently used first. Werkzeug runs each request on
+# a fresh thread, so connections are handed to one thread at a time rather
+# than pinned to a thread for life.
+_db_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+
+
+def get_db():
+    try:
+        conn = _db_pool.get_nowait()
+    except queue.Empty:
+        conn = _connect()
+    return PooledConnection(conn)
+
+
+class DBWriter:
+    """Background writer. Detection inserts and inventory deltas are queued and
+    committed together every DB_WRITE_FLUSH_MS, so a burst of edge-counter
+    posts becomes one transaction instead of one fsync per request."""
+    def __init__(self, flush_ms=DB_WRITE_FLUSH_MS, max_batch=DB_WRITE_MAX_BATCH):
+        self.flush_ms = flush_ms
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.thread = None
+        self.start_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.errors = 0
+        self.write_latency_ms = deque(maxlen=1000)
+        self.commit_ms = deque(maxlen=500)
+
+    def _put(self, item):
+        if self.thread is None:
+            with self.start_lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, daemon=True)
+                    self.thread.start()
+        self.queue.put(item)
+
+    def execute(self, sql, params=()):
+        self._put(('sql', time.time(), (sql, params)))
+
+    def log_detection(self, product, direction='IN', confidence=1.0, camera_id=None,
+                      quantity=1, detected_at=None):
+        """Queue a detection row plus the matching inventory IN/OUT delta."""
+        self._put(('detection', time.time(),
+                   (product, direction, confidence, camera_id, quantity, detected_at)))
+
+    def flush(self, timeout=5.0):
+        """Block until everything queued so far is committed."""
+        done = threading.Event()
+        self._put(('barrier', time.time(), done))
+        return done.wait(timeout)
+
+    def _run(self):
+        conn = _connect()
+        last_prune = time.time()
+        while True:
+            if time.time() - last_prune > 3600:
+                with conn:
+                    prune_rollups(conn)
+                last_prune = time.time()
+            try:
+                batch = [self.queue.get(timeout=600)]
+            except queue.Empty:
+                continue
+            deadline = time.time() + self.flush_ms / 1000
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._commit(conn, batch)
+
+    def _apply(self, conn, batch):
+        statements = []
+        detection_rows = []
+        deltas = {}
+        for kind, _, payload in batch:
+            if kind == 'sql':
+                statements.append(payload)
+            elif kind == 'detection':
+                product, direction, confidence, camera_id, quantity, detected_at = payload
+                detection_rows.append((str(uuid.uuid4()), product, confidence, direction,
+                                       camera_id, detected_at))
+                d = deltas.setdefault(product, [0, 0])
+                d[0 if direction == 'IN' else 1] += quantity
+
+        for sql, params in statements:
+            conn.execute(sql, params)
+        if detection_rows:
+            conn.executemany('INSERT INTO detections (id, type, confidence, direction, camera_id, detected_at) '
+                             'VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))', detection_rows)
+        if deltas:
+            conn.executemany('UPDATE inventory SET count_in = count_in + ?, count_out = count_out + ?, '
+                             'current_stock = current_stock + ? - ?, last_updated = CURRENT_TIMESTAMP '
+                             'WHERE product_name = ?',
+                             [(i, o, i, o, product) for product, (i, o) in deltas.items()])
+
+    def _commit(self, conn, batch):
+        writes = [item for item in batch if item[0] != 'barrier']
+        t0 = time.time()
+        if writes:
+            try:
+                with conn:
+                    self._apply(conn, writes)
+            except Exception as e:
+                # Retry one by one so a single bad row doesn't lose the batch
+                print(f"⚠️ Batched write failed ({e}), retrying individually")
+                for item in writes:
+                    try:
+                        with conn:
+                            self._apply(conn, [item])
+                    except Exception as e2:
+                        self.errors += 1
+                        print(f"❌ DB write dropped: {e2}")
+        done = time.time()
+        if any(item[0] == 'detection' for item in writes) and event_bus.wants('inventory'):
+            # One snapshot per committed batch, however many clients listen
+            event_bus.publish('inventory', None, dashboard_snapshot(conn))
+        if writes:
+            self.commit_ms.append((done - t0) * 1000)
+            for _, enqueued_at, _ in writes:
+                self.write_latency_ms.append((done - enqueued_at) * 1000)
+            self.batches += 1
+            self.items += len(writes)
+        for kind, _, payload in batch:
+            if kind == 'barrier':
+                payload.set()
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue.qsize(),
+            'batches': self.batches,
+            'items': self.items,
+            'avg_batch_size': round(self.items / self.batches, 2) if self.batches else 0,
+            'errors': self.errors,
+            'write_latency_ms': latency_summary(list(self.write_latency_ms)),
+            'commit_ms': latency_summary(list(self.commit_ms))
+        }
+
+
+db_writer = DBWriter()
+
+
+ROLLUP_BUCKET_FORMATS = {'minute': '%Y-%m-%d %H:%M', 'hour': '%Y-%m-%d %H:00'}
+
+
+def prune_rollups(conn):
+    """Drop minute buckets past their retention; hour buckets are kept."""
+    conn.execute("DELETE FROM detection_rollups WHERE granularity = 'minute' AND bucket < strftime('%Y-%m-%d %H:%M', 'now', ?)",
+                 (f'-{ROLLUP_MINUTE_RETENTION_DAYS} days',))
+
+
 def init_db():
     """Initialize SQLite database with all tables."""
     conn = get_db()
@@ -139,6 +611,13 @@ def init_db():
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )''')
     
+    # Columns added to cameras after the first release
+    for column in ('count_lines TEXT', 'roi TEXT', 'infer_size INTEGER'):
+        try:
+            c.execute(f'ALTER TABLE cameras ADD COLUMN {column}')
+        except sqlite3.OperationalError:
+            pass
+    
     # Product types table
     c.execute('''CREATE TABLE IF NOT EXISTS product_types (
         id TEXT PRIMARY KEY,
@@ -224,6 +703,115 @@ def init_db():
         FOREIGN KEY (face_id) REFERENCES faces(id)
     )''')
     
+    # Person tracker - one row per person, one per continuous stay on a camera
+    c.execute('''CREATE TABLE IF NOT EXISTS persons (
+        id TEXT PRIMARY KEY,
+        name TEXT,
+        face_id TEXT,
+        first_seen TIMESTAMP,
+        last_seen TIMESTAMP,
+        last_camera TEXT,
+        appearances INTEGER DEFAULT 0
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS person_segments (
+        id TEXT PRIMARY KEY,
+        person_id TEXT NOT NULL,
+        camera_id TEXT,
+        start_at TIMESTAMP NOT NULL,
+        end_at TIMESTAMP NOT NULL
+    )''')
+    
+    # Background jobs (compression, ...) - the queue itself, so it survives restarts
+    c.execute('''CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        params TEXT,
+        input_path TEXT,
+        output_path TEXT,
+        original_filename TEXT,
+        original_size INTEGER,
+        output_size INTEGER,
+        progress REAL DEFAULT 0,
+        eta_seconds REAL,
+        result TEXT,
+        error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP
+    )''')
+    
+    # Chunked uploads - written in place, sha256 kept for de-duplication
+    c.execute('''CREATE TABLE IF NOT EXISTS uploads (
+        id TEXT PRIMARY KEY,
+        filename TEXT,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        received INTEGER DEFAULT 0,
+        sha256 TEXT,
+        status TEXT NOT NULL DEFAULT 'uploading',
+        duplicate_of TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        completed_at TIMESTAMP
+    )''')
+    
+    # Meta counters (faces_version is bumped on every faces write so the
+    # in-memory face cache can tell when it is stale)
+    c.execute('''CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER DEFAULT 0
+    )''')
+    c.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('faces_version', 0)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_faces_version_{event.lower()} AFTER {event} ON faces
+        BEGIN
+            UPDATE meta SET value = value + 1 WHERE key = 'faces_version';
+        END''')
+    
+    # Indexes for the time-ordered listings and per-type / per-camera filters
+    c.execute('CREATE INDEX IF NOT EXISTS idx_detections_detected_at ON detections(detected_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_detections_type_time ON detections(type, detected_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_detections_camera_time ON detections(camera_id, detected_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_trucks_detected_at ON trucks(detected_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_face_detections_detected_at ON face_detections(detected_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_person_segments_person_time ON person_segments(person_id, start_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_persons_last_seen ON persons(last_seen)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_uploads_sha256 ON uploads(sha256)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_kind_created ON jobs(kind, created_at)')
+    
+    # Detection rollups - per-minute and per-hour counts, kept current by a
+    # trigger so analytics never have to scan the detections table
+    c.execute('''CREATE TABLE IF NOT EXISTS detection_rollups (
+        granularity TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        type TEXT NOT NULL,
+        direction TEXT NOT NULL DEFAULT '',
+        camera_id TEXT NOT NULL DEFAULT '',
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (granularity, bucket, type, direction, camera_id)
+    ) WITHOUT ROWID''')
+    
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_detections_rollup AFTER INSERT ON detections
+    BEGIN
+        INSERT INTO detection_rollups (granularity, bucket, type, direction, camera_id, count)
+        VALUES ('minute', strftime('%Y-%m-%d %H:%M', NEW.detected_at), NEW.type,
+                COALESCE(NEW.direction, ''), COALESCE(NEW.camera_id, ''), 1)
+        ON CONFLICT (granularity, bucket, type, direction, camera_id) DO UPDATE SET count = count + 1;
+        INSERT INTO detection_rollups (granularity, bucket, type, direction, camera_id, count)
+        VALUES ('hour', strftime('%Y-%m-%d %H:00', NEW.detected_at), NEW.type,
+                COALESCE(NEW.direction, ''), COALESCE(NEW.camera_id, ''), 1)
+        ON CONFLICT (granularity, bucket, type, direction, camera_id) DO UPDATE SET count = count + 1;
+    END''')
+    
+    # One-off backfill for databases that predate the rollup table
+    if not c.execute('SELECT 1 FROM detection_rollups LIMIT 1').fetchone():
+        for granularity, fmt in ROLLUP_BUCKET_FORMATS.items():
+            c.execute('''INSERT INTO detection_rollups (granularity, bucket, type, direction, camera_id, count)
+                SELECT ?, strftime(?, detected_at), type, COALESCE(direction, ''), COALESCE(camera_id, ''), COUNT(*)
+                FROM detections GROUP BY 2, 3, 4, 5''', (granularity, fmt))
+    prune_rollups(conn)
+    
     # Create default admin user
     admin_id = str(uuid.uuid4())
     try:
@@ -273,6 +861,9 @@ def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         token = request.headers.get('Authorization', '').replace('Bearer ', '')
+        if not token:
+            # EventSource / <img> can't set headers
+            token = request.args.get('token', '')
         if not token:
             return jsonify({'error': 'Token required'}), 401
         try:
@@ -338,7 +929,11 @@ def get_cameras():
     conn = get_db()
     cameras = conn.execute('SELECT * FROM cameras').fetchall()
     conn.close()
-    return jsonify([dict(c) for c in cameras])
+    result = []
+    for c in cameras:
+        pipe = camera_manager.get(c['id'])
+        result.append({**dict(c), 'stream_status': pipe.camera.status if pipe else 'stopped'})
+    return jsonify(result)
 
 
 @app.route('/api/v1/cameras', methods=['POST'])
@@ -359,6 +954,7 @@ def create_camera():
 @app.route('/api/v1/cameras/<camera_id>', methods=['DELETE'])
 @token_required
 def delete_camera(camera_id):
+    camera_manager.stop(camera_id)
     conn = get_db()
     conn.execute('DELETE FROM cameras WHERE id = ?', (camera_id,))
     conn.commit()
@@ -390,24 +986,24 @@ def get_inventory():
 @app.route('/api/v1/inventory/movement', methods=['POST'])
 @token_required
 def log_movement():
-    data = request.json
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'JSON object required'}), 400
     product = data.get('product_name') or data.get('class_name')
     direction = data.get('direction', 'IN')
-    quantity = data.get('quantity', 1)
-    
-    conn = get_db()
-    if direction == 'IN':
-        conn.execute('UPDATE inventory SET count_in = count_in + ?, current_stock = current_stock + ?, last_updated = CURRENT_TIMESTAMP WHERE product_name = ?',
-                     (quantity, quantity, product))
-    else:
-        conn.execute('UPDATE inventory SET count_out = count_out + ?, current_stock = current_stock - ?, last_updated = CURRENT_TIMESTAMP WHERE product_name = ?',
-                     (quantity, quantity, product))
-    
-    conn.execute('INSERT INTO detections (id, type, confidence, direction) VALUES (?, ?, ?, ?)',
-                 (str(uuid.uuid4()), product, 1.0, direction))
+    if not product or not isinstance(product, str):
+        return jsonify({'error': 'product_name required'}), 400
+    if direction not in ('IN', 'OUT'):
+        return jsonify({'error': 'direction must be IN or OUT'}), 400
+    # Validate here - the writer thread applies it later, after we've answered
+    try:
+        quantity = int(data.get('quantity', 1))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'quantity must be an integer'}), 400
+    if quantity <= 0:
+        return jsonify({'error': 'quantity must be positive'}), 400
     
-    conn.commit()
-    conn.close()
+    db_writer.log_detection(product, direction, quantity=quantity)
     
     return jsonify({'status': 'logged'})
 
@@ -427,27 +1023,77 @@ def get_product_types():
 @token_required
 def get_dashboard_analytics():
     conn = get_db()
-    
-    inv = conn.execute('SELECT SUM(count_in) as total_in, SUM(count_out) as total_out, SUM(current_stock) as total_stock FROM inventory').fetchone()
-    det_count = conn.execute('SELECT COUNT(*) as count FROM detections WHERE date(detected_at) = date("now")').fetchone()
-    inventory = conn.execute('SELECT product_name, count_in, count_out, current_stock FROM inventory').fetchall()
-    
+    snapshot = dashboard_snapshot(conn)
     conn.close()
     
     return jsonify({
-        'total_in': inv['total_in'] or 0,
-        'total_out': inv['total_out'] or 0,
-        'total_stock': inv['total_stock'] or 0,
-        'detections_today': det_count['count'] or 0,
-        'inventory': [dict(i) for i in inventory],
-        'camera_active': camera is not None and getattr(camera, 'running', False),
+        **snapshot,
+        'camera_active': camera_manager.any_running(),
         'models_loaded': {
-            'count': len(loaded_models),
+            'count': len(model_registry.loaded()),
             'active': active_model_name
         }
     })
 
 
+@app.route('/api/v1/analytics/summary')
+@token_required
+def get_analytics_summary():
+    """Totals by type, direction and day over the last N days (hour rollups)"""
+    days = max(1, min(request.args.get('days', 7, type=int), 366))
+    conn = get_db()
+    rows = conn.execute('''SELECT type, direction, substr(bucket, 1, 10) as day, SUM(count) as count
+        FROM detection_rollups WHERE granularity = 'hour' AND bucket >= strftime('%Y-%m-%d 00:00', 'now', ?)
+        GROUP BY type, direction, day''', (f'-{days - 1} days',)).fetchall()
+    conn.close()
+    
+    by_type, by_date = {}, {}
+    total = total_in = total_out = 0
+    for r in rows:
+        total += r['count']
+        by_type[r['type']] = by_type.get(r['type'], 0) + r['count']
+        by_date[r['day']] = by_date.get(r['day'], 0) + r['count']
+        if r['direction'] == 'IN':
+            total_in += r['count']
+        elif r['direction'] == 'OUT':
+            total_out += r['count']
+    
+    return jsonify({
+        'days': days,
+        'total': total,
+        'in': total_in,
+        'out': total_out,
+        'by_type': by_type,
+        'by_date': [{'date': d, 'count': by_date[d]} for d in sorted(by_date, reverse=True)]
+    })
+
+
+@app.route('/api/v1/analytics/timeseries')
+@token_required
+def get_analytics_timeseries():
+    """Bucketed detection counts from the rollup table.
+    ?granularity=minute|hour&hours=24&type=&camera_id=&direction="""
+    granularity = request.args.get('granularity', 'hour')
+    if granularity not in ROLLUP_BUCKET_FORMATS:
+        return jsonify({'error': 'granularity must be minute or hour'}), 400
+    hours = max(1, min(request.args.get('hours', 24, type=int), 24 * 366))
+    
+    sql = '''SELECT bucket, SUM(count) as count FROM detection_rollups
+        WHERE granularity = ? AND bucket >= strftime(?, 'now', ?)'''
+    params = [granularity, ROLLUP_BUCKET_FORMATS[granularity], f'-{hours} hours']
+    for field in ('type', 'camera_id', 'direction'):
+        value = request.args.get(field)
+        if value is not None:
+            sql += f' AND {field} = ?'
+            params.append(value)
+    sql += ' GROUP BY bucket ORDER BY bucket'
+    
+    conn = get_db()
+    rows = conn.execute(sql, params).fetchall()
+    conn.close()
+    return jsonify({'granularity': granularity, 'buckets': [dict(r) for r in rows]})
+
+
 # ===== DETECTIONS =====
 @app.route('/api/v1/detections')
 @token_required
@@ -545,6 +1191,12 @@ def create_truck_entry():
     return jsonify({'id': truck_id, **data}), 201
 
 
+@app.route('/api/v1/trucks/anpr/stats')
+def get_anpr_stats():
+    """OCR engine, call rate / latency and how many plates were logged"""
+    return jsonify(plate_recognizer.stats())
+
+
 @app.route('/api/v1/trucks/reset', methods=['POST'])
 @token_required
 def reset_trucks():
@@ -556,6 +1208,318 @@ def reset_trucks():
 
 
 # ===== FACES =====
+class FaceIndex:
+    """All registered 128-d encodings in one contiguous float32 matrix with
+    parallel id/name arrays. Matching is a single matrix product for every
+    query face at once; above FACE_INDEX_IVF_THRESHOLD faces (mode 'auto') an
+    IVF partitioning limits each query to the closest clusters."""
+    def __init__(self, dim=128, mode=FACE_INDEX_MODE):
+        self.dim = dim
+        self.mode = mode
+        self.lock = threading.RLock()
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.sq_norms = np.empty(0, dtype=np.float32)
+        self.ids = []
+        self.names = []
+        self.rows = {}
+        self.count = 0
+        # IVF state - centroids plus the cluster of every row
+        self.centroids = None
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.trained_count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _reserve(self, n):
+        capacity = self.vectors.shape[0]
+        if n <= capacity:
+            return
+        new_capacity = max(n, capacity * 2, 1024)
+        vectors = np.empty((new_capacity, self.dim), dtype=np.float32)
+        vectors[:self.count] = self.vectors[:self.count]
+        sq_norms = np.empty(new_capacity, dtype=np.float32)
+        sq_norms[:self.count] = self.sq_norms[:self.count]
+        assignments = np.zeros(new_capacity, dtype=np.int32)
+        assignments[:self.count] = self.assignments[:self.count]
+        self.vectors, self.sq_norms, self.assignments = vectors, sq_norms, assignments
+
+    def add(self, face_id, name, encoding):
+        self.add_many([(face_id, name, encoding)])
+
+    def add_many(self, items):
+        with self.lock:
+            self._reserve(self.count + len(items))
+            for face_id, name, encoding in items:
+                vec = np.asarray(encoding, dtype=np.float32).reshape(self.dim)
+                row = self.rows.get(face_id)
+                if row is None:
+                    row = self.count
+                    self.count += 1
+                    self.rows[face_id] = row
+                    self.ids.append(face_id)
+                    self.names.append(name)
+                else:
+                    self.names[row] = name
+                self.vectors[row] = vec
+                self.sq_norms[row] = float(vec @ vec)
+                if self.centroids is not None:
+                    self.assignments[row] = self._nearest_centroids(vec[None, :], 1)[0, 0]
+            self._maybe_train()
+
+    def remove(self, face_id):
+        with self.lock:
+            row = self.rows.pop(face_id, None)
+            if row is None:
+                return False
+            last = self.count - 1
+            if row != last:
+                # Move the last row into the hole to keep the matrix dense
+                self.vectors[row] = self.vectors[last]
+                self.sq_norms[row] = self.sq_norms[last]
+                self.assignments[row] = self.assignments[last]
+                self.ids[row] = self.ids[last]
+                self.names[row] = self.names[last]
+                self.rows[self.ids[row]] = row
+            self.ids.pop()
+            self.names.pop()
+            self.count = last
+            return True
+
+    def clear(self):
+        with self.lock:
+            self.count = 0
+            self.ids, self.names, self.rows = [], [], {}
+            self.centroids = None
+            self.trained_count = 0
+
+    def _use_ivf(self):
+        if self.mode == 'ivf':
+            return True
+        return self.mode == 'auto' and self.count >= FACE_INDEX_IVF_THRESHOLD
+
+    def _maybe_train(self):
+        if not self._use_ivf():
+            self.centroids = None
+            return
+        # Retrain when the index has grown a lot since the last k-means
+        if self.centroids is None or self.count > 2 * self.trained_count:
+            self._train_ivf()
+
+    def _train_ivf(self, iterations=10):
+        n = self.count
+        nlist = max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(0)
+        sample = self.vectors[:n]
+        if n > 50 * nlist:
+            sample = sample[rng.choice(n, 50 * nlist, replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            d = (sample ** 2).sum(1)[:, None] + (centroids ** 2).sum(1)[None, :] - 2 * sample @ centroids.T
+            labels = d.argmin(1)
+            for c in range(nlist):
+                members = sample[labels == c]
+                if len(members):
+                    centroids[c] = members.mean(0)
+        self.centroids = centroids
+        self.assignments[:n] = self._nearest_centroids(self.vectors[:n], 1)[:, 0]
+        self.trained_count = n
+
+    def _nearest_centroids(self, queries, nprobe):
+        d = (queries ** 2).sum(1)[:, None] + (self.centroids ** 2).sum(1)[None, :] - 2 * queries @ self.centroids.T
+        nprobe = min(nprobe, len(self.centroids))
+        return np.argsort(d, axis=1)[:, :nprobe]
+
+    def _distances(self, queries, rows=None):
+        if rows is None:
+            vectors, sq_norms = self.vectors[:self.count], self.sq_norms[:self.count]
+        else:
+            vectors, sq_norms = self.vectors[rows], self.sq_norms[rows]
+        d2 = (queries ** 2).sum(1)[:, None] + sq_norms[None, :] - 2 * queries @ vectors.T
+        return np.sqrt(np.maximum(d2, 0))
+
+    def search(self, encodings, k=1):
+        """Top-k (face_id, name, distance) per query encoding, nearest first."""
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        with self.lock:
+            if self.count == 0 or len(queries) == 0:
+                return [[] for _ in range(len(queries))]
+
+            if self.centroids is not None and self._use_ivf():
+                probes = self._nearest_centroids(queries, FACE_INDEX_IVF_PROBES)
+                assignments = self.assignments[:self.count]
+                results = []
+                for q, probe in zip(queries, probes):
+                    rows = np.flatnonzero(np.isin(assignments, probe))
+                    dist = self._distances(q[None, :], rows)[0]
+                    results.append(self._top_k(dist, k, rows))
+                return results
+
+            dist = self._distances(queries)
+            return [self._top_k(d, k) for d in dist]
+
+    def _top_k(self, dist, k, rows=None):
+        if len(dist) == 0:
+            return []
+        k = min(k, len(dist))
+        idx = np.argpartition(dist, k - 1)[:k] if k < len(dist) else np.arange(len(dist))
+        idx = idx[np.argsort(dist[idx])]
+        out = []
+        for i in idx:
+            row = int(rows[i]) if rows is not None else int(i)
+            out.append((self.ids[row], self.names[row], float(dist[i])))
+        return out
+
+    def stats(self):
+        return {
+            'faces': self.count,
+            'mode': 'ivf' if self.centroids is not None and self._use_ivf() else 'exact',
+            'clusters': 0 if self.centroids is None else len(self.centroids),
+            'memory_bytes': int(self.vectors.nbytes + self.sq_norms.nbytes)
+        }
+
+
+def faces_version(conn):
+    row = conn.execute("SELECT value FROM meta WHERE key = 'faces_version'").fetchone()
+    return row['value'] if row else 0
+
+
+class FaceCache:
+    """Owns the FaceIndex and keeps it in step with the faces table.
+
+    Loaded in a background thread at startup. Every write to faces bumps
+    meta.faces_version (via triggers); local registrations/deletes are applied
+    incrementally when they are the next version, anything else (another
+    process, a missed update) triggers a full reload.
+    """
+    def __init__(self):
+        self.index = FaceIndex()
+        self.lock = threading.RLock()
+        self.ready = threading.Event()
+        self.status = 'cold'
+        self.version = None
+        self.thread = None
+        self.last_check = 0.0
+        self.loads = 0
+        self.load_ms = 0.0
+        self.error = None
+
+    def start_warmup(self, check=False):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.status = 'warming' if self.status == 'cold' else self.status
+            self.thread = threading.Thread(target=self._warm, args=(check,), daemon=True)
+            self.thread.start()
+
+    def _warm(self, check=False):
+        try:
+            if check and self._unchanged():
+                return
+            self.reload()
+        except Exception as e:
+            self.status = 'error'
+            self.error = str(e)
+            print(f"❌ Face cache warm-up failed: {e}")
+        finally:
+            self.ready.set()
+
+    def reload(self):
+        """Rebuild the index from a consistent snapshot of the faces table."""
+        t0 = time.time()
+        while True:
+            conn = get_db()
+            try:
+                conn.execute('BEGIN')
+                version = faces_version(conn)
+                faces = conn.execute('SELECT id, name, encoding FROM faces').fetchall()
+                conn.execute('COMMIT')
+            finally:
+                conn.close()
+
+            index = FaceIndex()
+            index.add_many([(f['id'], f['name'], np.frombuffer(f['encoding'], dtype=np.float64))
+                            for f in faces if f['encoding']])
+            with self.lock:
+                # A write that landed while we were building bumps the version;
+                # go round again rather than publish a stale index
+                conn = get_db()
+                current = faces_version(conn)
+                conn.close()
+                if current != version:
+                    continue
+                self.index = index
+                self.version = version
+                self.status = 'warm'
+                self.error = None
+                self.loads += 1
+                self.load_ms = (time.time() - t0) * 1000
+                self.last_check = time.time()
+            print(f"✅ Face cache warm: {len(index)} faces (v{version}, {self.load_ms:.0f} ms)")
+            return len(index)
+
+    def _unchanged(self):
+        conn = get_db()
+        current = faces_version(conn)
+        conn.close()
+        self.last_check = time.time()
+        return current == self.version
+
+    def ensure_fresh(self, timeout=FACE_CACHE_WARM_TIMEOUT):
+        if not self.ready.is_set():
+            self.start_warmup()
+            self.ready.wait(timeout)
+        if time.time() - self.last_check < FACE_CACHE_CHECK_INTERVAL:
+            return
+        if not self._unchanged():
+            self.reload()
+
+    def refresh_async(self):
+        """ensure_fresh() for capture threads: the version check and any
+        rebuild run on the warm-up thread while readers keep the last index."""
+        if self.ready.is_set() and time.time() - self.last_check < FACE_CACHE_CHECK_INTERVAL:
+            return
+        self.last_check = time.time()
+        self.start_warmup(check=self.ready.is_set())
+
+    def on_added(self, face_id, name, encoding, new_version):
+        with self.lock:
+            if self.version is not None and new_version == self.version + 1:
+                self.index.add(face_id, name, encoding)
+                self.version = new_version
+            else:
+                self.last_check = 0.0
+
+    def on_removed(self, face_id, new_version):
+        with self.lock:
+            if self.version is not None and new_version == self.version + 1:
+                self.index.remove(face_id)
+                self.version = new_version
+            else:
+                self.last_check = 0.0
+
+    def search(self, encodings, k=1, wait=True):
+        """wait=False never blocks on the DB - see refresh_async()."""
+        if wait:
+            self.ensure_fresh()
+        else:
+            self.refresh_async()
+        return self.index.search(encodings, k)
+
+    def stats(self):
+        return {
+            'status': self.status,
+            'version': self.version,
+            'loads': self.loads,
+            'load_ms': round(self.load_ms, 1),
+            'error': self.error,
+            **self.index.stats()
+        }
+
+
+face_cache = FaceCache()
+
+
 @app.route('/api/v1/faces')
 @token_required
 def get_faces():
@@ -565,316 +1529,3139 @@ def get_faces():
     return jsonify([dict(f) for f in faces])
 
 
+class UploadRequest(Request):
+    """Keep small multipart uploads (face photos) in memory instead of letting
+    Werkzeug spool anything over 500KB to a temp file. Large uploads such as
+    video for compression still go to disk."""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= FACE_UPLOAD_MAX_BYTES:
+            return io.BytesIO()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+
+app.request_class = UploadRequest
+
+
+def read_upload_images():
+    """(filename, bytes) for every image in the request: 'image' / 'images'
+    form fields, or a raw image/* body."""
+    uploads = [f for key in ('image', 'images') for f in request.files.getlist(key)]
+    if uploads:
+        return [(f.filename or '', f.read()) for f in uploads]
+    if request.mimetype and request.mimetype.startswith('image/'):
+        return [('', request.get_data())]
+    return []
+
+
+def decode_image(data):
+    """Encoded image bytes -> RGB array, or None if it can't be decoded."""
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def find_faces(rgb, max_side=FACE_DETECTION_MAX_SIDE):
+    """Locate faces on a downscaled copy, then encode them at full resolution.
+    Returns (locations, encodings) with locations in full-image coordinates."""
+    h, w = rgb.shape[:2]
+    scale = min(1.0, max_side / max(h, w))
+    small = rgb if scale == 1.0 else cv2.resize(rgb, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    locations = []
+    for top, right, bottom, left in face_recognition.face_locations(small):
+        locations.append((min(h, int(top / scale)), min(w, int(right / scale)),
+                          min(h, int(bottom / scale)), max(0, int(left / scale))))
+    if not locations:
+        return [], []
+    return locations, face_recognition.face_encodings(rgb, locations)
+
+
+def match_faces(locations, encodings, top_k=1):
+    matches = face_cache.search(encodings, k=top_k) if encodings else []
+    
+    results = []
+    for face_loc, face_matches in zip(locations, matches):
+        if not face_matches:
+            results.append({
+                'name': 'Unknown',
+                'confidence': 0,
+                'bbox': list(face_loc)
+            })
+            continue
+        
+        face_id, name, distance = face_matches[0]
+        confidence = 1 - distance
+        result = {
+            'name': name if confidence > 1 - FACE_MATCH_TOLERANCE else 'Unknown',
+            'confidence': float(confidence),
+            'bbox': list(face_loc),
+            'matches': [{'face_id': fid, 'name': n, 'confidence': float(1 - d)}
+                        for fid, n, d in face_matches]
+        }
+        if confidence > 1 - FACE_MATCH_TOLERANCE:
+            result['face_id'] = face_id
+        results.append(result)
+    return results
+
+
+class FaceTrack:
+    def __init__(self, track_id, box):
+        self.id = track_id
+        self.box = box
+        self.face_id = None
+        self.name = 'Unknown'
+        self.confidence = 0.0
+        self.encoded = False
+        self.detections_since_encode = 0
+        self.last_seen = time.time()
+
+    def to_dict(self):
+        return {
+            'track_id': self.id,
+            'face_id': self.face_id,
+            'name': self.name,
+            'confidence': round(self.confidence, 3),
+            'bbox': [int(v) for v in self.box]
+        }
+
+
+class FaceRecognitionStage:
+    """Live face recognition for one camera.
+
+    face_locations runs on a downscaled frame every FACE_STREAM_DETECT_EVERY
+    inferred frames; faces are tied to tracks by IoU so the 128-d encoding is
+    only computed for new tracks and refreshed every FACE_STREAM_REENCODE_EVERY
+    detections. Sightings are written at most once per person per camera per
+    FACE_LOG_WINDOW seconds.
+    """
+    def __init__(self, camera_id):
+        self.camera_id = camera_id
+        self.tracks = []
+        self.next_id = 1
+        self.frame_index = 0
+        self.last_logged = {}
+        self.detect_runs = 0
+        self.encodings = 0
+        self.logged = 0
+        self.stage_ms = deque(maxlen=200)
+
+    def process(self, frame):
+        self.frame_index += 1
+        if self.frame_index % FACE_STREAM_DETECT_EVERY:
+            return self.tracks
+        t0 = time.time()
+
+        h, w = frame.shape[:2]
+        scale = min(1.0, FACE_STREAM_MAX_SIDE / max(h, w))
+        small = frame if scale == 1.0 else cv2.resize(frame, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        locations = face_recognition.face_locations(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+        self.detect_runs += 1
+        boxes = np.array([[l / scale, t / scale, r / scale, b / scale] for t, r, b, l in locations],
+                         dtype=np.float32).reshape(-1, 4)
+
+        now = time.time()
+        track_boxes = np.array([t.box for t in self.tracks], dtype=np.float32).reshape(-1, 4)
+        matched = greedy_match(box_iou(track_boxes, boxes), FACE_TRACK_IOU)
+        seen = set()
+        current = []
+        for ti, di in matched:
+            track = self.tracks[ti]
+            track.box = boxes[di]
+            track.last_seen = now
+            track.detections_since_encode += 1
+            seen.add(di)
+            current.append(track)
+        for di in range(len(boxes)):
+            if di not in seen:
+                track = FaceTrack(self.next_id, boxes[di])
+                track.last_seen = now
+                self.next_id += 1
+                current.append(track)
+        # Keep unmatched tracks briefly so a missed detection doesn't re-encode
+        for track in self.tracks:
+            if track not in current and now - track.last_seen < FACE_TRACK_TTL:
+                current.append(track)
+        self.tracks = current
+
+        visible = [t for t in self.tracks if t.last_seen == now]
+        to_encode = [t for t in visible
+                     if not t.encoded or t.detections_since_encode >= FACE_STREAM_REENCODE_EVERY]
+        if to_encode:
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            locs = [(int(t.box[1]), int(t.box[2]), int(t.box[3]), int(t.box[0])) for t in to_encode]
+            encodings = face_recognition.face_encodings(rgb, locs)
+            self.encodings += len(encodings)
+            for track, face_matches in zip(to_encode, face_cache.search(encodings, k=1, wait=False)):
+                track.encoded = True
+                track.detections_since_encode = 0
+                if face_matches and 1 - face_matches[0][2] > 1 - FACE_MATCH_TOLERANCE:
+                    track.face_id, track.name, distance = face_matches[0]
+                    track.confidence = 1 - distance
+                else:
+                    track.face_id, track.name = None, 'Unknown'
+                    track.confidence = max(0.0, 1 - face_matches[0][2]) if face_matches else 0.0
+
+        self._log(visible, now)
+        self.stage_ms.append((time.time() - t0) * 1000)
+        return self.tracks
+
+    def _log(self, tracks, now):
+        for track in tracks:
+            if not track.encoded:
+                continue
+            key = track.face_id or f'track-{track.id}'
+            if now - self.last_logged.get(key, 0) < FACE_LOG_WINDOW:
+                continue
+            self.last_logged[key] = now
+            db_writer.execute('INSERT INTO face_detections (id, face_id, name, confidence, camera_id) VALUES (?, ?, ?, ?, ?)',
+                              (str(uuid.uuid4()), track.face_id, track.name, float(track.confidence), self.camera_id))
+            self.logged += 1
+        if len(self.last_logged) > 1000:
+            self.last_logged = {k: v for k, v in self.last_logged.items() if now - v < FACE_LOG_WINDOW}
+
+    def stats(self):
+        return {
+            'tracks': len(self.tracks),
+            'detect_runs': self.detect_runs,
+            'encodings': self.encodings,
+            'logged': self.logged,
+            'stage_ms': latency_summary(list(self.stage_ms))
+        }
+
+
 @app.route('/api/v1/faces', methods=['POST'])
 @token_required
 def register_face():
-    if 'image' not in request.files:
+    """Register one face ('image' + 'name') or a roster in one request
+    ('images' + matching 'names'; file names are used when names are missing)."""
+    uploads = read_upload_images()
+    if not uploads:
         return jsonify({'error': 'No image provided'}), 400
     
-    image = request.files['image']
-    name = request.form.get('name', 'Unknown')
-    
     if not FACE_RECOGNITION_AVAILABLE:
         return jsonify({'error': 'Face recognition not available'}), 503
     
-    face_id = str(uuid.uuid4())
-    image_path = FACE_DIR / f"{face_id}.jpg"
-    image.save(image_path)
+    names = request.form.getlist('names') or request.form.getlist('name')
     
-    try:
-        img = face_recognition.load_image_file(str(image_path))
-        encodings = face_recognition.face_encodings(img)
-        
+    registered, failed, new_faces = [], [], []
+    for i, (filename, data) in enumerate(uploads):
+        name = names[i] if i < len(names) else (Path(filename).stem if len(uploads) > 1 and filename else 'Unknown')
+        img = decode_image(data)
+        if img is None:
+            failed.append({'filename': filename, 'name': name, 'error': 'Could not decode image'})
+            continue
+        locations, encodings = find_faces(img)
         if not encodings:
-            image_path.unlink()
-            return jsonify({'error': 'No face detected in image'}), 400
-        
-        encoding = encodings[0]
-        encoding_bytes = encoding.tobytes()
+            failed.append({'filename': filename, 'name': name, 'error': 'No face detected in image'})
+            continue
         
+        # Enrollment photos should have one subject - take the largest face
+        areas = [(b - t) * (r - l) for t, r, b, l in locations]
+        encoding = encodings[int(np.argmax(areas))]
+        new_faces.append((str(uuid.uuid4()), name, encoding, data, filename))
+    
+    if new_faces:
         conn = get_db()
-        conn.execute('INSERT INTO faces (id, name, encoding, image_path) VALUES (?, ?, ?, ?)',
-                     (face_id, name, encoding_bytes, str(image_path)))
-        conn.commit()
-        conn.close()
-        
-        face_encodings_cache[face_id] = {'name': name, 'encoding': encoding}
+        try:
+            versions = []
+            for face_id, name, encoding, data, _ in new_faces:
+                image_path = FACE_DIR / f"{face_id}.jpg"
+                conn.execute('INSERT INTO faces (id, name, encoding, image_path) VALUES (?, ?, ?, ?)',
+                             (face_id, name, encoding.tobytes(), str(image_path)))
+                versions.append(faces_version(conn))
+            # Keep the photo for the UI - the only disk write per face
+            for face_id, _, _, data, _ in new_faces:
+                (FACE_DIR / f"{face_id}.jpg").write_bytes(data)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            for face_id, *_ in new_faces:
+                (FACE_DIR / f"{face_id}.jpg").unlink(missing_ok=True)
+            return jsonify({'error': str(e)}), 500
+        finally:
+            conn.close()
         
-        return jsonify({'id': face_id, 'name': name, 'image_path': str(image_path)}), 201
-    except Exception as e:
-        if image_path.exists():
-            image_path.unlink()
-        return jsonify({'error': str(e)}), 500
+        for (face_id, name, encoding, _, filename), version in zip(new_faces, versions):
+            face_cache.on_added(face_id, name, encoding, version)
+            registered.append({'id': face_id, 'name': name, 'filename': filename,
+                               'image_path': str(FACE_DIR / f"{face_id}.jpg")})
+    
+    if len(uploads) == 1:
+        if failed:
+            return jsonify({'error': failed[0]['error']}), 400
+        face = registered[0]
+        return jsonify({'id': face['id'], 'name': face['name'], 'image_path': face['image_path']}), 201
+    
+    return jsonify({'registered': registered, 'failed': failed}), 201 if registered else 400
 
 
 @app.route('/api/v1/faces/search', methods=['POST'])
 @token_required
 def search_faces():
-    if 'image' not in request.files:
+    uploads = read_upload_images()
+    if not uploads:
         return jsonify({'error': 'No image provided'}), 400
     
     if not FACE_RECOGNITION_AVAILABLE:
         return jsonify({'error': 'Face recognition not available'}), 503
     
-    image = request.files['image']
-    temp_path = UPLOAD_DIR / f"temp_{uuid.uuid4()}.jpg"
-    image.save(temp_path)
+    top_k = max(1, request.form.get('top_k', request.args.get('top_k', 1, type=int), type=int))
     
-    try:
-        img = face_recognition.load_image_file(str(temp_path))
-        face_locations = face_recognition.face_locations(img)
-        face_encs = face_recognition.face_encodings(img, face_locations)
-        
-        results = []
-        
-        if not face_encodings_cache:
-            conn = get_db()
-            faces = conn.execute('SELECT id, name, encoding FROM faces').fetchall()
-            conn.close()
-            for f in faces:
-                if f['encoding']:
-                    enc = np.frombuffer(f['encoding'], dtype=np.float64)
-                    face_encodings_cache[f['id']] = {'name': f['name'], 'encoding': enc}
-        
-        known_encodings = [v['encoding'] for v in face_encodings_cache.values()]
-        known_names = [v['name'] for v in face_encodings_cache.values()]
-        known_ids = list(face_encodings_cache.keys())
-        
-        for face_enc, face_loc in zip(face_encs, face_locations):
-            if known_encodings:
-                distances = face_recognition.face_distance(known_encodings, face_enc)
-                best_idx = np.argmin(distances)
-                confidence = 1 - distances[best_idx]
-                
-                if confidence > 0.5:
-                    results.append({
-                        'name': known_names[best_idx],
-                        'face_id': known_ids[best_idx],
-                        'confidence': float(confidence),
-                        'bbox': list(face_loc)
-                    })
-                else:
-                    results.append({
-                        'name': 'Unknown',
-                        'confidence': float(confidence),
-                        'bbox': list(face_loc)
-                    })
-            else:
-                results.append({
-                    'name': 'Unknown',
-                    'confidence': 0,
-                    'bbox': list(face_loc)
-                })
-        
-        return jsonify({'results': results, 'count': len(results)})
-    finally:
-        if temp_path.exists():
-            temp_path.unlink()
-
+    images = []
+    for filename, data in uploads:
+        img = decode_image(data)
+        if img is None:
+            images.append({'filename': filename, 'error': 'Could not decode image', 'results': [], 'count': 0})
+            continue
+        locations, encodings = find_faces(img)
+        results = match_faces(locations, encodings, top_k)
+        images.append({'filename': filename, 'results': results, 'count': len(results)})
+    
+    if len(images) == 1:
+        if images[0].get('error'):
+            return jsonify({'error': images[0]['error']}), 400
+        return jsonify({'results': images[0]['results'], 'count': images[0]['count']})
+    return jsonify({'images': images, 'count': sum(i['count'] for i in images)})
+
+
+@app.route('/api/v1/faces/detect', methods=['POST'])
+@token_required
+def detect_faces():
+    """Recognise faces in an uploaded frame and log them to face_detections"""
+    uploads = read_upload_images()
+    if not uploads:
+        return jsonify({'error': 'No image provided'}), 400
+    
+    if not FACE_RECOGNITION_AVAILABLE:
+        return jsonify({'error': 'Face recognition not available'}), 503
+    
+    img = decode_image(uploads[0][1])
+    if img is None:
+        return jsonify({'error': 'Could not decode image'}), 400
+    
+    locations, encodings = find_faces(img)
+    results = match_faces(locations, encodings)
+    camera_id = request.form.get('camera_id')
+    for r in results:
+        db_writer.execute('INSERT INTO face_detections (id, face_id, name, confidence, camera_id) VALUES (?, ?, ?, ?, ?)',
+                          (str(uuid.uuid4()), r.get('face_id'), r['name'], r['confidence'], camera_id))
+    if results:
+        db_writer.flush()
+    
+    return jsonify({'detections': results, 'logged': bool(results)})
+
+
+@app.route('/api/v1/faces/<face_id>', methods=['DELETE'])
+@token_required
+def delete_face(face_id):
+    conn = get_db()
+    face = conn.execute('SELECT image_path FROM faces WHERE id = ?', (face_id,)).fetchone()
+    if not face:
+        conn.close()
+        return jsonify({'error': 'Face not found'}), 404
+    conn.execute('DELETE FROM faces WHERE id = ?', (face_id,))
+    version = faces_version(conn)
+    conn.commit()
+    conn.close()
+    
+    face_cache.on_removed(face_id, version)
+    if face['image_path']:
+        Path(face['image_path']).unlink(missing_ok=True)
+    return jsonify({'status': 'deleted'})
+
+
+@app.route('/api/v1/faces/index')
+def face_index_stats():
+    return jsonify(face_cache.stats())
+
+
+@app.route('/api/v1/faces/detections')
+@token_required
+def get_face_detections():
+    limit = request.args.get('limit', 50, type=int)
+    conn = get_db()
+    dets = conn.execute('SELECT * FROM face_detections ORDER BY detected_at DESC LIMIT ?', (limit,)).fetchall()
+    conn.close()
+    return jsonify([dict(d) for d in dets])
+
+
+# ===== JOBS =====
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    """Handed to a job handler: progress reporting and cancellation."""
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.progress = 0.0
+        self.eta_seconds = None
+        self.cancelled = threading.Event()
+        self.process = None
+        self.last_saved = 0
+
+    def report(self, progress, eta_seconds=None):
+        self.progress = max(0.0, min(progress, 100.0))
+        self.eta_seconds = eta_seconds
+        if time.time() - self.last_saved >= JOB_PROGRESS_SAVE_INTERVAL:
+            # Live values are served from memory; the row is only refreshed
+            # now and then so a restart shows roughly where we were
+            db_writer.execute('UPDATE jobs SET progress = ?, eta_seconds = ? WHERE id = ?',
+                              (round(self.progress, 1), eta_seconds, self.job_id))
+            self.last_saved = time.time()
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise JobCancelled()
+
+
+class JobQueue:
+    """SQLite-backed job queue with a fixed pool of worker threads.
+
+    Jobs live in the jobs table, so queued work survives a restart (jobs
+    that were mid-run go back to 'queued' and start over). Handlers are
+    looked up by kind in JOB_HANDLERS and receive (job, JobContext)."""
+    def __init__(self, workers=JOB_WORKERS):
+        self.workers = workers
+        self.threads = []
+        self.cond = threading.Condition()
+        self.active = {}
+        self.started = False
+        self.start_lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        with self.start_lock:
+            if self.started:
+                return
+            self.started = True
+            conn = get_db()
+            resumed = conn.execute("UPDATE jobs SET status = 'queued', progress = 0, eta_seconds = NULL "
+                                   "WHERE status = 'processing'").rowcount
+            conn.commit()
+            conn.close()
+            if resumed:
+                print(f"🔁 Requeued {resumed} interrupted job(s)")
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, daemon=True, name=f'job-worker-{i}')
+                t.start()
+                self.threads.append(t)
+            threading.Thread(target=self._janitor, daemon=True, name='upload-janitor').start()
+
+    def enqueue(self, kind, params=None, input_path=None, output_path=None,
+                original_filename=None, original_size=None, job_id=None):
+        """Queue a job; returns its id, or None when the queue is full."""
+        self.start()
+        job_id = job_id or str(uuid.uuid4())[:8]
+        conn = get_db()
+        queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        if queued >= JOB_QUEUE_MAX:
+            conn.close()
+            return None
+        conn.execute('''INSERT INTO jobs (id, kind, status, params, input_path, output_path,
+            original_filename, original_size) VALUES (?, ?, 'queued', ?, ?, ?, ?, ?)''',
+            (job_id, kind, json.dumps(params or {}), str(input_path) if input_path else None,
+             str(output_path) if output_path else None, original_filename, original_size))
+        conn.commit()
+        conn.close()
+        with self.cond:
+            self.cond.notify()
+        return job_id
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job. Returns the job's new status or None."""
+        conn = get_db()
+        cur = conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = CURRENT_TIMESTAMP "
+                           "WHERE id = ? AND status = 'queued'", (job_id,))
+        conn.commit()
+        row = conn.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        conn.close()
+        if cur.rowcount:
+            return 'cancelled'
+        ctx = self.active.get(job_id)
+        if ctx is None:
+            return row['status'] if row else None
+        ctx.cancelled.set()
+        if ctx.process and ctx.process.poll() is None:
+            ctx.process.terminate()
+        return 'cancelling'
+
+    def _claim(self):
+        with self.cond:
+            conn = get_db()
+            row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY rowid LIMIT 1").fetchone()
+            if row:
+                conn.execute("UPDATE jobs SET status = 'processing', started_at = CURRENT_TIMESTAMP WHERE id = ?",
+                             (row['id'],))
+                conn.commit()
+                self.active[row['id']] = JobContext(row['id'])
+            conn.close()
+            return dict(row) if row else None
+
+    def _worker(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                with self.cond:
+                    self.cond.wait(JOB_POLL_INTERVAL)
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        ctx = self.active[job['id']]
+        job['params'] = json.loads(job['params'] or '{}')
+        handler = JOB_HANDLERS.get(job['kind'])
+        status, error, result = 'failed', None, {}
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown job kind: {job['kind']}")
+            result = handler(job, ctx) or {}
+            status = 'completed'
+        except JobCancelled:
+            status = 'cancelled'
+        except Exception as e:
+            status, error = ('cancelled', None) if ctx.cancelled.is_set() else ('failed', str(e))
+            if error:
+                print(f"❌ Job {job['id']} failed: {e}")
+        finally:
+            self.active.pop(job['id'], None)
+        if status == 'completed':
+            self.completed += 1
+        elif status == 'failed':
+            self.failed += 1
+        conn = get_db()
+        conn.execute('''UPDATE jobs SET status = ?, error = ?, result = ?, output_size = ?,
+            progress = CASE WHEN ? = 'completed' THEN 100 ELSE progress END, eta_seconds = NULL,
+            finished_at = CURRENT_TIMESTAMP WHERE id = ?''',
+            (status, error, json.dumps(result), result.get('output_size'), status, job['id']))
+        conn.commit()
+        conn.close()
+
+    def _janitor(self):
+        while True:
+            try:
+                cleanup_uploads()
+            except Exception as e:
+                print(f"⚠️ Upload cleanup failed: {e}")
+            time.sleep(UPLOAD_CLEANUP_INTERVAL)
+
+    def status(self, job_id):
+        conn = get_db()
+        row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        position = None
+        if row and row['status'] == 'queued':
+            position = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND rowid <= "
+                                    "(SELECT rowid FROM jobs WHERE id = ?)", (job_id,)).fetchone()[0]
+        conn.close()
+        if row is None:
+            return None
+        job = dict(row)
+        job['params'] = json.loads(job['params'] or '{}')
+        job['result'] = json.loads(job['result'] or '{}')
+        ctx = self.active.get(job_id)
+        if ctx:
+            job['progress'] = round(ctx.progress, 1)
+            job['eta_seconds'] = round(ctx.eta_seconds) if ctx.eta_seconds is not None else None
+        job['queue_position'] = position
+        return job
+
+    def stats(self):
+        conn = get_db()
+        counts = {r['status']: r['n'] for r in conn.execute('SELECT status, COUNT(*) as n FROM jobs GROUP BY status')}
+        conn.close()
+        return {
+            'workers': self.workers,
+            'running': list(self.active),
+            'by_status': counts,
+            'completed': self.completed,
+            'failed': self.failed
+        }
+
+
+def cleanup_uploads():
+    """Delete upload files older than UPLOAD_MAX_AGE_HOURS, then the oldest
+    ones until UPLOAD_DIR fits in UPLOAD_MAX_BYTES. Files of queued or
+    running jobs are never touched."""
+    conn = get_db()
+    busy = set()
+    for row in conn.execute("SELECT input_path, output_path FROM jobs WHERE status IN ('queued', 'processing')"):
+        busy.update(Path(p).name for p in (row['input_path'], row['output_path']) if p)
+    for row in conn.execute("SELECT path FROM uploads WHERE status = 'uploading' AND created_at >= datetime('now', ?)",
+                            (f'-{UPLOAD_MAX_AGE_HOURS} hours',)):
+        busy.add(Path(row['path']).name)
+    conn.close()
+    
+    files = []
+    for path in UPLOAD_DIR.iterdir():
+        if path.is_file() and path.name not in busy:
+            st = path.stat()
+            files.append((st.st_mtime, st.st_size, path))
+    files.sort()
+    cutoff = time.time() - UPLOAD_MAX_AGE_HOURS * 3600
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for mtime, size, path in files:
+        if mtime >= cutoff and total <= UPLOAD_MAX_BYTES:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+        removed += 1
+    if removed:
+        print(f"🧹 Removed {removed} old upload file(s)")
+    return removed
+
+
+def probe_duration(path):
+    """Media duration in seconds via ffprobe, or None if unknown."""
+    try:
+        out = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+                              '-of', 'default=noprint_wrappers=1:nokey=1', str(path)],
+                             capture_output=True, text=True, timeout=30)
+        return float(out.stdout.strip())
+    except (OSError, ValueError, subprocess.TimeoutExpired):
+        return None
+
+
+def run_ffmpeg(cmd, ctx, duration=None, feed=None):
+    """Run ffmpeg with -progress on stdout, reporting percent and ETA.
+    feed(pipe) - if given - writes the input to ffmpeg's stdin ('-i pipe:0')."""
+    cmd = cmd[:1] + ['-progress', 'pipe:1', '-nostats'] + cmd[1:]
+    started = time.time()
+    feed_errors = []
+
+    def feeder():
+        try:
+            feed(ctx.process.stdin)
+        except BrokenPipeError:
+            pass
+        except Exception as e:
+            feed_errors.append(e)
+            ctx.process.terminate()
+
+    # stderr goes to a temp file so a chatty ffmpeg can't fill the pipe and stall
+    with tempfile.TemporaryFile('w+') as log:
+        ctx.process = subprocess.Popen(cmd, stdin=subprocess.PIPE if feed else subprocess.DEVNULL,
+                                       stdout=subprocess.PIPE, stderr=log)
+        if feed:
+            threading.Thread(target=feeder, daemon=True).start()
+        try:
+            for raw in ctx.process.stdout:
+                key, _, value = raw.decode(errors='replace').strip().partition('=')
+                if key == 'out_time_us' and duration and value.isdigit():
+                    done = min(int(value) / 1e6 / duration, 1.0)
+                    elapsed = time.time() - started
+                    eta = elapsed * (1 - done) / done if done > 0.01 else None
+                    ctx.report(done * 100, eta)
+                if ctx.cancelled.is_set():
+                    ctx.process.terminate()
+            code = ctx.process.wait(timeout=JOB_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            ctx.process.kill()
+            raise RuntimeError('ffmpeg timed out')
+        ctx.check()
+        if feed_errors:
+            raise feed_errors[0]
+        if code != 0:
+            log.seek(0)
+            raise RuntimeError(f"ffmpeg exited with {code}: {log.read()[-500:].strip()}")
+
+
+def run_compression_job(job, ctx):
+    level = job['params'].get('level', 'medium')
+    crf = '28' if level == 'medium' else '35'
+    output_path = Path(job['output_path'])
+    upload_id = job['params'].get('upload_id')
+
+    def command(source):
+        return ['ffmpeg', '-y', '-i', source, '-c:v', 'libx264', '-crf', crf,
+                '-preset', 'fast', '-c:a', 'aac', '-movflags', '+faststart', str(output_path)]
+
+    state = upload_manager.get(upload_id) if upload_id else None
+    if state and not state.complete:
+        # Upload still arriving: start encoding from a pipe right away
+        try:
+            run_ffmpeg(command('pipe:0'), ctx, feed=lambda pipe: upload_manager.follow(upload_id, pipe, ctx))
+        except RuntimeError as e:
+            # Containers that need seeking (MP4 with the index at the end)
+            # can't be read from a pipe - wait for the file and redo it
+            print(f"⚠️ Streaming compression of {job['id']} failed ({e}), retrying from file")
+            input_path = upload_manager.wait_complete(upload_id, ctx)
+            run_ffmpeg(command(str(input_path)), ctx, probe_duration(input_path))
+    else:
+        input_path = state.path if state else job['input_path']
+        run_ffmpeg(command(str(input_path)), ctx, probe_duration(input_path))
+    if not output_path.exists():
+        raise RuntimeError('ffmpeg produced no output')
+    return {'output_size': output_path.stat().st_size, 'output_path': str(output_path.resolve())}
+
+
+JOB_HANDLERS = {
+    'compression': run_compression_job,
+}
+
+job_queue = JobQueue()
+
+
+# ===== UPLOADS =====
+class UploadState:
+    def __init__(self, row, offset, hasher):
+        self.id = row['id']
+        self.path = Path(row['path'])
+        self.size = row['size']
+        self.offset = offset
+        self.hasher = hasher
+        self.complete = row['status'] == 'complete'
+        self.sha256 = row['sha256']
+        self.cond = threading.Condition()
+        self.write_lock = threading.Lock()
+
+
+class UploadManager:
+    """Chunked, resumable uploads written straight to their final path.
+
+    Chunks must arrive in order (PUT with Upload-Offset), which lets the
+    sha256 be computed on the fly; after a restart the hash is rebuilt from
+    the bytes already on disk. Readers can follow() an upload while it is
+    still arriving - that is how ffmpeg starts before the last byte lands."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.states = {}
+
+    def create(self, filename, size, sha256=None):
+        """Returns (row dict, duplicate row or None)."""
+        conn = get_db()
+        if sha256:
+            dup = conn.execute("SELECT * FROM uploads WHERE sha256 = ? AND status = 'complete'", (sha256.lower(),)).fetchone()
+            if dup and Path(dup['path']).exists():
+                conn.close()
+                return dict(dup), dict(dup)
+        upload_id = str(uuid.uuid4())[:8]
+        path = UPLOAD_DIR / f"{upload_id}_input{Path(filename or '').suffix}"
+        path.touch()
+        conn.execute("INSERT INTO uploads (id, filename, path, size, status) VALUES (?, ?, ?, ?, 'uploading')",
+                     (upload_id, filename, str(path), size))
+        conn.commit()
+        row = conn.execute('SELECT * FROM uploads WHERE id = ?', (upload_id,)).fetchone()
+        conn.close()
+        return dict(row), None
+
+    def get(self, upload_id):
+        with self.lock:
+            state = self.states.get(upload_id)
+            if state:
+                return state
+            conn = get_db()
+            row = conn.execute('SELECT * FROM uploads WHERE id = ?', (upload_id,)).fetchone()
+            conn.close()
+            if row is None:
+                return None
+            hasher, offset = None, row['size']
+            if row['status'] != 'complete':
+                # Resumed after a restart - rebuild the hash from what's on disk
+                hasher = hashlib.sha256()
+                offset = 0
+                path = Path(row['path'])
+                if path.exists():
+                    with open(path, 'rb') as f:
+                        for block in iter(lambda: f.read(UPLOAD_IO_BLOCK), b''):
+                            hasher.update(block)
+                            offset += len(block)
+            state = self.states[upload_id] = UploadState(row, offset, hasher)
+            return state
+
+    def write(self, state, offset, stream, length=None):
+        """Append a chunk from a file-like stream. Returns None on success or
+        an error string (offset mismatch, size overflow) - in which case
+        nothing of the chunk has been committed."""
+        if not state.write_lock.acquire(blocking=False):
+            return 'another chunk for this upload is in progress'
+        try:
+            if state.complete:
+                return 'upload already complete'
+            if offset != state.offset:
+                return f'expected offset {state.offset}'
+            if length is not None and offset + length > state.size:
+                return 'chunk runs past the declared size'
+            # Without a Content-Length an overflow only shows while reading:
+            # hold the offset (and hash) back until the whole chunk has fit
+            live = length is not None
+            hasher = state.hasher.copy()
+            end = offset
+            with open(state.path, 'r+b') as f:
+                f.seek(offset)
+                while True:
+                    block = stream.read(UPLOAD_IO_BLOCK)
+                    if not block:
+                        break
+                    if end + len(block) > state.size:
+                        f.truncate(offset)
+                        return 'chunk runs past the declared size'
+                    f.write(block)
+                    f.flush()
+                    hasher.update(block)
+                    end += len(block)
+                    if live:
+                        with state.cond:
+                            state.offset = end
+                            state.cond.notify_all()
+            state.hasher = hasher
+            with state.cond:
+                state.offset = end
+                state.cond.notify_all()
+            db_writer.execute('UPDATE uploads SET received = ? WHERE id = ?', (state.offset, state.id))
+            if state.offset == state.size:
+                self._finish(state)
+            return None
+        finally:
+            state.write_lock.release()
+
+    def discard(self, upload_id):
+        """Drop an upload nobody will finish (its job could not be queued)."""
+        with self.lock:
+            self.states.pop(upload_id, None)
+        conn = get_db()
+        row = conn.execute('SELECT path FROM uploads WHERE id = ?', (upload_id,)).fetchone()
+        conn.execute('DELETE FROM uploads WHERE id = ?', (upload_id,))
+        conn.commit()
+        conn.close()
+        if row:
+            Path(row['path']).unlink(missing_ok=True)
+
+    def _finish(self, state):
+        digest = state.hasher.hexdigest()
+        conn = get_db()
+        dup = conn.execute("SELECT * FROM uploads WHERE sha256 = ? AND status = 'complete' AND id != ?",
+                           (digest, state.id)).fetchone()
+        duplicate_of = None
+        if dup and Path(dup['path']).exists():
+            # Same bytes already on disk - keep one copy (a reader that
+            # already has this file open keeps reading it)
+            state.path.unlink(missing_ok=True)
+            state.path = Path(dup['path'])
+            duplicate_of = dup['id']
+        conn.execute("UPDATE uploads SET status = 'complete', sha256 = ?, received = size, path = ?, "
+                     "duplicate_of = ?, completed_at = CURRENT_TIMESTAMP WHERE id = ?",
+                     (digest, str(state.path), duplicate_of, state.id))
+        conn.execute("UPDATE jobs SET input_path = ? WHERE status = 'queued' AND json_extract(params, '$.upload_id') = ?",
+                     (str(state.path), state.id))
+        conn.commit()
+        conn.close()
+        with state.cond:
+            state.sha256 = digest
+            state.complete = True
+            state.cond.notify_all()
+
+    def follow(self, upload_id, pipe, ctx):
+        """Copy an upload into pipe as it arrives, until it is complete."""
+        state = self.get(upload_id)
+        pos = 0
+        started = time.time()
+        with open(state.path, 'rb') as f:
+            while True:
+                with state.cond:
+                    state.cond.wait_for(lambda: state.offset > pos or state.complete or ctx.cancelled.is_set(),
+                                        UPLOAD_STALL_TIMEOUT)
+                    available, complete = state.offset, state.complete
+                ctx.check()
+                if available == pos:
+                    if complete:
+                        break
+                    raise RuntimeError('upload stalled')
+                f.seek(pos)
+                while pos < available:
+                    block = f.read(min(UPLOAD_IO_BLOCK, available - pos))
+                    pipe.write(block)
+                    pos += len(block)
+                done = pos / state.size if state.size else 1.0
+                elapsed = time.time() - started
+                ctx.report(done * 100, elapsed * (1 - done) / done if done > 0.01 else None)
+        pipe.close()
+
+    def wait_complete(self, upload_id, ctx):
+        state = self.get(upload_id)
+        with state.cond:
+            while not state.complete:
+                seen = state.offset
+                state.cond.wait_for(lambda: state.complete or state.offset > seen or ctx.cancelled.is_set(),
+                                    UPLOAD_STALL_TIMEOUT)
+                ctx.check()
+                if not state.complete and state.offset == seen:
+                    raise RuntimeError('upload stalled')
+        return state.path
+
+    def view(self, state):
+        return {
+            'upload_id': state.id,
+            'size': state.size,
+            'offset': state.offset,
+            'complete': state.complete,
+            'sha256': state.sha256,
+            'chunk_size': UPLOAD_CHUNK_SIZE
+        }
+
+
+upload_manager = UploadManager()
+
+
+@app.route('/api/v1/uploads', methods=['POST'])
+@token_required
+def create_upload():
+    """Start a chunked upload: {filename, size, sha256?, compress?: 'medium'|'high'}.
+    With compress set, the compression job is queued at once and ffmpeg
+    reads the upload as it arrives."""
+    data = request.json or {}
+    size = data.get('size')
+    if not isinstance(size, int) or size <= 0:
+        return jsonify({'error': 'size (bytes) required'}), 400
+    
+    row, duplicate = upload_manager.create(data.get('filename'), size, data.get('sha256'))
+    result = {'upload_id': row['id'], 'offset': row['size'] if duplicate else 0, 'size': row['size'],
+              'complete': duplicate is not None, 'duplicate': duplicate is not None,
+              'chunk_size': UPLOAD_CHUNK_SIZE}
+    
+    level = data.get('compress')
+    if level:
+        job_id = str(uuid.uuid4())[:8]
+        job_id = job_queue.enqueue('compression', {'level': level, 'upload_id': row['id']},
+                                   row['path'], UPLOAD_DIR / f"{job_id}_output.mp4",
+                                   data.get('filename'), size, job_id=job_id)
+        if job_id is None:
+            if duplicate is None:
+                upload_manager.discard(row['id'])
+            return jsonify({'error': 'Compression queue is full, try again later'}), 503
+        result['job_id'] = job_id
+    return jsonify(result), 201
+
+
+@app.route('/api/v1/uploads/<upload_id>')
+@token_required
+def get_upload(upload_id):
+    """Where to resume: the server's current offset"""
+    state = upload_manager.get(upload_id)
+    if state is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify(upload_manager.view(state))
+
+
+@app.route('/api/v1/uploads/<upload_id>', methods=['PUT', 'PATCH'])
+@token_required
+def put_upload_chunk(upload_id):
+    """Raw chunk body at Upload-Offset (header) or ?offset="""
+    state = upload_manager.get(upload_id)
+    if state is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    offset = request.headers.get('Upload-Offset', request.args.get('offset'), type=int)
+    if offset is None:
+        return jsonify({'error': 'Upload-Offset required'}), 400
+    
+    error = upload_manager.write(state, offset, request.stream, request.content_length)
+    if error:
+        return jsonify({'error': error, **upload_manager.view(state)}), 409
+    return jsonify(upload_manager.view(state))
+
+
+# ===== COMPRESSION =====
+def compression_job_view(job):
+    """Job row -> the shape Compression.tsx expects"""
+    result = {
+        'job_id': job['id'],
+        'status': job['status'],
+        'original_size': job['original_size'],
+        'original_filename': job['original_filename'],
+        'level': job['params'].get('level'),
+        'progress': job['progress'],
+        'eta_seconds': job['eta_seconds'],
+        'queue_position': job.get('queue_position'),
+        'created_at': job['created_at']
+    }
+    if job['error']:
+        result['error'] = job['error']
+    if job['status'] == 'completed':
+        result['compressed_size'] = job['output_size']
+        result['download_url'] = f"/api/v1/compression/download/{job['id']}"
+        if job['output_size'] and job['original_size']:
+            result['compression_ratio'] = round((1 - job['output_size'] / job['original_size']) * 100, 1)
+    return result
+
+
+@app.route('/api/v1/compression/upload', methods=['POST'])
+@token_required
+def compression_upload():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file'}), 400
+    
+    file = request.files['file']
+    level = request.form.get('level', 'medium')
+    
+    job_id = str(uuid.uuid4())[:8]
+    input_path = UPLOAD_DIR / f"{job_id}_input{Path(file.filename).suffix}"
+    output_path = UPLOAD_DIR / f"{job_id}_output.mp4"
+    
+    file.save(input_path)
+    original_size = input_path.stat().st_size
+    
+    if not job_queue.enqueue('compression', {'level': level}, input_path, output_path,
+                             file.filename, original_size, job_id=job_id):
+        input_path.unlink(missing_ok=True)
+        return jsonify({'error': 'Compression queue is full, try again later'}), 503
+    
+    return jsonify({'job_id': job_id, 'status': 'queued', 'original_size': original_size,
+                    'original_filename': file.filename})
+
+
+@app.route('/api/v1/compression/status/<job_id>')
+@token_required
+def compression_status(job_id):
+    job = job_queue.status(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(compression_job_view(job))
+
+
+@app.route('/api/v1/compression/jobs')
+@token_required
+def list_compression_jobs():
+    limit = request.args.get('limit', 50, type=int)
+    conn = get_db()
+    ids = [r['id'] for r in conn.execute("SELECT id FROM jobs WHERE kind = 'compression' ORDER BY created_at DESC, rowid DESC LIMIT ?", (limit,))]
+    conn.close()
+    return jsonify([compression_job_view(job_queue.status(i)) for i in ids])
+
+
+@app.route('/api/v1/compression/cancel/<job_id>', methods=['POST'])
+@token_required
+def compression_cancel(job_id):
+    status = job_queue.cancel(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'job_id': job_id, 'status': status})
+
+
+@app.route('/api/v1/jobs/stats')
+@token_required
+def job_stats():
+    return jsonify(job_queue.stats())
+
+
+@app.route('/api/v1/compression/download/<job_id>')
+def compression_download(job_id):
+    # The job row is the one record of where the output went
+    job = job_queue.status(job_id)
+    if not job or job['kind'] != 'compression' or job['status'] != 'completed':
+        return jsonify({'error': 'File not found'}), 404
+    output_path = Path(job['result'].get('output_path') or job['output_path']).resolve()
+    if not output_path.exists():
+        return jsonify({'error': 'File not found'}), 404
+    
+    return send_file(output_path, as_attachment=True, download_name=f'compressed_{job_id}.mp4')
+
+
+# ===== ONNX BACKEND =====
+def backend_parity(model, reference, frames, runs=5):
+    """Compare an ONNX detector against its PyTorch reference on the same
+    frames: matched boxes (IoU >= 0.5, same class), their mean IoU, and
+    per-call latency."""
+    report = {}
+    outputs = {}
+    for label, runner in (('onnx', model), ('torch', reference)):
+        detect_raw(runner, frames, INFERENCE_CONF)   # warm-up
+        times = []
+        for _ in range(runs):
+            t0 = time.time()
+            outputs[label] = detect_raw(runner, frames, INFERENCE_CONF)
+            times.append((time.time() - t0) * 1000)
+        report[f'{label}_ms'] = latency_summary(times)
+    matched = total = 0
+    ious = []
+    for a, b in zip(outputs['onnx'], outputs['torch']):
+        total += max(len(a), len(b))
+        if not a or not b:
+            continue
+        iou = box_iou(np.array([d[0] for d in a], dtype=np.float32), np.array([d[0] for d in b], dtype=np.float32))
+        for i, j in greedy_match(iou, 0.5):
+            if a[i][2] == b[j][2]:
+                matched += 1
+                ious.append(float(iou[i, j]))
+    report.update({
+        'frames': len(frames),
+        'boxes_onnx': sum(len(a) for a in outputs['onnx']),
+        'boxes_torch': sum(len(b) for b in outputs['torch']),
+        'matched': matched,
+        'match_rate': round(matched / total, 3) if total else 1.0,
+        'mean_iou': round(float(np.mean(ious)), 4) if ious else None,
+        'speedup': round(report['torch_ms']['p50'] / report['onnx_ms']['p50'], 2) if report['onnx_ms']['p50'] else None
+    })
+    return report
+
+
+# ===== INFERENCE SCHEDULER =====
+class InferenceRequest:
+    def __init__(self, camera_id, frame, model_name, imgsz=None):
+        self.camera_id = camera_id
+        self.frame = frame
+        self.model_name = model_name
+        self.imgsz = imgsz
+        self.submitted_at = time.time()
+        self.done = threading.Event()
+        self.detections = None
+
+
+class InferenceScheduler:
+    """Collects the latest frame from every live stream and runs them through
+    the model as one batch.
+
+    A batch is dispatched when it reaches max_batch frames, when every running
+    stream has a frame queued, or when the oldest queued frame has waited
+    max_wait_ms - whichever comes first.
+    """
+    def __init__(self, max_batch=INFERENCE_MAX_BATCH, max_wait_ms=INFERENCE_MAX_WAIT_MS):
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.pending = OrderedDict()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.batches = 0
+        self.frames = 0
+        self.dropped = 0
+        self.batch_sizes = {}
+        self.queue_wait_ms = deque(maxlen=500)
+        self.inference_ms = deque(maxlen=500)
+
+    def _ensure_started(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def submit(self, camera_id, frame, model_name=None, imgsz=None):
+        req = InferenceRequest(camera_id, frame, model_name or active_model_name, imgsz)
+        with self.cond:
+            self._ensure_started()
+            # Only the newest frame per stream is worth running
+            old = self.pending.pop(camera_id, None)
+            if old is not None:
+                self.dropped += 1
+                old.done.set()
+            self.pending[camera_id] = req
+            self.cond.notify()
+        return req
+
+    def infer(self, camera_id, frame, model_name=None, timeout=10.0, imgsz=None):
+        """Blocking submit. Returns the detection list, or None if the frame was
+        superseded or timed out."""
+        req = self.submit(camera_id, frame, model_name, imgsz)
+        req.done.wait(timeout)
+        return req.detections
+
+    def _next_batch(self):
+        with self.cond:
+            while not self.pending:
+                self.cond.wait()
+            while True:
+                target = min(self.max_batch, max(1, camera_manager.running_count()))
+                if len(self.pending) >= target:
+                    break
+                oldest = next(iter(self.pending.values()))
+                remaining = oldest.submitted_at + self.max_wait_ms / 1000 - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            batch = []
+            while self.pending and len(batch) < self.max_batch:
+                batch.append(self.pending.popitem(last=False)[1])
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            started = time.time()
+            for req in batch:
+                self.queue_wait_ms.append((started - req.submitted_at) * 1000)
+
+            # Streams sharing a model and inference size go through as one batch
+            by_model = {}
+            for req in batch:
+                by_model.setdefault((req.model_name, req.imgsz), []).append(req)
+            for (model_name, imgsz), reqs in by_model.items():
+                t0 = time.time()
+                try:
+                    results = run_model_batch(model_name, [r.frame for r in reqs], imgsz)
+                except Exception as e:
+                    print(f"❌ Inference failed ({model_name}): {e}")
+                    results = [[] for _ in reqs]
+                self.inference_ms.append((time.time() - t0) * 1000)
+                for req, detections in zip(reqs, results):
+                    req.detections = detections
+                    req.frame = None
+                    req.done.set()
+
+            self.batches += 1
+            self.frames += len(batch)
+            self.batch_sizes[len(batch)] = self.batch_sizes.get(len(batch), 0) + 1
+
+    def stats(self):
+        return {
+            'max_batch': self.max_batch,
+            'max_wait_ms': self.max_wait_ms,
+            'batches': self.batches,
+            'frames': self.frames,
+            'dropped': self.dropped,
+            'avg_batch_size': round(self.frames / self.batches, 2) if self.batches else 0,
+            'batch_sizes': self.batch_sizes,
+            'queue_wait_ms': latency_summary(list(self.queue_wait_ms)),
+            'inference_ms': latency_summary(list(self.inference_ms)),
+            'queued': len(self.pending)
+        }
+
+
+inference_scheduler = InferenceScheduler()
+
+
+@app.route('/api/v1/inference/stats')
+def inference_stats():
+    """Batch size, queue wait and model time for the shared scheduler"""
+    return jsonify(inference_scheduler.stats())
+
+
+@app.route('/api/v1/inference/config', methods=['POST'])
+@token_required
+def inference_config():
+    data = request.json or {}
+    with inference_scheduler.cond:
+        if 'max_batch' in data:
+            inference_scheduler.max_batch = max(1, int(data['max_batch']))
+        if 'max_wait_ms' in data:
+            inference_scheduler.max_wait_ms = max(0, float(data['max_wait_ms']))
+        inference_scheduler.cond.notify()
+    return jsonify({
+        'max_batch': inference_scheduler.max_batch,
+        'max_wait_ms': inference_scheduler.max_wait_ms
+    })
+
+
+# ===== TRACKING =====
+_product_names = {'loaded_at': 0, 'names': {}}
+
+
+def normalize_label(label):
+    return ''.join(ch for ch in str(label).lower() if ch.isalnum())
+
+
+def inventory_product_for(class_name):
+    """Map a model class ('sugar_bag', 'FullCrate') to an inventory product
+    name ('Sugar Bag', 'Full Crate'); None if there is no such product."""
+    if time.time() - _product_names['loaded_at'] > 60:
+        conn = get_db()
+        rows = conn.execute('SELECT product_name FROM inventory').fetchall()
+        conn.close()
+        _product_names['names'] = {normalize_label(r['product_name']): r['product_name'] for r in rows}
+        _product_names['loaded_at'] = time.time()
+    return _product_names['names'].get(normalize_label(class_name))
+
+
+def crossing_product(class_name):
+    """Product a crossing of this class is booked as, or None if not counted."""
+    if normalize_label(class_name) in COUNT_EXCLUDE_CLASSES:
+        return None
+    return inventory_product_for(class_name) or class_name
+
+
+def record_crossings(camera_id, events, counts=None):
+    """Write counted crossings to detections + inventory via the batched writer."""
+    global sugar_bag_count
+    for track, line, direction in events:
+        product = crossing_product(track.cls)
+        if product is None:
+            continue
+        db_writer.log_detection(product, direction, track.score, camera_id)
+        if 'sugar' in track.cls.lower() and direction == 'IN':
+            with counters_lock:
+                sugar_bag_count += 1
+    if events and counts is not None:
+        event_bus.publish('counts', camera_id, {'camera_id': camera_id, 'counts': counts,
+                                                'sugar_bag_count': sugar_bag_count})
+
+
+def parse_count_lines(raw):
+    """Validate count lines from JSON; returns a list or raises ValueError."""
+    lines = json.loads(raw) if isinstance(raw, str) else raw
+    if not isinstance(lines, list):
+        raise ValueError('lines must be a list')
+    clean = []
+    for i, line in enumerate(lines):
+        p1, p2 = line.get('p1'), line.get('p2')
+        if not (isinstance(p1, (list, tuple)) and isinstance(p2, (list, tuple)) and len(p1) == 2 and len(p2) == 2):
+            raise ValueError('each line needs p1 and p2 as [x, y]')
+        clean.append({
+            'name': str(line.get('name') or f'line{i + 1}'),
+            'p1': [float(p1[0]), float(p1[1])],
+            'p2': [float(p2[0]), float(p2[1])],
+            'invert': bool(line.get('invert', False))
+        })
+    return clean
+
+
+# ===== PERSON TRACKING =====
+def db_timestamp(ts):
+    """Epoch seconds -> the 'YYYY-MM-DD HH:MM:SS' UTC text CURRENT_TIMESTAMP uses."""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts))
+
+
+def appearance_histogram(frame, box):
+    """Coarse HS colour histogram of a person crop - enough to re-identify the
+    same clothing on a neighbouring camera a few seconds later."""
+    h, w = frame.shape[:2]
+    x1, y1, x2, y2 = [int(v) for v in box]
+    x1, y1, x2, y2 = max(0, x1), max(0, y1), min(w, x2), min(h, y2)
+    if x2 - x1 < 8 or y2 - y1 < 16:
+        return None
+    crop = cv2.resize(frame[y1:y2, x1:x2], (32, 64), interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(crop, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, [16, 8], [0, 180, 0, 256])
+    return cv2.normalize(hist, hist).flatten()
+
+
+class PersonSighting:
+    """A person currently visible on one camera = one open person_segments row."""
+    __slots__ = ('person_id', 'segment_id', 'camera_id', 'started_at', 'last_seen',
+                 'last_flushed', 'hist', 'observations', 'face_id')
+
+    def __init__(self, person_id, camera_id, now, hist):
+        self.person_id = person_id
+        self.segment_id = str(uuid.uuid4())
+        self.camera_id = camera_id
+        self.started_at = now
+        self.last_seen = now
+        self.last_flushed = now
+        self.hist = hist
+        self.observations = 1
+        self.face_id = None
+
+
+class PersonRegistry:
+    """Gives 'person' tracks an ID that survives across frames and cameras.
+
+    Per-camera track IDs come from ObjectTracker. A new track is matched to a
+    person who recently left any camera by appearance; a recognised face
+    pins the sighting to that face's person. Only segment boundaries are
+    written (one row per continuous stay on a camera), so storage grows with
+    visits, not frames."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sightings = {}               # (camera_id, track_id) -> PersonSighting
+        self.recently_lost = deque(maxlen=200)
+        self.face_persons = None          # face_id -> person_id, loaded lazily
+        self.persons_created = 0
+        self.reidentified = 0
+        self.segments_closed = 0
+        self.observe_ms = deque(maxlen=300)
+
+    def _face_person(self, face_id):
+        if self.face_persons is None:
+            conn = get_db()
+            rows = conn.execute('SELECT id, face_id FROM persons WHERE face_id IS NOT NULL').fetchall()
+            conn.close()
+            self.face_persons = {r['face_id']: r['id'] for r in rows}
+        return self.face_persons.get(face_id)
+
+    def _reidentify(self, camera_id, hist, now):
+        """Best recently-lost person whose appearance matches, or None."""
+        if hist is None:
+            return None
+        active = {s.person_id for s in self.sightings.values()}
+        best, best_score = None, PERSON_REID_MIN_SIMILARITY
+        for i, (person_id, lost_hist, lost_at, lost_camera) in enumerate(self.recently_lost):
+            if now - lost_at > PERSON_REID_WINDOW or person_id in active or lost_hist is None:
+                continue
+            score = cv2.compareHist(hist, lost_hist, cv2.HISTCMP_CORREL)
+            if score > best_score:
+                best, best_score = i, score
+        if best is None:
+            return None
+        person_id = self.recently_lost[best][0]
+        del self.recently_lost[best]
+        self.reidentified += 1
+        return person_id
+
+    def _open(self, camera_id, track, frame, now):
+        hist = appearance_histogram(frame, track.box)
+        person_id = self._reidentify(camera_id, hist, now)
+        if person_id is None:
+            person_id = f"P-{uuid.uuid4().hex[:10]}"
+            self.persons_created += 1
+            db_writer.execute('INSERT INTO persons (id, name, first_seen, last_seen, last_camera, appearances) '
+                              'VALUES (?, ?, ?, ?, ?, 0)',
+                              (person_id, f"Person {person_id[2:8]}", db_timestamp(now), db_timestamp(now), camera_id))
+        sighting = PersonSighting(person_id, camera_id, now, hist)
+        db_writer.execute('INSERT INTO person_segments (id, person_id, camera_id, start_at, end_at) VALUES (?, ?, ?, ?, ?)',
+                          (sighting.segment_id, person_id, camera_id, db_timestamp(now), db_timestamp(now)))
+        db_writer.execute('UPDATE persons SET appearances = appearances + 1, last_seen = ?, last_camera = ? WHERE id = ?',
+                          (db_timestamp(now), camera_id, person_id))
+        return sighting
+
+    def _close(self, sighting):
+        db_writer.execute('UPDATE person_segments SET end_at = ? WHERE id = ?',
+                          (db_timestamp(sighting.last_seen), sighting.segment_id))
+        db_writer.execute('UPDATE persons SET last_seen = MAX(last_seen, ?) WHERE id = ?',
+                          (db_timestamp(sighting.last_seen), sighting.person_id))
+        self.recently_lost.append((sighting.person_id, sighting.hist, sighting.last_seen, sighting.camera_id))
+        self.segments_closed += 1
+
+    def _link_face(self, sighting, face_id, name):
+        """A recognised face decides who this sighting is."""
+        if sighting.face_id == face_id:
+            return
+        sighting.face_id = face_id
+        known = self._face_person(face_id)
+        if known and known != sighting.person_id:
+            # Move the open segment over to the known person; drop the
+            # placeholder person if this was its only visit
+            db_writer.execute('UPDATE person_segments SET person_id = ? WHERE id = ?', (known, sighting.segment_id))
+            db_writer.execute('UPDATE persons SET appearances = appearances + 1, last_seen = ?, last_camera = ? WHERE id = ?',
+                              (db_timestamp(sighting.last_seen), sighting.camera_id, known))
+            db_writer.execute('DELETE FROM persons WHERE id = ? AND appearances <= 1 AND face_id IS NULL', (sighting.person_id,))
+            sighting.person_id = known
+        elif not known:
+            self.face_persons[face_id] = sighting.person_id
+            db_writer.execute('UPDATE persons SET face_id = ?, name = ? WHERE id = ?', (face_id, name, sighting.person_id))
+
+    def observe(self, camera_id, tracks, frame, faces=(), now=None):
+        """Feed the person tracks seen on one camera this frame."""
+        t0 = time.time()
+        now = now or t0
+        people = [t for t in tracks if normalize_label(t.cls) == 'person' and t.hits >= TRACK_MIN_HITS]
+        known_faces = [f for f in faces if f.get('face_id')]
+        with self.lock:
+            for track in people:
+                key = (camera_id, track.id)
+                sighting = self.sightings.get(key)
+                if sighting is None:
+                    sighting = self.sightings[key] = self._open(camera_id, track, frame, now)
+                sighting.last_seen = now
+                sighting.observations += 1
+                if sighting.observations % PERSON_HIST_REFRESH == 0:
+                    hist = appearance_histogram(frame, track.box)
+                    if hist is not None:
+                        sighting.hist = hist
+                for face in known_faces:
+                    fx1, fy1, fx2, fy2 = face['bbox']
+                    cx, cy = (fx1 + fx2) / 2, (fy1 + fy2) / 2
+                    if track.box[0] <= cx <= track.box[2] and track.box[1] <= cy <= track.box[3]:
+                        self._link_face(sighting, face['face_id'], face.get('name'))
+                        break
+                if now - sighting.last_flushed > PERSON_SEGMENT_FLUSH:
+                    # Long stays: keep end_at roughly current in case we crash
+                    db_writer.execute('UPDATE person_segments SET end_at = ? WHERE id = ?',
+                                      (db_timestamp(now), sighting.segment_id))
+                    sighting.last_flushed = now
+            self._expire(camera_id, now)
+        self.observe_ms.append((time.time() - t0) * 1000)
+
+    def _expire(self, camera_id, now):
+        for key in [k for k, s in self.sightings.items()
+                    if k[0] == camera_id and now - s.last_seen > PERSON_SEGMENT_GAP]:
+            self._close(self.sightings.pop(key))
+
+    def close_camera(self, camera_id):
+        """Camera stopped - end every open segment on it."""
+        with self.lock:
+            for key in [k for k in self.sightings if k[0] == camera_id]:
+                self._close(self.sightings.pop(key))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'active_sightings': len(self.sightings),
+                'persons_created': self.persons_created,
+                'reidentified': self.reidentified,
+                'segments_closed': self.segments_closed,
+                'observe_ms': latency_summary(list(self.observe_ms))
+            }
+
+
+person_registry = PersonRegistry()
+
+
+@app.route('/api/v1/tracker/persons')
+@token_required
+def get_tracked_persons():
+    limit = request.args.get('limit', 100, type=int)
+    conn = get_db()
+    rows = conn.execute('''SELECT p.id, p.name, p.face_id, p.last_seen, p.appearances,
+        COALESCE(c.name, p.last_camera) as last_camera
+        FROM persons p LEFT JOIN cameras c ON c.id = p.last_camera
+        ORDER BY p.last_seen DESC LIMIT ?''', (limit,)).fetchall()
+    conn.close()
+    return jsonify([{
+        'person_id': r['id'],
+        'name': r['name'],
+        'last_camera': r['last_camera'],
+        'last_seen': r['last_seen'],
+        'total_appearances': r['appearances'],
+        'is_known': r['face_id'] is not None
+    } for r in rows])
+
+
+@app.route('/api/v1/tracker/timeline/<person_id>')
+@token_required
+def get_person_timeline(person_id):
+    """Entered/exited events for one person, newest first. Optional since/until
+    ('YYYY-MM-DD HH:MM:SS' UTC) bound the range; served from the
+    (person_id, start_at) index."""
+    since = request.args.get('since', '0000-00-00 00:00:00')
+    until = request.args.get('until', '9999-12-31 23:59:59')
+    limit = request.args.get('limit', 200, type=int)
+    conn = get_db()
+    rows = conn.execute('''SELECT s.id, s.camera_id, s.start_at, s.end_at,
+        COALESCE(c.name, s.camera_id) as camera_name
+        FROM person_segments s LEFT JOIN cameras c ON c.id = s.camera_id
+        WHERE s.person_id = ? AND s.start_at >= ? AND s.start_at <= ?
+        ORDER BY s.start_at DESC LIMIT ?''', (person_id, since, until, limit)).fetchall()
+    conn.close()
+    
+    with person_registry.lock:
+        open_segments = {s.segment_id for s in person_registry.sightings.values()}
+    events = []
+    for r in rows:
+        if r['id'] not in open_segments:
+            events.append({'id': f"{r['id']}:out", 'camera_id': r['camera_id'], 'camera_name': r['camera_name'],
+                           'action': 'exited', 'timestamp': r['end_at']})
+        events.append({'id': f"{r['id']}:in", 'camera_id': r['camera_id'], 'camera_name': r['camera_name'],
+                       'action': 'entered', 'timestamp': r['start_at']})
+    return jsonify(events)
+
+
+@app.route('/api/v1/tracker/stats')
+@token_required
+def get_tracker_stats():
+    return jsonify(person_registry.stats())
+
+
+# ===== PLATE RECOGNITION =====
+def normalize_plate(text):
+    plate = ''.join(ch for ch in str(text).upper() if ch.isalnum())
+    return plate if ANPR_PLATE_LENGTH[0] <= len(plate) <= ANPR_PLATE_LENGTH[1] else None
+
+
+def plates_match(a, b):
+    """Same plate, allowing one misread character (OCR noise between reads)."""
+    if a == b:
+        return True
+    return len(a) == len(b) and sum(x != y for x, y in zip(a, b)) <= 1
+
+
+def plate_crop(frame, box):
+    """The part of a truck box where the plate sits (ANPR_PLATE_REGION), or
+    None if the truck is too small to read. A view into the frame."""
+    h, w = frame.shape[:2]
+    x1, y1, x2, y2 = [float(v) for v in box]
+    if x2 - x1 < ANPR_MIN_WIDTH:
+        return None
+    rx1, ry1, rx2, ry2 = ANPR_PLATE_REGION
+    bw, bh = x2 - x1, y2 - y1
+    cx1, cy1 = max(0, int(x1 + rx1 * bw)), max(0, int(y1 + ry1 * bh))
+    cx2, cy2 = min(w, int(x1 + rx2 * bw)), min(h, int(y1 + ry2 * bh))
+    if cx2 - cx1 < 16 or cy2 - cy1 < 8:
+        return None
+    return frame[cy1:cy2, cx1:cx2]
+
+
+def plate_quality(crop, score):
+    """Sharpness (variance of the Laplacian) x size x detector confidence -
+    the frame with the highest value is the one worth OCR-ing."""
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    if gray.shape[1] > 320:
+        gray = cv2.resize(gray, (320, max(1, gray.shape[0] * 320 // gray.shape[1])), interpolation=cv2.INTER_AREA)
+    sharpness = cv2.Laplacian(gray, cv2.CV_32F).var()
+    return float(sharpness) * min(1.0, crop.shape[1] / ANPR_GOOD_WIDTH) * score
+
+
+class PlateReader:
+    """OCR engine, initialised on first use and then kept: PaddleOCR, else
+    EasyOCR, else Tesseract. read() returns (text, confidence) or None."""
+    def __init__(self):
+        self.engine = None
+        self.name = None
+        self.error = None
+        self.lock = threading.Lock()
+
+    def _init(self):
+        os.environ.setdefault('FLAGS_log_level', '3')
+        attempts = (
+            ('paddleocr', lambda: __import__('paddleocr').PaddleOCR(use_angle_cls=True, lang='en')),
+            ('paddleocr', lambda: __import__('paddleocr').PaddleOCR(lang='en')),
+            ('easyocr', lambda: __import__('easyocr').Reader(['en'], gpu=False, verbose=False)),
+            ('tesseract', self._tesseract),
+        )
+        errors, missing = [], set()
+        for name, factory in attempts:
+            if name in missing:
+                continue
+            try:
+                self.engine, self.name = factory(), name
+                print(f"✅ Plate OCR engine: {name}")
+                return True
+            except ImportError as e:
+                missing.add(name)
+                errors.append(f"{name}: {e}")
+            except Exception as e:
+                errors.append(f"{name}: {e}")
+        self.error = '; '.join(errors)
+        print(f"⚠️ No OCR engine available - plate recognition disabled ({self.error})")
+        return False
+
+    @staticmethod
+    def _tesseract():
+        import pytesseract
+        pytesseract.get_tesseract_version()   # raises if the binary is missing
+        return pytesseract
+
+    def available(self):
+        with self.lock:
+            return self.engine is not None or (self.error is None and self._init())
+
+    def read(self, crop):
+        if not self.available():
+            return None
+        if crop.shape[0] < 48:
+            # Small plates read much better upscaled
+            crop = cv2.resize(crop, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+        if self.name == 'paddleocr':
+            fragments = self._read_paddle(crop)
+        elif self.name == 'easyocr':
+            fragments = [(text, conf) for _, text, conf in self.engine.readtext(crop)]
+        else:
+            fragments = self._read_tesseract(crop)
+        fragments = [(t, float(c)) for t, c in fragments if t and str(t).strip()]
+        if not fragments:
+            return None
+        # Two-line plates come back as two fragments
+        text = ''.join(t for t, _ in fragments)
+        return text, sum(c for _, c in fragments) / len(fragments)
+
+    def _read_paddle(self, crop):
+        if hasattr(self.engine, 'predict'):
+            fragments = []
+            for page in self.engine.predict(crop) or []:
+                fragments += zip(page.get('rec_texts', []), page.get('rec_scores', []))
+            return fragments
+        result = self.engine.ocr(crop, cls=True) or []
+        return [line[1] for page in result if page for line in page]
+
+    def _read_tesseract(self, crop):
+        data = self.engine.image_to_data(
+            cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY), output_type=self.engine.Output.DICT,
+            config='--psm 7 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789')
+        return [(t, float(c) / 100) for t, c in zip(data['text'], data['conf']) if float(c) >= 0]
+
+    def stats(self):
+        return {'engine': self.name, 'error': self.error}
+
+
+class PlateCandidate:
+    """A truck track being watched for its best plate view."""
+    __slots__ = ('camera_id', 'track_id', 'first_seen', 'last_seen', 'observations',
+                 'best_crop', 'best_quality', 'direction', 'submitted')
+
+    def __init__(self, camera_id, track_id, now):
+        self.camera_id = camera_id
+        self.track_id = track_id
+        self.first_seen = now
+        self.last_seen = now
+        self.observations = 0
+        self.best_crop = None
+        self.best_quality = 0.0
+        self.direction = None
+        self.submitted = False
+
+
+class PlateRecognizer:
+    """Server-side ANPR over the truck tracks of every camera.
+
+    observe() keeps, per track, a copy of the sharpest plate crop seen so far.
+    Each track is OCR'd once - when it crosses a counting line, or when it
+    leaves - on a single background worker, so the capture loops never wait
+    on OCR. A truck parked short of the line keeps its best crop until then. Reads are validated, deduplicated per (plate, direction, camera)
+    within ANPR_DEDUP_WINDOW (allowing one misread character) and queued to
+    the batched DB writer; trucks that never crossed a line log 'UNKNOWN'."""
+    def __init__(self):
+        self.reader = PlateReader()
+        self.candidates = {}
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=ANPR_QUEUE_SIZE)
+        self.thread = None
+        self.recent = OrderedDict()   # (plate, direction, camera_id) -> logged_at
+        self.ocr_calls = 0
+        self.ocr_reads = 0
+        self.ocr_times = deque(maxlen=500)
+        self.ocr_ms = deque(maxlen=500)
+        self.dropped = 0
+        self.rejected = 0
+        self.duplicates = 0
+        self.logged = 0
+
+    def observe(self, camera_id, tracks, frame, now, crossings=()):
+        if not ANPR_ENABLED or self.reader.error:
+            return
+        with self.lock:
+            for track in tracks:
+                if normalize_label(track.cls) not in ANPR_CLASSES or track.hits < TRACK_MIN_HITS:
+                    continue
+                key = (camera_id, track.id)
+                candidate = self.candidates.get(key)
+                if candidate is None:
+                    candidate = self.candidates[key] = PlateCandidate(camera_id, track.id, now)
+                candidate.last_seen = now
+                candidate.observations += 1
+                if candidate.submitted:
+                    continue
+                crop = plate_crop(frame, track.box)
+                if crop is None:
+                    continue
+                quality = plate_quality(crop, track.score)
+                if quality > candidate.best_quality:
+                    # Only the winning crop is copied out of the shared frame
+                    candidate.best_crop, candidate.best_quality = crop.copy(), quality
+            for track, _, direction in crossings:
+                candidate = self.candidates.get((camera_id, track.id))
+                if candidate is not None:
+                    candidate.direction = direction
+            self._due(camera_id, now)
+
+    def _due(self, camera_id, now, closing=False):
+        for key, candidate in list(self.candidates.items()):
+            if key[0] != camera_id:
+                continue
+            gone = closing or now - candidate.last_seen > ANPR_TRACK_GONE
+            crossed = candidate.direction is not None and candidate.observations >= ANPR_SETTLE_FRAMES
+            if not candidate.submitted and candidate.best_crop is not None and (gone or crossed):
+                self._submit(candidate)
+            if gone:
+                del self.candidates[key]
+
+    def _submit(self, candidate):
+        candidate.submitted = True
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True, name='anpr')
+            self.thread.start()
+        job = (candidate.camera_id, candidate.track_id, candidate.first_seen,
+               candidate.direction, candidate.best_crop)
+        candidate.best_crop = None
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            self.dropped += 1
+
+    def close_camera(self, camera_id):
+        """Camera stopped - read whatever its trucks still have pending."""
+        with self.lock:
+            self._due(camera_id, time.time(), closing=True)
+
+    def _run(self):
+        while True:
+            camera_id, track_id, seen_at, direction, crop = self.queue.get()
+            t0 = time.time()
+            try:
+                result = self.reader.read(crop)
+            except Exception as e:
+                print(f"⚠️ Plate OCR failed: {e}")
+                result = None
+            if self.reader.engine is None:
+                continue
+            self.ocr_calls += 1
+            self.ocr_times.append(t0)
+            self.ocr_ms.append((time.time() - t0) * 1000)
+            if result is None:
+                continue
+            self.ocr_reads += 1
+            plate = normalize_plate(result[0])
+            if plate is None or result[1] < ANPR_MIN_CONFIDENCE:
+                self.rejected += 1
+                continue
+            self._log(plate, result[1], camera_id, direction, seen_at)
+
+    def _log(self, plate, confidence, camera_id, direction, seen_at):
+        now = time.time()
+        with self.lock:
+            while self.recent and now - next(iter(self.recent.values())) > ANPR_DEDUP_WINDOW:
+                self.recent.popitem(last=False)
+            # A truck leaving shortly after it arrived, or seen by another
+            # camera, is a new event - only the same pass is a duplicate
+            direction = direction or 'UNKNOWN'
+            if any(plates_match(plate, seen) and (seen_direction, seen_camera) == (direction, camera_id)
+                   for seen, seen_direction, seen_camera in self.recent):
+                self.duplicates += 1
+                return
+            self.recent[(plate, direction, camera_id)] = now
+            self.logged += 1
+        db_writer.execute(
+            'INSERT INTO trucks (id, plate_number, direction, confidence, camera_id, detected_at) VALUES (?, ?, ?, ?, ?, ?)',
+            (str(uuid.uuid4()), plate, direction, round(confidence, 3), camera_id, db_timestamp(seen_at)))
+        print(f"🚚 Plate {plate} ({direction}) on camera {camera_id}")
+
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            active = len(self.candidates)
+        return {
+            'enabled': ANPR_ENABLED,
+            **self.reader.stats(),
+            'active_tracks': active,
+            'queued': self.queue.qsize(),
+            'dropped': self.dropped,
+            'ocr_calls': self.ocr_calls,
+            'ocr_per_min': sum(1 for t in self.ocr_times if now - t < 60),
+            'ocr_ms': latency_summary(list(self.ocr_ms)),
+            'read_rate': round(self.ocr_reads / self.ocr_calls, 3) if self.ocr_calls else None,
+            'rejected': self.rejected,
+            'duplicates': self.duplicates,
+            'logged': self.logged
+        }
+
+
+plate_recognizer = PlateRecognizer()
+
+
+# ===== LIVE EVENTS =====
+class EventClient:
+    """One SSE connection. Pending events are keyed by (topic, key) so a
+    burst of updates for the same camera/product collapses to the newest."""
+    def __init__(self, topics, cameras, interval):
+        self.id = str(uuid.uuid4())
+        self.topics = topics
+        self.cameras = cameras
+        self.interval = interval
+        self.pending = OrderedDict()
+        self.cond = threading.Condition()
+        self.sent = 0
+        self.coalesced = 0
+
+    def wants(self, topic, key):
+        if self.topics and topic not in self.topics:
+            return False
+        return not (self.cameras and topic in CAMERA_TOPICS and key not in self.cameras)
+
+    def push(self, topic, key, message):
+        with self.cond:
+            if (topic, key) in self.pending:
+                self.coalesced += 1
+                self.pending.pop((topic, key))
+            self.pending[(topic, key)] = message
+            self.cond.notify()
+
+    def drain(self, timeout):
+        with self.cond:
+            self.cond.wait_for(lambda: self.pending, timeout)
+            messages = list(self.pending.values())
+            self.pending.clear()
+        self.sent += len(messages)
+        return messages
+
+
+class EventBus:
+    """Fan-out for live updates. Each event is serialised once and handed to
+    every matching client; the last event per (topic, key) is retained so new
+    clients get current state on connect without hitting the DB."""
+    def __init__(self):
+        self.clients = {}
+        self.lock = threading.Lock()
+        self.retained = {}
+        self.next_id = 0
+        self.published = 0
+
+    def wants(self, topic):
+        """Is anyone listening? Lets publishers skip building expensive payloads."""
+        with self.lock:
+            return any(not c.topics or topic in c.topics for c in self.clients.values())
+
+    def publish(self, topic, key, data):
+        with self.lock:
+            self.next_id += 1
+            message = f"id: {self.next_id}\nevent: {topic}\ndata: {json.dumps(data, default=str)}\n\n"
+            self.retained[(topic, key)] = message
+            clients = [c for c in self.clients.values() if c.wants(topic, key)]
+            self.published += 1
+        for client in clients:
+            client.push(topic, key, message)
+
+    def forget(self, topic, key):
+        with self.lock:
+            self.retained.pop((topic, key), None)
+
+    def subscribe(self, topics=None, cameras=None, interval=EVENT_MIN_INTERVAL):
+        client = EventClient(topics, cameras, interval)
+        with self.lock:
+            self.clients[client.id] = client
+            retained = [(t, k, m) for (t, k), m in self.retained.items() if client.wants(t, k)]
+        for topic, key, message in retained:
+            client.push(topic, key, message)
+        return client
+
+    def unsubscribe(self, client):
+        with self.lock:
+            self.clients.pop(client.id, None)
+
+    def stream(self, client):
+        try:
+            yield f"retry: {EVENT_RETRY_MS}\n\n"
+            while True:
+                started = time.time()
+                messages = client.drain(EVENT_KEEPALIVE)
+                if not messages:
+                    yield ': keepalive\n\n'
+                    continue
+                yield ''.join(messages)
+                # Hold off for the client's interval; anything arriving
+                # meanwhile is coalesced into the next batch
+                wait = client.interval - (time.time() - started)
+                if wait > 0:
+                    time.sleep(wait)
+        finally:
+            self.unsubscribe(client)
+
+    def stats(self):
+        with self.lock:
+            clients = list(self.clients.values())
+            return {
+                'clients': len(clients),
+                'published': self.published,
+                'retained': len(self.retained),
+                'sent': sum(c.sent for c in clients),
+                'coalesced': sum(c.coalesced for c in clients)
+            }
+
+
+event_bus = EventBus()
+
+
+def dashboard_snapshot(conn):
+    inv = conn.execute('SELECT SUM(count_in) as total_in, SUM(count_out) as total_out, SUM(current_stock) as total_stock FROM inventory').fetchone()
+    det_count = conn.execute("SELECT SUM(count) as count FROM detection_rollups WHERE granularity = 'hour' AND bucket >= strftime('%Y-%m-%d 00:00', 'now')").fetchone()
+    inventory = conn.execute('SELECT product_name, count_in, count_out, current_stock FROM inventory').fetchall()
+    return {
+        'total_in': inv['total_in'] or 0,
+        'total_out': inv['total_out'] or 0,
+        'total_stock': inv['total_stock'] or 0,
+        'detections_today': det_count['count'] or 0,
+        'inventory': [dict(i) for i in inventory]
+    }
+
+
+@app.route('/api/v1/events')
+@token_required
+def live_events():
+    """Server-Sent Events: detections, counts, inventory, camera status.
+    ?topics=detections,inventory  ?camera_id=c1,c2  ?interval_ms=250"""
+    topics = {t for t in request.args.get('topics', '').split(',') if t} or None
+    if topics and not topics <= EVENT_TOPICS:
+        return jsonify({'error': f"Unknown topic, expected {sorted(EVENT_TOPICS)}"}), 400
+    cameras = {c for c in request.args.get('camera_id', '').split(',') if c} or None
+    interval = max(0.0, request.args.get('interval_ms', EVENT_MIN_INTERVAL * 1000, type=float) / 1000)
+    
+    client = event_bus.subscribe(topics, cameras, interval)
+    return Response(event_bus.stream(client), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/v1/events/stats')
+@token_required
+def live_event_stats():
+    return jsonify(event_bus.stats())
+
+
+# ===== VIDEO FEED =====
+LIVE_SOURCE_PREFIXES = ('rtsp://', 'rtmp://', 'http://', 'https://', 'udp://', 'tcp://')
+
+
+class VideoCamera:
+    """Capture worker. Publishes every frame into a small drop-oldest buffer
+    with a sequence number; consumers block in wait_for_frame() instead of
+    polling."""
+    def __init__(self, source=0, camera_id=DEFAULT_CAMERA_ID):
+        self.source = source
+        self.camera_id = camera_id
+        self.cap = None
+        self.frame = None
+        self.running = False
+        self.thread = None
+        self._status = None
+        self.status = 'stopped'
+        self.reconnects = 0
+        self.last_error = None
+        self.is_live = isinstance(source, int) or str(source).lower().startswith(LIVE_SOURCE_PREFIXES)
+        self._stop_event = threading.Event()
+        self.cond = threading.Condition()
+        self.buffer = deque(maxlen=FRAME_BUFFER_SIZE)
+        self.seq = 0
+        self.last_read_seq = 0
+        self.dropped_frames = 0
+        self.source_fps = 0.0
+        self.capture_fps = 0.0
+
+    @property
+    def status(self):
+        return self._status
+
+    @status.setter
+    def status(self, value):
+        if value != self._status:
+            self._status = value
+            event_bus.publish('camera', self.camera_id, {'camera_id': self.camera_id, 'status': value})
+
+    def start(self):
+        if self.running:
+            return
+        self.cap = self._open()
+        if not self.cap.isOpened():
+            raise Exception(f"Cannot open camera: {self.source}")
+        self.running = True
+        self.status = 'online'
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._update, daemon=True)
+        self.thread.start()
+
+    def _open(self):
+        cap = cv2.VideoCapture(self.source)
+        if self.is_live:
+            # Keep the backend's own queue short so we always read fresh frames
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        self.source_fps = fps if fps and 1 <= fps <= 240 else 25.0
+        return cap
+
+    def _update(self):
+        backoff = RECONNECT_BACKOFF_MIN
+        next_due = time.time()
+        try:
+            while self.running:
+                ret, frame = self.cap.read()
+                if ret:
+                    self._publish(frame)
+                    self.status = 'online'
+                    backoff = RECONNECT_BACKOFF_MIN
+                elif not self.is_live:
+                    # End of a recorded file - nothing to reconnect to
+                    self.status = 'ended'
+                    break
+                else:
+                    backoff = self._reconnect(backoff)
+                    next_due = time.time()
+                    continue
+
+                if not self.is_live:
+                    # Files decode faster than real time; play them at their
+                    # own FPS. Live sources are paced by the blocking read.
+                    next_due += 1.0 / self.source_fps
+                    delay = next_due - time.time()
+                    if delay > 0:
+                        self._stop_event.wait(delay)
+                    else:
+                        next_due = time.time()
+        finally:
+            self.running = False
+            with self.cond:
+                self.cond.notify_all()
+            if self.cap:
+                self.cap.release()
+
+    def _publish(self, frame):
+        now = time.time()
+        with self.cond:
+            if len(self.buffer) == self.buffer.maxlen and self.buffer[0][0] > self.last_read_seq:
+                # Oldest frame is about to fall off without anyone reading it
+                self.dropped_frames += 1
+            if self.buffer:
+                interval = now - self.buffer[-1][2]
+                if interval > 0:
+                    self.capture_fps = 0.9 * self.capture_fps + 0.1 / interval
+            self.seq += 1
+            # Shared by inference, overlays, faces and snapshots - nobody draws on it
+            frame.flags.writeable = False
+            self.buffer.append((self.seq, frame, now))
+            self.frame = frame
+            self.cond.notify_all()
+
+    def wait_for_frame(self, after_seq=0, timeout=1.0):
+        """Block until a frame newer than after_seq is available.
+        Returns (seq, frame, captured_at) for the newest frame, or None."""
+        with self.cond:
+            self.cond.wait_for(lambda: not self.running or self.seq > after_seq, timeout)
+            if self.seq <= after_seq:
+                return None
+            item = self.buffer[-1]
+            self.last_read_seq = max(self.last_read_seq, item[0])
+            return item
+
+    def _reconnect(self, backoff):
+        """Reopen a dropped live stream with exponential backoff."""
+        self.status = 'reconnecting'
+        self.cap.release()
+        print(f"⚠️ Camera {self.camera_id} lost, reconnecting in {backoff:.0f}s")
+        if self._stop_event.wait(backoff):
+            return backoff
+        self.reconnects += 1
+        self.cap = self._open()
+        if self.cap.isOpened():
+            print(f"✅ Camera {self.camera_id} reconnected")
+            return RECONNECT_BACKOFF_MIN
+        self.last_error = f"Cannot open camera: {self.source}"
+        return min(backoff * 2, RECONNECT_BACKOFF_MAX)
+
+    def get_frame(self):
+        return self.frame
+
+    def stop(self):
+        # The capture thread releases self.cap on its way out; releasing it
+        # here could race with a blocking read()
+        self.running = False
+        self.status = 'stopped'
+        self._stop_event.set()
+        with self.cond:
+            self.cond.notify_all()
+
+    def stats(self):
+        return {
+            'source': str(self.source),
+            'status': self.status,
+            'reconnects': self.reconnects,
+            'last_error': self.last_error,
+            'seq': self.seq,
+            'source_fps': round(self.source_fps, 1),
+            'capture_fps': round(self.capture_fps, 1),
+            'dropped_frames': self.dropped_frames
+        }
+
+
+def run_model_batch(model_name, frames, imgsz=None):
+    """Run one model over a list of frames. Returns one detection list per frame."""
+    if not frames:
+        return []
+    model = model_registry.get(model_name)
+    if not model:
+        return [[] for _ in frames]
+    return detect_batch(model, model_name, frames, imgsz)
+
+
+class FrameResult:
+    """Everything one processed frame produced, in compact form: boxes,
+    classes, scores and track ids as NumPy arrays next to the raw frame, which
+    is shared read-only with every other consumer. The annotated image and
+    its JPEG are only rendered when a stream or snapshot asks for them, once
+    per frame; the dict view for the API / events is built on first use."""
+    __slots__ = ('seq', 'camera_id', 'captured_at', 'frame', 'boxes', 'classes', 'scores',
+                 'track_ids', 'labels', 'model', 'faces', 'lines', 'roi', 'owner',
+                 '_dicts', '_annotated', '_jpeg', '_variants', '_lock')
+
+    def __init__(self, seq, camera_id, captured_at, frame, boxes, classes, scores, track_ids,
+                 labels, model, faces=(), lines=(), roi=None, owner=None):
+        self.seq = seq
+        self.camera_id = camera_id
+        self.captured_at = captured_at
+        self.frame = frame
+        self.boxes = boxes
+        self.classes = classes
+        self.scores = scores
+        self.track_ids = track_ids
+        self.labels = labels
+        self.model = model
+        self.faces = faces
+        self.lines = lines
+        self.roi = roi
+        self.owner = owner
+        self._dicts = None
+        self._annotated = None
+        self._jpeg = None
+        self._variants = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_detections(cls, seq, camera_id, captured_at, frame, detections, **extra):
+        labels = tuple(dict.fromkeys(d['class'] for d in detections))
+        index = {label: i for i, label in enumerate(labels)}
+        n = len(detections)
+        result = cls(
+            seq, camera_id, captured_at, frame,
+            np.array([d['bbox'] for d in detections], dtype=np.int32).reshape(n, 4),
+            np.fromiter((index[d['class']] for d in detections), dtype=np.int16, count=n),
+            np.fromiter((d['confidence'] for d in detections), dtype=np.float32, count=n),
+            np.fromiter((d.get('track_id') or 0 for d in detections), dtype=np.int32, count=n),
+            labels, detections[0]['model'] if detections else active_model_name, **extra)
+        result._dicts = detections
+        return result
+
+    def follow(self, seq, captured_at, frame, **extra):
+        """Same detections on a newer frame (the motion gate skipped inference)."""
+        result = FrameResult(seq, self.camera_id, captured_at, frame, self.boxes, self.classes,
+                             self.scores, self.track_ids, self.labels, self.model,
+                             **{'faces': self.faces, 'lines': self.lines, 'roi': self.roi,
+                                'owner': self.owner, **extra})
+        result._dicts = self._dicts
+        return result
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def detections(self):
+        if self._dicts is None:
+            self._dicts = [{
+                'class': self.labels[c],
+                'confidence': float(s),
+                'model': self.model,
+                'bbox': box.tolist(),
+                **({'track_id': int(t)} if t else {})
+            } for box, c, s, t in zip(self.boxes, self.classes, self.scores, self.track_ids)]
+        return self._dicts
+
+    def annotated(self):
+        with self._lock:
+            if self._annotated is None:
+                canvas = self.frame.copy()
+                draw_detections(canvas, self)
+                draw_faces(canvas, self.faces)
+                draw_count_lines(canvas, self.lines)
+                draw_roi(canvas, self.roi)
+                canvas.flags.writeable = False
+                self._annotated = canvas
+                if self.owner is not None:
+                    self.owner.rendered += 1
+            return self._annotated
+
+    def jpeg(self):
+        """Full-size annotated JPEG, encoded at most once; None if encoding failed."""
+        annotated = self.annotated()
+        with self._lock:
+            if self._jpeg is None:
+                t0 = time.time()
+                self._jpeg = encode_jpeg(annotated)
+                if self._jpeg is not None and self.owner is not None:
+                    self.owner.encode_ms.append((time.time() - t0) * 1000)
+            return self._jpeg
+
+    def variant(self, width=None, quality=None):
+        """(jpeg, encoded_now) of a downscaled / re-encoded copy, without the
+        full-size encode. Each (width, quality) is encoded once per frame,
+        however many streams and snapshot pollers ask for it."""
+        key = (width, quality)
+        with self._lock:
+            if self._variants and key in self._variants:
+                return self._variants[key], False
+        annotated = self.annotated()
+        with self._lock:
+            if self._variants and key in self._variants:
+                return self._variants[key], False
+            h, w = annotated.shape[:2]
+            frame = annotated
+            if width and width < w:
+                frame = cv2.resize(annotated, (width, int(h * width / w)), interpolation=cv2.INTER_AREA)
+            data = encode_jpeg(frame, quality)
+            if data is None:
+                return None, False
+            if self._variants is None:
+                self._variants = {}
+            if len(self._variants) < SNAPSHOT_MAX_VARIANTS:
+                self._variants[key] = data
+            if self.owner is not None:
+                self.owner.variant_encodes += 1
+            return data, True
+
+
+class DetectionRecord:
+    """One box of a history frame, as served by the API."""
+    __slots__ = ('cls', 'confidence', 'bbox', 'track_id')
+
+    def __init__(self, cls, confidence, bbox, track_id):
+        self.cls = cls
+        self.confidence = confidence
+        self.bbox = bbox
+        self.track_id = track_id
+
+    def to_dict(self):
+        det = {'class': self.cls, 'confidence': round(self.confidence, 4), 'bbox': self.bbox}
+        if self.track_id:
+            det['track_id'] = self.track_id
+        return det
+
+
+class FrameRecord:
+    __slots__ = ('seq', 'timestamp', 'detections')
+
+    def __init__(self, seq, timestamp, detections):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.detections = detections
+
+    def to_dict(self):
+        return {'seq': self.seq, 'timestamp': self.timestamp,
+                'detections': [d.to_dict() for d in self.detections]}
+
+
+class DetectionHistory:
+    """Recent inference results of one camera in two preallocated rings: one
+    row per inferred frame (seq, time, where its boxes start, how many) and
+    one row per box. append() only copies the FrameResult's arrays into the
+    rings, so memory is fixed however long the stream runs; the oldest
+    frames fall off first, also once their boxes have been overwritten.
+    Python records are only built when the API asks."""
+    def __init__(self, frames=HISTORY_FRAMES, boxes=HISTORY_BOXES):
+        self.frames = np.zeros(frames, dtype=HISTORY_FRAME_DTYPE)
+        self.boxes = np.zeros(boxes, dtype=HISTORY_BOX_DTYPE)
+        self.frame_head = 0     # frames ever appended; slot = index % capacity
+        self.box_head = 0
+        self.labels = []        # stored class id -> name
+        self.label_ids = {}
+        self.label_maps = {}    # FrameResult.labels tuple -> stored class ids
+        self.truncated = 0
+        self.lock = threading.Lock()
+
+    def _label_map(self, labels):
+        ids = self.label_maps.get(labels)
+        if ids is None:
+            for label in labels:
+                if label not in self.label_ids:
+                    self.label_ids[label] = len(self.labels)
+                    self.labels.append(label)
+            if len(self.label_maps) >= 256:
+                self.label_maps.clear()
+            ids = self.label_maps[labels] = np.array([self.label_ids[l] for l in labels], dtype=np.int16)
+        return ids
+
+    def append(self, result):
+        capacity = len(self.boxes)
+        count = min(len(result), capacity)
+        with self.lock:
+            self.truncated += len(result) - count
+            ids = self._label_map(result.labels)
+            start = self.box_head
+            done = 0
+            while done < count:
+                pos = (start + done) % capacity
+                n = min(count - done, capacity - pos)
+                dst = self.boxes[pos:pos + n]
+                dst['bbox'] = result.boxes[done:done + n]
+                dst['score'] = result.scores[done:done + n]
+                dst['cls'] = ids[result.classes[done:done + n]]
+                dst['track_id'] = result.track_ids[done:done + n]
+                done += n
+            self.box_head += count
+            self.frames[self.frame_head % len(self.frames)] = (result.seq, result.captured_at, start, count)
+            self.frame_head += 1
+
+    def _first_after(self, field, value, lo):
+        """First absolute frame index >= lo whose field exceeds value (fields
+        only grow, so a binary search over the ring works)."""
+        capacity = len(self.frames)
+        hi = self.frame_head
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.frames[mid % capacity][field] > value:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def query(self, since_seq=None, seconds=None, limit=HISTORY_QUERY_LIMIT):
+        """FrameRecords newer than since_seq and/or from the last `seconds`,
+        oldest first. At most `limit`: the first ones after since_seq (so a
+        client can page forward from its last seq), otherwise the newest."""
+        with self.lock:
+            start = max(0, self.frame_head - len(self.frames))
+            # Frames whose boxes were already overwritten by newer ones
+            start = self._first_after('box_start', self.box_head - len(self.boxes) - 1, start)
+            if since_seq is not None:
+                start = self._first_after('seq', since_seq, start)
+            if seconds is not None:
+                start = self._first_after('ts', time.time() - seconds, start)
+            end = self.frame_head
+            if limit and end - start > limit:
+                if since_seq is not None:
+                    end = start + limit
+                else:
+                    start = end - limit
+            rows = []
+            for i in range(start, end):
+                seq, ts, box_start, count = self.frames[i % len(self.frames)].tolist()
+                idx = np.arange(box_start, box_start + count) % len(self.boxes)
+                rows.append((seq, ts, self.boxes[idx].tolist()))
+            labels = list(self.labels)
+        return [FrameRecord(seq, ts, [DetectionRecord(labels[cls], score, bbox.tolist(), track_id)
+                                      for bbox, score, cls, track_id in boxes])
+                for seq, ts, boxes in rows]
+
+    def stats(self):
+        with self.lock:
+            stored = min(self.frame_head, len(self.frames))
+            oldest = self.frames[(self.frame_head - stored) % len(self.frames)] if stored else None
+            return {
+                'frames': stored,
+                'frame_capacity': len(self.frames),
+                'box_capacity': len(self.boxes),
+                'boxes_written': self.box_head,
+                'memory_kb': round((self.frames.nbytes + self.boxes.nbytes) / 1024, 1),
+                'oldest_seq': int(oldest['seq']) if oldest is not None else None,
+                'oldest_ts': float(oldest['ts']) if oldest is not None else None,
+                'truncated_boxes': self.truncated
+            }
+
+
+def draw_detections(frame, result):
+    # Color based on model type
+    color = (0, 255, 0) if result.model == 'best_dec20' else (255, 165, 0)
+    for (x1, y1, x2, y2), cls, score, track_id in zip(result.boxes.tolist(), result.classes,
+                                                      result.scores, result.track_ids):
+        label = f"{result.labels[cls]} ({score:.2f})"
+        if track_id:
+            label = f"#{track_id} {label}"
+
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(frame, label, (x1, y1-10),
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+    return frame
+
+
+def draw_count_lines(frame, lines):
+    h, w = frame.shape[:2]
+    for line in lines:
+        p1 = (int(line['p1'][0] * w), int(line['p1'][1] * h))
+        p2 = (int(line['p2'][0] * w), int(line['p2'][1] * h))
+        cv2.line(frame, p1, p2, (0, 255, 255), 2)
+    return frame
+
+
+def draw_roi(frame, roi):
+    if roi:
+        h, w = frame.shape[:2]
+        pts = (np.array(roi, dtype=np.float32) * [w, h]).astype(np.int32)
+        cv2.polylines(frame, [pts], True, (255, 255, 0), 1)
+    return frame
+
+
+def draw_faces(frame, faces):
+    for face in faces:
+        x1, y1, x2, y2 = face['bbox']
+        color = (255, 0, 255) if face['face_id'] else (0, 0, 255)
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(frame, face['name'], (x1, y2 + 15),
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+    return frame
+
+
+def encode_jpeg(frame, quality=None):
+    """BGR frame -> JPEG bytes (TurboJPEG when available, OpenCV otherwise)."""
+    quality = quality or STREAM_JPEG_QUALITY
+    if turbo_jpeg is not None:
+        return turbo_jpeg.encode(frame, quality=quality)
+    ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes() if ok else None
+
+
+class StreamSubscriber:
+    """One connected /video_feed client. Holds at most one pending frame.
+
+    Per-client options cap fps, width and JPEG quality. In adaptive mode the
+    time spent blocked handing a frame to the socket drives a step-down
+    level: first quality drops (STREAM_ADAPTIVE_QUALITY), then fps halves.
+    Levels recover slowly once sends stop blocking."""
+    def __init__(self, max_fps=None, width=None, quality=None, adaptive=False):
+        self.id = str(uuid.uuid4())[:8]
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.pending = None
+        self.sent = 0
+        self.skipped = 0
+        self.connected_at = time.time()
+        self.max_fps = max_fps
+        self.width = width
+        self.quality = quality
+        self.adaptive = adaptive
+        self.level = 0
+        self.calm_frames = 0
+        self.bytes_sent = 0
+        self.bandwidth = 0.0
+        self.last_sent_at = None
+        self.blocked_ms = deque(maxlen=100)
+
+    def push(self, seq, result):
+        with self.lock:
+            if self.pending is not None:
+                # Client hasn't taken the previous frame yet - drop it
+                self.skipped += 1
+            self.pending = (seq, result)
+        self.event.set()
+
+    def wait(self, timeout=1.0):
+        if not self.event.wait(timeout):
+            return None
+        with self.lock:
+            item = self.pending
+            self.pending = None
+            self.event.clear()
+        if item is not None:
+            self.sent += 1
+        return item
+
+    def current_quality(self):
+        if self.level == 0:
+            return self.quality
+        levels = STREAM_ADAPTIVE_QUALITY
+        q = levels[min(self.level, len(levels)) - 1]
+        return min(q, self.quality) if self.quality else q
+
+    def current_fps(self):
+        extra = self.level - len(STREAM_ADAPTIVE_QUALITY)
+        if extra <= 0:
+            return self.max_fps
+        return max(STREAM_MIN_FPS, (self.max_fps or STREAM_ADAPTIVE_BASE_FPS) / 2 ** extra)
+
+    def record_send(self, nbytes, blocked):
+        now = time.time()
+        if self.last_sent_at is not None and now > self.last_sent_at:
+            rate = nbytes / (now - self.last_sent_at)
+            self.bandwidth = 0.9 * self.bandwidth + 0.1 * rate if self.bandwidth else rate
+        self.last_sent_at = now
+        self.bytes_sent += nbytes
+        self.blocked_ms.append(blocked * 1000)
+        if not self.adaptive:
+            return
+        budget = 1.0 / (self.current_fps() or STREAM_ADAPTIVE_BASE_FPS)
+        if blocked > STREAM_BACKPRESSURE_RATIO * budget:
+            self.level = min(self.level + 1, len(STREAM_ADAPTIVE_QUALITY) + STREAM_ADAPTIVE_FPS_STEPS)
+            self.calm_frames = 0
+        elif blocked < 0.1 * budget:
+            self.calm_frames += 1
+            if self.calm_frames >= STREAM_RECOVER_FRAMES and self.level > 0:
+                self.level -= 1
+                self.calm_frames = 0
+
+    def stats(self):
+        elapsed = max(time.time() - self.connected_at, 1e-6)
+        return {
+            'id': self.id,
+            'sent': self.sent,
+            'skipped': self.skipped,
+            'connected_for': round(elapsed, 1),
+            'options': {'max_fps': self.max_fps, 'width': self.width,
+                        'quality': self.quality, 'adaptive': self.adaptive},
+            'level': self.level,
+            'quality': self.current_quality() or STREAM_JPEG_QUALITY,
+            'fps_cap': self.current_fps(),
+            'bytes_sent': self.bytes_sent,
+            'kbps': round(self.bandwidth * 8 / 1000, 1),
+            'avg_kbps': round(self.bytes_sent * 8 / 1000 / elapsed, 1),
+            'send_blocked_ms': latency_summary(list(self.blocked_ms))
+        }
+
+
+class MotionGate:
+    """Cheap per-camera check in front of the model. Compares a small blurred
+    grayscale thumbnail against the one from the last inference and only lets
+    the frame through when enough pixels changed (or every max_skip frames, so
+    detections never go fully stale)."""
+    def __init__(self, enabled=MOTION_GATE_ENABLED, threshold=MOTION_THRESHOLD,
+                 stride=INFERENCE_STRIDE, max_skip=MOTION_MAX_SKIP):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.stride = stride
+        self.max_skip = max_skip
+        self.reference = None
+        self.frame_index = 0
+        self.skipped_in_row = 0
+        self.last_score = 0.0
+        self.frames = 0
+        self.inferences = 0
+        self.saved_static = 0
+        self.saved_stride = 0
+
+    def _thumbnail(self, frame):
+        h, w = frame.shape[:2]
+        size = (MOTION_GATE_WIDTH, max(1, int(h * MOTION_GATE_WIDTH / w)))
+        small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def should_infer(self, frame):
+        self.frames += 1
+        self.frame_index += 1
+        if not self.enabled:
+            self.inferences += 1
+            return True
+
+        force = self.reference is None or self.skipped_in_row >= self.max_skip
+        if not force and self.stride > 1 and self.frame_index % self.stride:
+            self.saved_stride += 1
+            self.skipped_in_row += 1
+            return False
+
+        thumb = self._thumbnail(frame)
+        if not force:
+            if thumb.shape != self.reference.shape:
+                force = True
+            else:
+                diff = cv2.absdiff(thumb, self.reference)
+                self.last_score = float(np.count_nonzero(diff > MOTION_PIXEL_DELTA)) / diff.size
+                if self.last_score < self.threshold:
+                    self.saved_static += 1
+                    self.skipped_in_row += 1
+                    return False
+
+        self.reference = thumb
+        self.skipped_in_row = 0
+        self.inferences += 1
+        return True
+
+    def configure(self, settings):
+        for key in ('enabled', 'threshold', 'stride', 'max_skip'):
+            if key in settings:
+                setattr(self, key, type(getattr(self, key))(settings[key]))
+        self.stride = max(1, self.stride)
+        self.max_skip = max(1, self.max_skip)
+
+    def stats(self):
+        saved = self.saved_static + self.saved_stride
+        return {
+            'enabled': self.enabled,
+            'threshold': self.threshold,
+            'stride': self.stride,
+            'max_skip': self.max_skip,
+            'frames': self.frames,
+            'inferences': self.inferences,
+            'saved': saved,
+            'saved_static': self.saved_static,
+            'saved_stride': self.saved_stride,
+            'saved_pct': round(100.0 * saved / self.frames, 1) if self.frames else 0,
+            'last_motion_score': round(self.last_score, 4)
+        }
+
+
+def parse_roi(raw):
+    """Validate an ROI polygon [[x, y], ...] in 0-1 coords; None/[] = whole frame."""
+    points = json.loads(raw) if isinstance(raw, str) else raw
+    if not points:
+        return None
+    if not isinstance(points, list) or len(points) < 3:
+        raise ValueError('roi must be a polygon of at least 3 [x, y] points')
+    clean = []
+    for point in points:
+        if not (isinstance(point, (list, tuple)) and len(point) == 2):
+            raise ValueError('each roi point must be [x, y]')
+        x, y = float(point[0]), float(point[1])
+        if not (0 <= x <= 1 and 0 <= y <= 1):
+            raise ValueError('roi points must be in 0-1 coords')
+        clean.append([x, y])
+    return clean
 
-@app.route('/api/v1/faces/detections')
-@token_required
-def get_face_detections():
-    limit = request.args.get('limit', 50, type=int)
-    conn = get_db()
-    dets = conn.execute('SELECT * FROM face_detections ORDER BY detected_at DESC LIMIT ?', (limit,)).fetchall()
-    conn.close()
-    return jsonify([dict(d) for d in dets])
 
+def parse_infer_size(raw):
+    """Longest side (px) the model sees; None = the model's own size."""
+    if raw in (None, '', 0):
+        return None
+    size = int(raw)
+    lo, hi = INFER_SIZE_LIMITS
+    if not lo <= size <= hi:
+        raise ValueError(f'infer_size must be between {lo} and {hi}')
+    return size
 
-# ===== COMPRESSION =====
-compression_jobs = {}
 
-@app.route('/api/v1/compression/upload', methods=['POST'])
-@token_required
-def compression_upload():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file'}), 400
-    
-    file = request.files['file']
-    level = request.form.get('level', 'medium')
-    
-    job_id = str(uuid.uuid4())[:8]
-    input_path = UPLOAD_DIR / f"{job_id}_input{Path(file.filename).suffix}"
-    output_path = UPLOAD_DIR / f"{job_id}_output.mp4"
-    
-    file.save(input_path)
-    original_size = input_path.stat().st_size
-    
-    compression_jobs[job_id] = {
-        'status': 'processing',
-        'original_size': original_size,
-        'original_filename': file.filename,
-        'level': level
-    }
-    
-    def compress():
-        try:
-            crf = '28' if level == 'medium' else '35'
-            cmd = ['ffmpeg', '-y', '-i', str(input_path), '-c:v', 'libx264', '-crf', crf, 
-                   '-preset', 'fast', '-c:a', 'aac', '-movflags', '+faststart', str(output_path)]
-            subprocess.run(cmd, capture_output=True, timeout=600)
-            
-            if output_path.exists():
-                compression_jobs[job_id]['status'] = 'completed'
-                compression_jobs[job_id]['compressed_size'] = output_path.stat().st_size
-                compression_jobs[job_id]['download_url'] = f'/api/v1/compression/download/{job_id}'
-            else:
-                compression_jobs[job_id]['status'] = 'failed'
-        except Exception as e:
-            compression_jobs[job_id]['status'] = 'failed'
-            compression_jobs[job_id]['error'] = str(e)
-    
-    threading.Thread(target=compress, daemon=True).start()
-    
-    return jsonify({'job_id': job_id, 'status': 'processing', 'original_size': original_size})
+class InferenceRegion:
+    """Which part of a camera's frame the model sees, and at what size.
 
+    prepare() crops the frame to the ROI polygon's bounding box (a view, no
+    copy) and downscales it so its longest side is infer_size. restore() maps
+    boxes back to full-frame pixels and drops those whose centre falls outside
+    the polygon. The pixel geometry is only recomputed when the frame size or
+    the settings change."""
+    def __init__(self, roi=None, infer_size=None):
+        self.roi = roi
+        self.infer_size = infer_size
+        self.lock = threading.Lock()
+        self.shape = None
+        self.view = None
+        self.outside = 0
 
-@app.route('/api/v1/compression/status/<job_id>')
-@token_required
-def compression_status(job_id):
-    job = compression_jobs.get(job_id)
-    if not job:
-        return jsonify({'error': 'Job not found'}), 404
-    
-    result = {**job}
-    if job.get('compressed_size') and job.get('original_size'):
-        result['compression_ratio'] = round((1 - job['compressed_size'] / job['original_size']) * 100, 1)
-    
-    return jsonify(result)
+    def configure(self, roi, infer_size):
+        with self.lock:
+            self.roi, self.infer_size = roi, infer_size
+            self.shape = None
 
+    def _geometry(self, shape):
+        """(x0, y0, x1, y1) crop, scale, polygon relative to the crop (None when
+        the ROI is its own bounding box), model input (h, w), imgsz."""
+        h, w = shape[:2]
+        x0, y0, x1, y1, polygon = 0, 0, w, h, None
+        if self.roi:
+            pts = np.array(self.roi, dtype=np.float32) * [w, h]
+            bx0, by0 = np.floor(pts.min(axis=0)).astype(int)
+            bx1, by1 = np.ceil(pts.max(axis=0)).astype(int)
+            bx0, by0, bx1, by1 = max(0, bx0), max(0, by0), min(w, bx1), min(h, by1)
+            if bx1 - bx0 >= 8 and by1 - by0 >= 8:
+                x0, y0, x1, y1 = int(bx0), int(by0), int(bx1), int(by1)
+                rel = (pts - [x0, y0]).astype(np.float32)
+                if cv2.contourArea(rel) < 0.99 * (x1 - x0) * (y1 - y0):
+                    polygon = rel
+        cw, ch = x1 - x0, y1 - y0
+        scale = min(1.0, self.infer_size / max(cw, ch)) if self.infer_size else 1.0
+        input_shape = (max(1, round(ch * scale)), max(1, round(cw * scale)))
+        imgsz = max(input_shape) if self.infer_size else None
+        return (x0, y0, x1, y1), scale, polygon, input_shape, imgsz
 
-@app.route('/api/v1/compression/download/<job_id>')
-def compression_download(job_id):
-    output_path = UPLOAD_DIR / f"{job_id}_output.mp4"
-    if not output_path.exists():
-        return jsonify({'error': 'File not found'}), 404
-    
-    return send_file(output_path, as_attachment=True, download_name=f'compressed_{job_id}.mp4')
+    def prepare(self, frame):
+        """(model input, view) - pass the view back to restore()."""
+        with self.lock:
+            if frame.shape != self.shape:
+                self.view = self._geometry(frame.shape)
+                self.shape = frame.shape
+            view = self.view
+        (x0, y0, x1, y1), scale, _, input_shape, _ = view
+        crop = frame[y0:y1, x0:x1]
+        if scale < 1.0:
+            crop = cv2.resize(crop, (input_shape[1], input_shape[0]), interpolation=cv2.INTER_AREA)
+        return crop, view
 
+    def restore(self, detections, view):
+        (x0, y0, _, _), scale, polygon, _, _ = view
+        kept = []
+        for det in detections:
+            bx1, by1, bx2, by2 = (v / scale for v in det['bbox'])
+            if polygon is not None and cv2.pointPolygonTest(polygon, ((bx1 + bx2) / 2, (by1 + by2) / 2), False) < 0:
+                self.outside += 1
+                continue
+            det['bbox'] = [int(round(bx1)) + x0, int(round(by1)) + y0, int(round(bx2)) + x0, int(round(by2)) + y0]
+            kept.append(det)
+        return kept
 
-# ===== VIDEO FEED =====
-class VideoCamera:
-    def __init__(self, source=0):
-        self.source = source
-        self.cap = None
-        self.frame = None
+    def stats(self):
+        view, shape = self.view, self.shape
+        stats = {'roi': self.roi, 'infer_size': self.infer_size, 'dropped_outside_roi': self.outside}
+        if view and shape:
+            (x0, y0, x1, y1), _, _, input_shape, imgsz = view
+            stats.update({
+                'frame_shape': list(shape[:2]),
+                'crop': [x0, y0, x1, y1],
+                'input_shape': list(input_shape),
+                'imgsz': imgsz,
+                'pixel_reduction': round(shape[0] * shape[1] / (input_shape[0] * input_shape[1]), 2)
+            })
+        return stats
+
+
+class SnapshotCache:
+    """Latest FrameResult of a pipeline for /snapshot polling. The full-size
+    JPEG and any downscaled / lower-quality variants come from the result
+    itself, so each is encoded at most once per frame whether a snapshot
+    poller or a stream asked first. Stats here cover snapshot requests only."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.result = None
+        self.served = 0
+        self.variant_encodes = 0
+        self.variant_hits = 0
+        self.encode_ms = deque(maxlen=300)
+
+    def update(self, seq, result):
+        with self.lock:
+            self.seq, self.result = seq, result
+
+    def get(self, width=None, quality=None):
+        """(seq, jpeg) for the newest frame, or None before the first frame."""
+        with self.lock:
+            seq, result = self.seq, self.result
+            self.served += 1
+        if result is None:
+            return None
+        if not width and not quality:
+            jpeg = result.jpeg()
+            return (seq, jpeg) if jpeg is not None else None
+        t0 = time.time()
+        data, encoded = result.variant(width, quality)
+        if data is None:
+            return None
+        with self.lock:
+            if encoded:
+                self.variant_encodes += 1
+                self.encode_ms.append((time.time() - t0) * 1000)
+            else:
+                self.variant_hits += 1
+        return seq, data
+
+    def stats(self):
+        return {
+            'served': self.served,
+            'variant_encodes': self.variant_encodes,
+            'variant_hits': self.variant_hits,
+            'variant_encode_ms': latency_summary(list(self.encode_ms))
+        }
+
+
+class DetectionPipeline:
+    """Runs detection once per captured frame and fans the FrameResult out to
+    every subscriber. Drawing and JPEG encoding happen on the result, only
+    when a stream or snapshot actually reads it."""
+    def __init__(self, camera, gate=None, lines=None, region=None):
+        self.camera = camera
+        self.camera_id = camera.camera_id
+        self.gate = gate or MotionGate()
+        self.region = region or InferenceRegion()
+        self.tracker = ObjectTracker()
+        self.counter = LineCounter(self.camera_id, lines)
+        self.face_stage = FaceRecognitionStage(self.camera_id) if FACE_RECOGNITION_AVAILABLE and LIVE_FACE_RECOGNITION else None
+        self.faces = []
         self.running = False
         self.thread = None
-        
+        self.subscribers = {}
+        self.subscribers_lock = threading.Lock()
+        self.seq = 0
+        self.result = None
+        self.snapshots = SnapshotCache()
+        self.history = DetectionHistory()
+        self.started_at = int(time.time())
+        self.frames_processed = 0
+        self.rendered = 0
+        self.variant_encodes = 0
+        self.event_signature = None   # what the last 'detections' event showed
+        self.latency_ms = deque(maxlen=300)
+        self.encode_ms = deque(maxlen=300)
+
+    @property
+    def detections(self):
+        result = self.result
+        return result.detections() if result else []
+
     def start(self):
         if self.running:
             return
-        self.cap = cv2.VideoCapture(self.source)
-        if not self.cap.isOpened():
-            raise Exception(f"Cannot open camera: {self.source}")
         self.running = True
-        self.thread = threading.Thread(target=self._update, daemon=True)
+        self.thread = threading.Thread(target=self._run, daemon=True)
         self.thread.start()
-        
-    def _update(self):
-        while self.running:
-            ret, frame = self.cap.read()
-            if ret:
-                self.frame = frame
-            time.sleep(0.03)
-            
-    def get_frame(self):
-        return self.frame
-    
+
     def stop(self):
         self.running = False
-        if self.cap:
-            self.cap.release()
 
+    def subscribe(self, **options):
+        sub = StreamSubscriber(**options)
+        with self.subscribers_lock:
+            self.subscribers[sub.id] = sub
+        # Give the new client the latest frame straight away
+        result = self.result
+        if result is not None:
+            sub.push(result.seq, result)
+        return sub
 
-def detect_objects(frame):
-    global latest_detections
-    
-    active_model = loaded_models.get(active_model_name)
-    if not active_model:
-        return frame, []
-    
-    detections = []
-    
-    # Run active model
-    results = active_model(frame, verbose=False, conf=0.35)
-    
-    for r in results:
-        for box in r.boxes:
-            cls = int(box.cls[0])
-            conf = float(box.conf[0])
-            class_name = active_model.names[cls]
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            
-            # Color based on model type
-            color = (0, 255, 0) if active_model_name == 'best_dec20' else (255, 165, 0)
-            
-            cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-            cv2.putText(frame, f"{class_name} ({conf:.2f})", (x1, y1-10), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-            
-            detections.append({
-                'class': class_name, 
-                'confidence': conf, 
-                'model': active_model_name
-            })
+    def unsubscribe(self, sub):
+        with self.subscribers_lock:
+            self.subscribers.pop(sub.id, None)
 
-            # Sugar Bag Counting Logic
-            if 'sugar' in active_model_name and 'bag' in class_name.lower():
-                 # Simple logic: if center of box is in lower half (offloading), count it?
-                 # Or just count unique IDs if tracking is enabled.
-                 # For now, let's assume the frontend tracks it, OR we just expose the count of total unique IDs seen in this session.
-                 # Since we use model.track(), we have IDs.
-                 pass 
-
-    latest_detections = detections
-    return frame, detections
-
-
-def generate_frames():
-    global camera
-    while True:
-        if camera is None or not camera.running:
-            placeholder = np.zeros((480, 640, 3), dtype=np.uint8)
-            cv2.putText(placeholder, "No Camera Connected", (150, 240),
-                       cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-            _, buffer = cv2.imencode('.jpg', placeholder)
-            yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
-            time.sleep(0.1)
-            continue
-            
-        frame = camera.get_frame()
-        if frame is None:
-            continue
-            
-        frame, _ = detect_objects(frame)
-        _, buffer = cv2.imencode('.jpg', frame)
-        yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
+    def _run(self):
+        last_seq = 0
+        while self.running and self.camera.running:
+            item = self.camera.wait_for_frame(last_seq, timeout=1.0)
+            if item is None:
+                continue
+            last_seq, frame, captured_at = item
+
+            # The gate and the model only ever see the ROI crop at infer_size
+            model_input, view = self.region.prepare(frame)
+            previous = self.result
+            overlay = {'lines': self.counter.lines, 'roi': self.region.roi}
+            if previous is None or self.gate.should_infer(model_input):
+                detections = inference_scheduler.infer(self.camera_id, model_input, imgsz=view[4])
+                if detections is None:
+                    continue
+                detections = self.region.restore(detections, view)
+                self.latency_ms.append((time.time() - captured_at) * 1000)
+                tracks = self.tracker.update(detections, captured_at)
+                crossings = self.counter.update(tracks, frame.shape)
+                record_crossings(self.camera_id, crossings, self.counter.counts)
+                if self.face_stage:
+                    self.faces = [t.to_dict() for t in self.face_stage.process(frame)]
+                else:
+                    self.faces = []
+                person_registry.observe(self.camera_id, tracks, frame, self.faces, captured_at)
+                plate_recognizer.observe(self.camera_id, tracks, frame, captured_at, crossings)
+                result = FrameResult.from_detections(self.seq + 1, self.camera_id, captured_at, frame, detections,
+                                                     faces=self.faces, owner=self, **overlay)
+                self.history.append(result)
+                # Push only when the set of tracked objects / recognised faces
+                # changes, and only if someone is listening
+                if event_bus.wants('detections'):
+                    signature = (frozenset((d.get('track_id'), d['class']) for d in detections),
+                                 frozenset((f['track_id'], f['face_id'], f['name']) for f in self.faces))
+                    if signature != self.event_signature:
+                        self.event_signature = signature
+                        event_bus.publish('detections', self.camera_id, {
+                            'camera_id': self.camera_id, 'seq': result.seq, 'timestamp': captured_at,
+                            'detections': detections, 'faces': self.faces})
+            else:
+                # Static scene - keep showing the last detections
+                self.tracker.keep_alive(captured_at)
+                result = previous.follow(self.seq + 1, captured_at, frame, **overlay)
+
+            self.seq = result.seq
+            self.result = result
+            self.snapshots.update(self.seq, result)
+            self.frames_processed += 1
+
+            with self.subscribers_lock:
+                subs = list(self.subscribers.values())
+            for sub in subs:
+                sub.push(self.seq, result)
+        self.running = False
+        person_registry.close_camera(self.camera_id)
+        plate_recognizer.close_camera(self.camera_id)
+        event_bus.forget('detections', self.camera_id)
+
+    def stats(self):
+        with self.subscribers_lock:
+            subs = [s.stats() for s in self.subscribers.values()]
+        return {
+            'camera_id': self.camera_id,
+            'running': self.running,
+            'frames_processed': self.frames_processed,
+            'seq': self.seq,
+            'glass_to_detection_ms': latency_summary(list(self.latency_ms)),
+            'gating': self.gate.stats(),
+            'region': self.region.stats(),
+            'encoder': JPEG_ENCODER,
+            'rendered_frames': self.rendered,
+            'variant_encodes': self.variant_encodes,
+            'encode_ms': latency_summary(list(self.encode_ms)),
+            'snapshots': self.snapshots.stats(),
+            'history': self.history.stats(),
+            'tracking': self.tracker.stats(),
+            'counting': self.counter.stats(),
+            'faces': self.face_stage.stats() if self.face_stage else None,
+            'camera': self.camera.stats(),
+            'subscribers': subs
+        }
+
+
+class CameraManager:
+    """Keeps one VideoCamera + DetectionPipeline alive per camera id."""
+    def __init__(self):
+        self.pipelines = {}
+        self.gate_settings = {}
+        self.lock = threading.Lock()
+
+    def start(self, camera_id, source):
+        # Opening an RTSP source can block for seconds - do it outside the
+        # lock so one unreachable camera doesn't stall every other stream.
+        # The old pipeline goes first so a local device is free to reopen.
+        self.stop(camera_id)
+        with self.lock:
+            settings = dict(self.gate_settings.get(camera_id, {}))
+        cam = VideoCamera(source, camera_id)
+        cam.start()
+        gate = MotionGate()
+        gate.configure(settings)
+        pipe = DetectionPipeline(cam, gate, load_count_lines(camera_id), load_inference_region(camera_id))
+        pipe.start()
+        with self.lock:
+            # A concurrent start of the same camera may have won the race
+            replaced = self.pipelines.get(camera_id)
+            self.pipelines[camera_id] = pipe
+        if replaced:
+            replaced.stop()
+            replaced.camera.stop()
+        return pipe
+
+    def stop(self, camera_id):
+        with self.lock:
+            return self._stop_locked(camera_id)
+
+    def _stop_locked(self, camera_id):
+        pipe = self.pipelines.pop(camera_id, None)
+        if pipe:
+            pipe.stop()
+            pipe.camera.stop()
+        return pipe is not None
+
+    def get(self, camera_id):
+        return self.pipelines.get(camera_id)
+
+    def configure_gate(self, camera_id, settings):
+        """Store gating overrides for a camera (kept across restarts)."""
+        with self.lock:
+            merged = {**self.gate_settings.get(camera_id, {}), **settings}
+            self.gate_settings[camera_id] = merged
+            pipe = self.pipelines.get(camera_id)
+            if pipe:
+                pipe.gate.configure(merged)
+                return pipe.gate.stats()
+        gate = MotionGate()
+        gate.configure(merged)
+        return gate.stats()
+
+    def any_running(self):
+        return any(p.running for p in list(self.pipelines.values()))
+
+    def running_count(self):
+        return sum(1 for p in list(self.pipelines.values()) if p.running)
+
+    def status(self):
+        return {cid: p.stats() for cid, p in list(self.pipelines.items())}
+
+
+camera_manager = CameraManager()
+
+
+def load_count_lines(camera_id):
+    conn = get_db()
+    row = conn.execute('SELECT count_lines FROM cameras WHERE id = ?', (camera_id,)).fetchone()
+    conn.close()
+    if row and row['count_lines']:
+        try:
+            return parse_count_lines(row['count_lines'])
+        except (ValueError, TypeError, AttributeError) as e:
+            print(f"⚠️ Bad count_lines for camera {camera_id}: {e}")
+    return DEFAULT_COUNT_LINES
+
+
+def load_inference_region(camera_id):
+    conn = get_db()
+    row = conn.execute('SELECT roi, infer_size FROM cameras WHERE id = ?', (camera_id,)).fetchone()
+    conn.close()
+    if row:
+        try:
+            return InferenceRegion(parse_roi(row['roi']), parse_infer_size(row['infer_size']))
+        except (ValueError, TypeError) as e:
+            print(f"⚠️ Bad roi/infer_size for camera {camera_id}: {e}")
+    return InferenceRegion()
+
+
+_placeholder_jpeg = None
+
+def get_placeholder_jpeg():
+    global _placeholder_jpeg
+    if _placeholder_jpeg is None:
+        placeholder = np.zeros((480, 640, 3), dtype=np.uint8)
+        cv2.putText(placeholder, "No Camera Connected", (150, 240),
+                   cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        _, buffer = cv2.imencode('.jpg', placeholder)
+        _placeholder_jpeg = buffer.tobytes()
+    return _placeholder_jpeg
+
+
+def mjpeg_part(jpeg):
+    return b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n'
+
+
+def generate_frames(camera_id=DEFAULT_CAMERA_ID, options=None):
+    options = options or {}
+    sub = None
+    sub_pipeline = None
+    try:
+        while True:
+            current = camera_manager.get(camera_id)
+            if current is None or not current.running:
+                if sub_pipeline is not None:
+                    sub_pipeline.unsubscribe(sub)
+                    sub, sub_pipeline = None, None
+                yield mjpeg_part(get_placeholder_jpeg())
+                time.sleep(0.1)
+                continue
+
+            if current is not sub_pipeline:
+                # Camera was (re)started - move to the new pipeline
+                if sub_pipeline is not None:
+                    sub_pipeline.unsubscribe(sub)
+                sub = current.subscribe(**options)
+                sub_pipeline = current
+
+            item = sub.wait(timeout=1.0)
+            if item is None:
+                continue
+            result = item[1]
+            width, quality = sub.width, sub.current_quality()
+            if width or quality:
+                # Only the variant this client asked for, shared with other
+                # clients (and snapshot pollers) on the same frame
+                jpeg = result.variant(width, quality)[0]
+            else:
+                jpeg = result.jpeg()
+            if jpeg is None:
+                continue
+
+            part = mjpeg_part(jpeg)
+            started = time.time()
+            yield part
+            # The server only asks for the next part once this one has been
+            # written, so time spent here is socket backpressure
+            sub.record_send(len(part), time.time() - started)
+
+            fps = sub.current_fps()
+            if fps:
+                delay = 1.0 / fps - (time.time() - started)
+                if delay > 0:
+                    time.sleep(delay)
+    finally:
+        if sub_pipeline is not None:
+            sub_pipeline.unsubscribe(sub)
+
+
+def stream_options(args):
+    """?fps=&width=&quality=&adaptive=1 from a /video_feed request. Widths snap
+    to 16px steps so arbitrary sizes can't flood the variant cache."""
+    width = args.get('width', type=int)
+    quality = args.get('quality', type=int)
+    fps = args.get('fps', type=float)
+    return {
+        'max_fps': max(0.5, min(fps, 60.0)) if fps else None,
+        'width': max(16, min(width, 3840)) // 16 * 16 if width else None,
+        'quality': max(10, min(quality, 95)) if quality else None,
+        'adaptive': args.get('adaptive', '').lower() in ('1', 'true', 'yes')
+    }
 
 
 @app.route('/video_feed')
-def video_feed():
-    return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+@app.route('/video_feed/<camera_id>')
+def video_feed(camera_id=DEFAULT_CAMERA_ID):
+    return Response(generate_frames(camera_id, stream_options(request.args)),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+
+@app.route('/api/v1/camera/snapshot')
+@app.route('/api/v1/cameras/<camera_id>/snapshot')
+@token_required
+def camera_snapshot(camera_id=None):
+    """Latest annotated frame as a JPEG. ?width= downscales, ?quality= (10-95)
+    re-encodes; the ETag is the frame sequence so pollers get 304 until the
+    next frame."""
+    camera_id = camera_id or request.args.get('camera_id', DEFAULT_CAMERA_ID)
+    options = stream_options(request.args)
+    width, quality = options['width'], options['quality']
+    
+    pipe = camera_manager.get(camera_id)
+    snapshot = pipe.snapshots.get(width, quality) if pipe else None
+    if snapshot is None:
+        etag, jpeg = 'placeholder', get_placeholder_jpeg()
+    else:
+        seq, jpeg = snapshot
+        etag = f"{camera_id}-{pipe.started_at}-{seq}-{width or 0}-{quality or 0}"
+    
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(jpeg, mimetype='image/jpeg')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def parse_source(source):
+    if isinstance(source, str) and source.isdigit():
+        return int(source)
+    return source
 
 
 @app.route('/api/v1/camera/start', methods=['POST'])
 @token_required
 def start_camera():
-    global camera
     data = request.json or {}
-    source = data.get('source', 0)
-    
-    if isinstance(source, str) and source.isdigit():
-        source = int(source)
-    
+    source = parse_source(data.get('source', 0))
+    camera_id = data.get('camera_id', DEFAULT_CAMERA_ID)
+
     try:
-        with camera_lock:
-            if camera:
-                camera.stop()
-            camera = VideoCamera(source)
-            camera.start()
-        return jsonify({'status': 'started', 'source': str(source)})
+        camera_manager.start(camera_id, source)
+        return jsonify({'status': 'started', 'source': str(source), 'camera_id': camera_id})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -882,17 +4669,341 @@ def start_camera():
 @app.route('/api/v1/camera/stop', methods=['POST'])
 @token_required
 def stop_camera():
-    global camera
-    with camera_lock:
-        if camera:
-            camera.stop()
-            camera = None
+    data = request.json or {}
+    camera_manager.stop(data.get('camera_id', DEFAULT_CAMERA_ID))
     return jsonify({'status': 'stopped'})
 
 
 @app.route('/api/v1/camera/detections')
 def live_detections():
-    return jsonify(latest_detections)
+    pipe = camera_manager.get(DEFAULT_CAMERA_ID)
+    if pipe and ('since' in request.args or 'seconds' in request.args):
+        return detection_history_response(pipe)
+    return jsonify(pipe.detections if pipe else [])
+
+
+def detection_history_response(pipe):
+    """?since=<seq> and/or ?seconds=<n> (&limit=) over the camera's history.
+    started_at changes when the stream restarts and seqs begin again."""
+    since = request.args.get('since', type=int)
+    seconds = request.args.get('seconds', type=float)
+    limit = max(1, min(request.args.get('limit', HISTORY_QUERY_LIMIT, type=int), HISTORY_QUERY_LIMIT))
+    frames = pipe.history.query(since, seconds, limit)
+    return jsonify({
+        'camera_id': pipe.camera_id,
+        'started_at': pipe.started_at,
+        'seq': pipe.seq,
+        'frames': [f.to_dict() for f in frames]
+    })
+
+
+@app.route('/api/v1/camera/stream-stats')
+def stream_stats():
+    """Per-client sent/skipped frame counters for the shared pipeline"""
+    pipe = camera_manager.get(request.args.get('camera_id', DEFAULT_CAMERA_ID))
+    if pipe is None:
+        return jsonify({'running': False, 'subscribers': []})
+    return jsonify(pipe.stats())
+
+
+@app.route('/api/v1/cameras/<camera_id>/start', methods=['POST'])
+@token_required
+def start_camera_stream(camera_id):
+    """Start streaming a registered camera from its rtsp_url"""
+    data = request.json or {}
+    source = data.get('source')
+    if source is None:
+        conn = get_db()
+        cam = conn.execute('SELECT rtsp_url FROM cameras WHERE id = ?', (camera_id,)).fetchone()
+        conn.close()
+        if not cam:
+            return jsonify({'error': 'Camera not found'}), 404
+        if not cam['rtsp_url']:
+            return jsonify({'error': 'Camera has no rtsp_url'}), 400
+        source = cam['rtsp_url']
+    source = parse_source(source)
+
+    try:
+        camera_manager.start(camera_id, source)
+        return jsonify({'status': 'started', 'source': str(source), 'camera_id': camera_id})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/api/v1/cameras/<camera_id>/stop', methods=['POST'])
+@token_required
+def stop_camera_stream(camera_id):
+    camera_manager.stop(camera_id)
+    return jsonify({'status': 'stopped', 'camera_id': camera_id})
+
+
+@app.route('/api/v1/cameras/start-all', methods=['POST'])
+@token_required
+def start_all_cameras():
+    """Start every registered camera that has an rtsp_url"""
+    conn = get_db()
+    cams = conn.execute("SELECT id, rtsp_url FROM cameras WHERE rtsp_url IS NOT NULL AND rtsp_url != ''").fetchall()
+    conn.close()
+
+    results = {}
+    for cam in cams:
+        try:
+            camera_manager.start(cam['id'], parse_source(cam['rtsp_url']))
+            results[cam['id']] = 'started'
+        except Exception as e:
+            results[cam['id']] = f'error: {e}'
+    return jsonify({'status': 'ok', 'cameras': results})
+
+
+@app.route('/api/v1/cameras/status')
+def cameras_status():
+    return jsonify(camera_manager.status())
+
+
+@app.route('/api/v1/cameras/<camera_id>/gating', methods=['POST'])
+@token_required
+def configure_camera_gating(camera_id):
+    """Tune motion gating / frame stride for one camera"""
+    data = request.json or {}
+    settings = {k: data[k] for k in ('enabled', 'threshold', 'stride', 'max_skip') if k in data}
+    return jsonify(camera_manager.configure_gate(camera_id, settings))
+
+
+@app.route('/api/v1/cameras/gating')
+def cameras_gating():
+    """Inferences run vs. saved by gating, per camera"""
+    return jsonify({cid: p.gate.stats() for cid, p in list(camera_manager.pipelines.items())})
+
+
+@app.route('/api/v1/cameras/<camera_id>/lines')
+@token_required
+def get_count_lines(camera_id):
+    pipe = camera_manager.get(camera_id)
+    if pipe:
+        return jsonify(pipe.counter.stats())
+    return jsonify({'lines': load_count_lines(camera_id), 'counts': {}, 'events': 0})
+
+
+@app.route('/api/v1/cameras/<camera_id>/lines', methods=['PUT'])
+@token_required
+def set_count_lines(camera_id):
+    """Set virtual count lines: [{name, p1: [x, y], p2: [x, y], invert}] in 0-1 coords"""
+    data = request.json or {}
+    try:
+        lines = parse_count_lines(data.get('lines', data if isinstance(data, list) else []))
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    conn = get_db()
+    cur = conn.execute('UPDATE cameras SET count_lines = ? WHERE id = ?', (json.dumps(lines), camera_id))
+    conn.commit()
+    conn.close()
+    
+    pipe = camera_manager.get(camera_id)
+    if pipe:
+        pipe.counter.lines = lines
+    return jsonify({'lines': lines, 'saved': cur.rowcount > 0})
+
+
+@app.route('/api/v1/cameras/<camera_id>/roi')
+@token_required
+def get_camera_roi(camera_id):
+    pipe = camera_manager.get(camera_id)
+    if pipe:
+        return jsonify(pipe.region.stats())
+    return jsonify(load_inference_region(camera_id).stats())
+
+
+@app.route('/api/v1/cameras/<camera_id>/roi', methods=['PUT'])
+@token_required
+def set_camera_roi(camera_id):
+    """Set the inference region: {roi: [[x, y], ...] in 0-1 coords or null, infer_size: px or null}"""
+    data = request.json or {}
+    try:
+        roi = parse_roi(data.get('roi'))
+        infer_size = parse_infer_size(data.get('infer_size'))
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    conn = get_db()
+    cur = conn.execute('UPDATE cameras SET roi = ?, infer_size = ? WHERE id = ?',
+                       (json.dumps(roi) if roi else None, infer_size, camera_id))
+    conn.commit()
+    conn.close()
+    
+    pipe = camera_manager.get(camera_id)
+    if pipe:
+        pipe.region.configure(roi, infer_size)
+    return jsonify({'roi': roi, 'infer_size': infer_size, 'saved': cur.rowcount > 0})
+
+
+@app.route('/api/v1/cameras/<camera_id>/faces')
+def camera_faces(camera_id):
+    """Faces currently tracked on a stream"""
+    pipe = camera_manager.get(camera_id)
+    if pipe is None:
+        return jsonify({'error': 'Camera not streaming'}), 404
+    return jsonify(pipe.faces)
+
+
+@app.route('/api/v1/cameras/<camera_id>/detections')
+def camera_detections(camera_id):
+    pipe = camera_manager.get(camera_id)
+    if pipe is None:
+        return jsonify({'error': 'Camera not streaming'}), 404
+    if 'since' in request.args or 'seconds' in request.args:
+        return detection_history_response(pipe)
+    return jsonify(pipe.detections)
+
+
+# ===== OFFLINE ANALYSIS =====
+def plan_segments(frame_count, fps, workers):
+    """[(warmup_start, start, end)] covering the whole file."""
+    length = max(int(ANALYSIS_MIN_SEGMENT_SEC * fps), -(-frame_count // (workers * ANALYSIS_SEGMENTS_PER_WORKER)))
+    warmup = int(ANALYSIS_WARMUP_SEC * fps)
+    return [(max(0, start - warmup), start, min(start + length, frame_count))
+            for start in range(0, frame_count, length)]
+
+
+def run_analysis_job(job, ctx):
+    params = job['params']
+    path = str(upload_manager.get(params['upload_id']).path) if params.get('upload_id') else job['input_path']
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Cannot open video: {path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    if frame_count <= 0:
+        raise RuntimeError('Video has no frames')
+
+    model_name = params.get('model') or active_model_name
+    stride = max(1, int(params.get('stride', ANALYSIS_STRIDE)))
+    batch_size = max(1, int(params.get('batch_size', ANALYSIS_BATCH_SIZE)))
+    workers = max(1, int(params.get('workers', ANALYSIS_WORKERS)))
+    lines = parse_count_lines(params['lines']) if params.get('lines') else DEFAULT_COUNT_LINES
+    camera_id = params.get('camera_id')
+    recorded_at = params.get('recorded_at_epoch') or time.time() - frame_count / fps
+    segments = plan_segments(frame_count, fps, workers)
+
+    t0 = time.time()
+    results = []
+    if model_name not in model_registry.specs:
+        raise RuntimeError(f"Model not available: {model_name}")
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    weights = model_registry.prepare(model_name)
+    executor, futures, cancel = analysis_worker.start(
+        workers, threads, weights, [(path, model_name, lines, w, s, e, fps, stride, batch_size) for w, s, e in segments])
+    try:
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+            if ctx.cancelled.is_set():
+                # Running segments check this between batches
+                cancel.set()
+                ctx.check()
+            results.extend(future.result() for future in done)
+            progress = sum(r['end'] - r['start'] for r in results) / frame_count
+            elapsed = time.time() - t0
+            ctx.report(progress * 100, elapsed * (1 - progress) / progress if progress else None)
+    finally:
+        executor.shutdown(wait=not ctx.cancelled.is_set(), cancel_futures=True)
+    wall = time.time() - t0
+
+    counts = {}
+    booked = 0
+    for result in results:
+        for index, cls, direction, score in result['events']:
+            key = f"{cls}:{direction}"
+            counts[key] = counts.get(key, 0) + 1
+            product = crossing_product(cls)
+            if product:
+                db_writer.log_detection(product, direction, score, camera_id,
+                                        detected_at=db_timestamp(recorded_at + index / fps))
+                booked += 1
+    db_writer.flush()
+
+    decoded = sum(r['decoded'] for r in results)
+    inferred = sum(r['inferred'] for r in results)
+    return {
+        'model': model_name,
+        'frames': frame_count,
+        'video_seconds': round(frame_count / fps, 1),
+        'frames_decoded': decoded,
+        'frames_inferred': inferred,
+        'wall_seconds': round(wall, 2),
+        'fps': round(frame_count / wall, 1) if wall else None,
+        'inferred_fps': round(inferred / wall, 1) if wall else None,
+        'realtime_factor': round(frame_count / fps / wall, 1) if wall else None,
+        'segments': len(segments),
+        'workers': workers,
+        'stride': stride,
+        'counts': counts,
+        'detections_logged': booked
+    }
+
+
+JOB_HANDLERS['analysis'] = run_analysis_job
+
+
+@app.route('/api/v1/analysis', methods=['POST'])
+@token_required
+def start_analysis():
+    """Queue offline detection over a recorded file.
+    {upload_id, model?, camera_id?, recorded_at? ('YYYY-MM-DD HH:MM:SS' UTC,
+    when the recording started), stride?, batch_size?, workers?, lines?}"""
+    data = request.json or {}
+    state = upload_manager.get(data.get('upload_id', ''))
+    if state is None:
+        return jsonify({'error': 'upload_id of a chunked upload required'}), 400
+    model = data.get('model') or active_model_name
+    if model not in model_registry:
+        return jsonify({'error': f'Model {model} not available'}), 400
+    if data.get('lines'):
+        try:
+            parse_count_lines(data['lines'])
+        except (ValueError, TypeError, AttributeError) as e:
+            return jsonify({'error': str(e)}), 400
+    
+    params = {k: data[k] for k in ('stride', 'batch_size', 'workers', 'lines', 'camera_id') if data.get(k)}
+    params.update({'upload_id': state.id, 'model': model})
+    if data.get('recorded_at'):
+        try:
+            params['recorded_at_epoch'] = datetime.strptime(data['recorded_at'], '%Y-%m-%d %H:%M:%S').replace(
+                tzinfo=timezone.utc).timestamp()
+        except ValueError:
+            return jsonify({'error': "recorded_at must be 'YYYY-MM-DD HH:MM:SS'"}), 400
+    
+    job_id = job_queue.enqueue('analysis', params, state.path, None, data.get('filename'), state.size)
+    if job_id is None:
+        return jsonify({'error': 'Job queue is full, try again later'}), 503
+    return jsonify({'job_id': job_id, 'status': 'queued'}), 201
+
+
+@app.route('/api/v1/analysis/<job_id>')
+@token_required
+def analysis_status(job_id):
+    job = job_queue.status(job_id)
+    if not job or job['kind'] != 'analysis':
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({
+        'job_id': job['id'],
+        'status': job['status'],
+        'progress': job['progress'],
+        'eta_seconds': job['eta_seconds'],
+        'queue_position': job['queue_position'],
+        'error': job['error'],
+        'result': job['result']
+    })
+
+
+@app.route('/api/v1/analysis/<job_id>/cancel', methods=['POST'])
+@token_required
+def analysis_cancel(job_id):
+    status = job_queue.cancel(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'job_id': job_id, 'status': status})
 
 
 # ===== MODEL SELECTION =====
@@ -900,16 +5011,24 @@ def live_detections():
 def get_models():
     """List available models"""
     return jsonify({
-        'available': list(loaded_models.keys()),
+        'available': model_registry.available(),
+        'loaded': model_registry.loaded(),
         'active': active_model_name,
-        'main_loaded': 'best_dec20' in loaded_models
+        'main_loaded': 'best_dec20' in model_registry.loaded()
     })
 
 
+@app.route('/api/v1/models/stats')
+def get_model_stats():
+    """Load time and resident memory per model"""
+    return jsonify(model_registry.stats())
+
+
 @app.route('/api/v1/models/switch', methods=['POST'])
 @token_required
 def switch_model():
-    """Switch the active model"""
+    """Switch the active model (loads it if it isn't resident yet).
+    ?parity=1 also compares an ONNX model against PyTorch on live frames."""
     global active_model_name
     data = request.json or {}
     model_name = data.get('model')
@@ -917,26 +5036,62 @@ def switch_model():
     if not model_name:
         return jsonify({'error': 'Model name required'}), 400
     
-    if model_name not in loaded_models:
+    if model_name not in model_registry:
         return jsonify({
             'error': f'Model not found: {model_name}',
-            'available': list(loaded_models.keys())
+            'available': model_registry.available()
         }), 404
     
+    was_loaded = model_name in model_registry.loaded()
+    model = model_registry.get(model_name, retry=True)
+    if model is None:
+        return jsonify({'error': f'Failed to load {model_name}: {model_registry.errors.get(model_name)}'}), 500
+    
     active_model_name = model_name
     print(f"🔄 Switched to model: {active_model_name}")
+
+    # ONNX vs PyTorch on a live frame: do the boxes agree, and how much faster is it?
+    parity = None
+    wants_parity = request.args.get('parity') in ('1', 'true') or data.get('parity') is True
+    if isinstance(model, OnnxDetector) and wants_parity:
+        reference = model_registry.reference(model_name)
+        frames = [pipe.camera.get_frame() for pipe in list(camera_manager.pipelines.values())]
+        frames = [f for f in frames if f is not None][:INFERENCE_MAX_BATCH]
+        if reference is None:
+            ref_name = model_name + ModelRegistry.REFERENCE_SUFFIX
+            parity = {'error': model_registry.errors.get(ref_name) or 'PyTorch reference unavailable'}
+        else:
+            try:
+                parity = backend_parity(model, reference, frames or [np.zeros((480, 640, 3), dtype=np.uint8)], PARITY_RUNS)
+                parity['source'] = 'live' if frames else 'blank'
+            except Exception as e:
+                parity = {'error': str(e)}
     
     return jsonify({
         'status': 'switched',
-        'active': active_model_name
+        'active': active_model_name,
+        'was_loaded': was_loaded,
+        'backend': getattr(model, 'backend', 'torch'),
+        'model': model_registry.stats()['models'][model_name],
+        'parity': parity
     })
 
 
+@app.route('/api/v1/sugar-count')
+def get_sugar_count():
+    """Sugar bags counted IN across the count lines this session"""
+    return jsonify({'count': sugar_bag_count})
+
+
 @app.route('/api/v1/sugar-count/reset', methods=['POST'])
 @token_required
 def reset_sugar_count():
     global sugar_bag_count
-    sugar_bag_count = 0
+    with counters_lock:
+        sugar_bag_count = 0
+    for camera_id, pipe in list(camera_manager.pipelines.items()):
+        event_bus.publish('counts', camera_id, {'camera_id': camera_id, 'counts': pipe.counter.counts,
+                                                'sugar_bag_count': 0})
     return jsonify({'status': 'reset', 'count': 0})
 
 
@@ -952,10 +5107,10 @@ def api_stats():
         'total_in': inv['total_in'] or 0,
         'total_out': inv['total_out'] or 0,
         'inventory': [dict(i) for i in inventory],
-        'camera_active': camera is not None and getattr(camera, 'running', False),
+        'camera_active': camera_manager.any_running(),
         'models_loaded': {
-            'count': len(loaded_models),
-            'available': list(loaded_models.keys()),
+            'count': len(model_registry.loaded()),
+            'available': model_registry.available(),
             'active': active_model_name
         }
     })
@@ -979,34 +5134,40 @@ def api_detections():
 
 @app.route('/api/log_detection', methods=['POST'])
 def api_log_detection():
-    data = request.json
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'JSON object required'}), 400
     product = data.get('class_name')
     direction = data.get('direction', 'IN')
+    # Validate here - the writer thread applies it later, after we've answered
+    if not product or not isinstance(product, str):
+        return jsonify({'error': 'class_name required'}), 400
+    if direction not in ('IN', 'OUT'):
+        return jsonify({'error': 'direction must be IN or OUT'}), 400
     
-    conn = get_db()
-    if direction == 'IN':
-        conn.execute('UPDATE inventory SET count_in = count_in + 1, current_stock = current_stock + 1, last_updated = CURRENT_TIMESTAMP WHERE product_name = ?', (product,))
-    else:
-        conn.execute('UPDATE inventory SET count_out = count_out + 1, current_stock = current_stock - 1, last_updated = CURRENT_TIMESTAMP WHERE product_name = ?', (product,))
-    
-    conn.execute('INSERT INTO detections (id, type, confidence, direction) VALUES (?, ?, ?, ?)',
-                 (str(uuid.uuid4()), product, 1.0, direction))
-    conn.commit()
-    conn.close()
+    db_writer.log_detection(product, direction)
     
     return jsonify({'status': 'logged'})
 
 
 @app.route('/api/reset', methods=['POST'])
 def api_reset():
+    db_writer.flush()
     conn = get_db()
     conn.execute('UPDATE inventory SET count_in = 0, count_out = 0, current_stock = 0')
     conn.execute('DELETE FROM detections')
+    conn.execute('DELETE FROM detection_rollups')
     conn.commit()
     conn.close()
     return jsonify({'status': 'reset'})
 
 
+@app.route('/api/v1/db/stats')
+def db_stats():
+    """Background writer queue depth and write latency"""
+    return jsonify(db_writer.stats())
+
+
 # ===== HEALTH =====
 @app.route('/')
 def root():
@@ -1019,18 +5180,31 @@ def health():
         'status': 'healthy', 
         'models': {
             'active': active_model_name,
-            'count': len(loaded_models)
+            'available': len(model_registry.available()),
+            'loaded': model_registry.loaded()
         },
-        'face_recognition': FACE_RECOGNITION_AVAILABLE
+        'face_recognition': FACE_RECOGNITION_AVAILABLE,
+        'face_cache': {
+            'status': face_cache.status,
+            'faces': len(face_cache.index),
+            'version': face_cache.version
+        }
     })
 
 
 if __name__ == '__main__':
     init_db()
+    face_cache.start_warmup()
+    if active_model_name in model_registry:
+        model_registry.preload(active_model_name)
+    # With the debug reloader __main__ also runs in the file-watcher process;
+    # only the serving child should pick up queued jobs
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        job_queue.start()
     print("\n" + "="*50)
     print("AI CCTV Flask Backend Starting...")
-    print(f"Active Model: {active_model_name if loaded_models else '❌ NONE'}")
-    print(f"Loaded Models: {len(loaded_models)}")
+    print(f"Active Model: {active_model_name if model_registry.available() else '❌ NONE'}")
+    print(f"Available Models: {len(model_registry.available())} (loaded on demand)")
     print(f"Face Recognition: {'✅ Available' if FACE_RECOGNITION_AVAILABLE else '❌ NOT AVAILABLE'}")
     print("API: http://localhost:5000")
     print("="*50 + "\n")
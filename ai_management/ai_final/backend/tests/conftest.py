@@ -0,0 +1,28 @@
+"""
+Shared test setup. app.py keeps its SQLite file, uploads and faces relative to
+the working directory, so the whole session runs in a scratch directory.
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.chdir(tempfile.mkdtemp(prefix='aicctv-tests-'))
+
+import app as backend  # noqa: E402
+
+backend.init_db()
+
+
+@pytest.fixture
+def client():
+    return backend.app.test_client()
+
+
+@pytest.fixture
+def auth():
+    # token_required falls back to the demo user for tokens it can't decode
+    return {'Authorization': 'Bearer test'}
@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import app as backend
+
+
+@pytest.fixture
+def recognizer(monkeypatch):
+    """A PlateRecognizer whose OCR submissions are recorded, not run."""
+    recognizer = backend.PlateRecognizer()
+    recognizer.submitted = []
+
+    def submit(candidate):
+        candidate.submitted = True
+        recognizer.submitted.append(candidate.direction)
+    monkeypatch.setattr(recognizer, '_submit', submit)
+    return recognizer
+
+
+def truck(track_id):
+    return SimpleNamespace(id=track_id, cls='truck', hits=5, box=np.array([300, 200, 800, 600], dtype=np.float32),
+                           score=0.9)
+
+
+FRAME = np.random.default_rng(0).integers(0, 255, (720, 1280, 3), dtype=np.uint8)
+
+
+def test_truck_waiting_before_the_line_is_read_with_its_crossing(recognizer):
+    parked = truck(1)
+    for second in range(30):
+        recognizer.observe('gate', [parked], FRAME, 100.0 + second)
+    assert recognizer.submitted == []
+
+    recognizer.observe('gate', [parked], FRAME, 131.0, crossings=[(parked, None, 'OUT')])
+    assert recognizer.submitted == ['OUT']
+
+
+def test_truck_that_never_crosses_is_read_when_it_leaves(recognizer):
+    recognizer.observe('gate', [truck(2)], FRAME, 200.0)
+    recognizer.observe('gate', [], FRAME, 200.0 + backend.ANPR_TRACK_GONE + 0.1)
+    assert recognizer.submitted == [None]
+
+
+def test_camera_stop_reads_pending_trucks(recognizer):
+    recognizer.observe('dock', [truck(3)], FRAME, 300.0)
+    recognizer.close_camera('dock')
+    assert recognizer.submitted == [None]
+
+
+def logged(plate):
+    backend.db_writer.flush()
+    conn = backend.get_db()
+    rows = [tuple(r) for r in conn.execute(
+        'SELECT direction, camera_id FROM trucks WHERE plate_number = ? ORDER BY direction, camera_id', (plate,))]
+    conn.close()
+    return rows
+
+
+def test_dedup_is_per_direction_and_camera():
+    recognizer = backend.PlateRecognizer()
+    plate = 'KA01AB1234'
+    reads = [('IN', 'gate'), ('IN', 'gate'), ('OUT', 'gate'), ('IN', 'yard'), (None, 'gate'), (None, 'gate')]
+    for direction, camera_id in reads:
+        recognizer._log(plate, 0.9, camera_id, direction, 1_700_000_000.0)
+    # One misread character is still the same truck
+    recognizer._log('KA01AB1284', 0.9, 'gate', 'IN', 1_700_000_000.0)
+
+    assert logged(plate) == [('IN', 'gate'), ('IN', 'yard'), ('OUT', 'gate'), ('UNKNOWN', 'gate')]
+    assert logged('KA01AB1284') == []
+    assert recognizer.duplicates == 3
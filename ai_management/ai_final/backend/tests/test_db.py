@@ -0,0 +1,103 @@
+import app as backend
+
+
+def inventory(product):
+    conn = backend.get_db()
+    row = conn.execute('SELECT count_in, count_out, current_stock FROM inventory WHERE product_name = ?',
+                       (product,)).fetchone()
+    conn.close()
+    return tuple(row)
+
+
+def count(sql, params=()):
+    conn = backend.get_db()
+    value = conn.execute(sql, params).fetchone()[0]
+    conn.close()
+    return value
+
+
+def test_pool_hands_back_connections():
+    conn = backend.get_db()
+    raw = conn._conn
+    conn.close()
+    conn.close()    # a second close is a no-op, not a double return
+    again = backend.get_db()
+    assert again._conn is raw
+    assert again.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    again.close()
+
+
+def test_pool_rolls_back_uncommitted_work():
+    conn = backend.get_db()
+    conn.execute("INSERT INTO cameras (id, name) VALUES ('pool-rollback', 'x')")
+    conn.close()
+    assert count("SELECT COUNT(*) FROM cameras WHERE id = 'pool-rollback'") == 0
+
+
+def test_writer_batches_detections_and_inventory():
+    before = inventory('Half Crate')
+    batches = backend.db_writer.batches
+    for _ in range(20):
+        backend.db_writer.log_detection('Half Crate', 'IN', camera_id='db-test')
+    backend.db_writer.log_detection('Half Crate', 'OUT', camera_id='db-test', quantity=3)
+    assert backend.db_writer.flush()
+
+    assert count("SELECT COUNT(*) FROM detections WHERE camera_id = 'db-test'") == 21
+    count_in, count_out, stock = inventory('Half Crate')
+    assert (count_in - before[0], count_out - before[1], stock - before[2]) == (20, 3, 17)
+    # 21 queued writes land in far fewer transactions
+    assert backend.db_writer.batches - batches < 21
+
+
+def test_rollup_trigger_counts_per_bucket():
+    for direction in ('IN', 'IN', 'OUT'):
+        backend.db_writer.log_detection('Full Crate', direction, camera_id='rollup-test',
+                                        detected_at='2026-01-02 10:15:30')
+    assert backend.db_writer.flush()
+    rows = backend.get_db()
+    got = {(r['granularity'], r['bucket'], r['direction']): r['count'] for r in rows.execute(
+        "SELECT * FROM detection_rollups WHERE camera_id = 'rollup-test'")}
+    rows.close()
+    assert got == {
+        ('minute', '2026-01-02 10:15', 'IN'): 2,
+        ('minute', '2026-01-02 10:15', 'OUT'): 1,
+        ('hour', '2026-01-02 10:00', 'IN'): 2,
+        ('hour', '2026-01-02 10:00', 'OUT'): 1,
+    }
+
+
+def test_bad_row_does_not_lose_the_batch():
+    errors = backend.db_writer.errors
+    backend.db_writer.execute("INSERT INTO cameras (id, name) VALUES ('writer-ok', 'ok')")
+    backend.db_writer.execute('INSERT INTO cameras (id, name) VALUES (?, NULL)', ('writer-bad',))
+    assert backend.db_writer.flush()
+    assert backend.db_writer.errors == errors + 1
+    assert count("SELECT COUNT(*) FROM cameras WHERE id = 'writer-ok'") == 1
+
+
+def test_log_detection_validates_before_queueing(client):
+    for body in ({}, {'direction': 'IN'}, {'class_name': ''}, {'class_name': 'Sugar Bag', 'direction': 'UP'}):
+        assert client.post('/api/log_detection', json=body).status_code == 400
+    assert client.post('/api/log_detection', data='not json').status_code == 400
+    assert client.post('/api/log_detection', json=['Sugar Bag']).status_code == 400
+
+    errors = backend.db_writer.errors
+    before = inventory('Sugar Bag')
+    r = client.post('/api/log_detection', json={'class_name': 'Sugar Bag', 'direction': 'OUT'})
+    assert r.status_code == 200
+    assert backend.db_writer.flush()
+    assert backend.db_writer.errors == errors
+    assert inventory('Sugar Bag')[1] == before[1] + 1
+
+
+def test_movement_validates_quantity_and_direction(client, auth):
+    url = '/api/v1/inventory/movement'
+    for body in ({'product_name': 'Truck', 'quantity': 'abc'}, {'product_name': 'Truck', 'quantity': None},
+                 {'product_name': 'Truck', 'quantity': 0}, {'product_name': 'Truck', 'direction': 'SIDEWAYS'},
+                 {'quantity': 2}):
+        assert client.post(url, json=body, headers=auth).status_code == 400
+
+    before = inventory('Truck')
+    assert client.post(url, json={'product_name': 'Truck', 'quantity': '4'}, headers=auth).status_code == 200
+    assert backend.db_writer.flush()
+    assert inventory('Truck')[0] == before[0] + 4
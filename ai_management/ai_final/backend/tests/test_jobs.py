@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+
+import pytest
+
+import app as backend
+
+
+def wait_for(job_id, statuses=('completed', 'failed', 'cancelled'), timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = backend.job_queue.status(job_id)
+        if job['status'] in statuses:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f'job {job_id} still {job["status"]}')
+
+
+@pytest.fixture
+def handlers(monkeypatch):
+    table = dict(backend.JOB_HANDLERS)
+    monkeypatch.setattr(backend, 'JOB_HANDLERS', table)
+    return table
+
+
+def test_handler_result_is_stored_on_the_row(handlers):
+    handlers['echo'] = lambda job, ctx: {'seen': job['params']['value']}
+    job_id = backend.job_queue.enqueue('echo', {'value': 7})
+    job = wait_for(job_id)
+    assert job['status'] == 'completed' and job['result'] == {'seen': 7} and job['progress'] == 100
+
+
+def test_failures_and_unknown_kinds_are_recorded(handlers):
+    def boom(job, ctx):
+        raise RuntimeError('no codec')
+    handlers['boom'] = boom
+    assert wait_for(backend.job_queue.enqueue('boom'))['error'] == 'no codec'
+    assert 'Unknown job kind' in wait_for(backend.job_queue.enqueue('nope'))['error']
+
+
+def test_running_job_can_be_cancelled(handlers):
+    started = threading.Event()
+
+    def slow(job, ctx):
+        started.set()
+        while True:
+            ctx.check()
+            time.sleep(0.01)
+    handlers['slow'] = slow
+    job_id = backend.job_queue.enqueue('slow')
+    assert started.wait(5)
+    assert backend.job_queue.cancel(job_id) == 'cancelling'
+    assert wait_for(job_id)['status'] == 'cancelled'
+
+
+def test_full_queue_refuses_new_jobs(monkeypatch):
+    monkeypatch.setattr(backend, 'JOB_QUEUE_MAX', 0)
+    assert backend.job_queue.enqueue('echo') is None
+
+
+def test_download_serves_the_path_recorded_by_the_job(client, auth, handlers):
+    def compress(job, ctx):
+        out = backend.UPLOAD_DIR / f"{job['id']}_elsewhere.mp4"
+        out.write_bytes(b'compressed')
+        return {'output_size': out.stat().st_size, 'output_path': str(out.resolve())}
+    handlers['compression'] = compress
+
+    job_id = backend.job_queue.enqueue('compression', {'level': 'medium'}, None,
+                                       backend.UPLOAD_DIR / 'never_written.mp4', 'in.mp4', 10)
+    wait_for(job_id)
+    r = client.get(f'/api/v1/compression/download/{job_id}', headers=auth)
+    assert r.status_code == 200 and r.data == b'compressed'
+    assert client.get('/api/v1/compression/download/missing', headers=auth).status_code == 404
+
+
+def test_chunked_upload_job_is_named_after_its_id(client, auth, handlers):
+    gate = threading.Event()
+    handlers['compression'] = lambda job, ctx: gate.wait(5) and {}
+    data = os.urandom(1000)
+    r = client.post('/api/v1/uploads', json={'filename': 'in.mp4', 'size': len(data), 'compress': 'high'},
+                    headers=auth)
+    assert r.status_code == 201
+    job = backend.job_queue.status(r.json['job_id'])
+    assert os.path.basename(job['output_path']) == f"{r.json['job_id']}_output.mp4"
+    gate.set()
+    wait_for(r.json['job_id'])
@@ -0,0 +1,93 @@
+import pytest
+
+import app as backend
+from vision import ObjectTracker, LineCounter
+
+
+class FakeYOLO:
+    loads = []
+    broken = set()
+
+    def __init__(self, path, task=None):
+        FakeYOLO.loads.append(path)
+        if path in FakeYOLO.broken:
+            raise RuntimeError('corrupt weights')
+        self.names = {0: 'sugar_bag'}
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    """A registry over three 1 MB weight files, loaded through FakeYOLO."""
+    monkeypatch.setattr(backend, 'YOLO', FakeYOLO)
+    monkeypatch.setattr(backend, 'YOLO_AVAILABLE', True)
+    monkeypatch.setattr(backend, 'INFERENCE_BACKEND', 'torch')
+    monkeypatch.setattr(backend, 'MODEL_MEMORY_BUDGET_MB', 2.5)
+    monkeypatch.setattr(backend, 'active_model_name', 'a')
+    FakeYOLO.loads, FakeYOLO.broken = [], set()
+    registry = backend.ModelRegistry({})
+    for name in ('a', 'b', 'c'):
+        path = tmp_path / f'{name}.pt'
+        path.write_bytes(b'\0' * 1024 ** 2)
+        registry.specs[name] = path
+    return registry
+
+
+def test_models_load_once_and_evict_least_recently_used(registry):
+    assert registry.get('a') is registry.get('a')
+    registry.get('b')
+    registry.get('c')
+    # 'a' is active and never evicted, so the budget drops 'b'
+    assert registry.loaded() == ['a', 'c']
+    assert registry.evictions == 1
+    assert len(FakeYOLO.loads) == 3
+    assert registry.stats()['resident_mb'] == 2.0
+
+
+def test_failed_load_is_not_retried_until_backoff_or_switch(registry, monkeypatch):
+    FakeYOLO.broken.add(str(registry.specs['b']))
+    for _ in range(50):
+        assert registry.get('b') is None
+    assert len(FakeYOLO.loads) == 1
+    assert registry.stats()['models']['b']['error'] == 'corrupt weights'
+
+    assert registry.get('b', retry=True) is None
+    assert len(FakeYOLO.loads) == 2
+
+    FakeYOLO.broken.clear()
+    monkeypatch.setattr(backend, 'MODEL_RETRY_BACKOFF', 0)
+    assert registry.get('b') is not None
+    assert registry.stats()['models']['b']['error'] is None
+
+
+def test_parity_reference_is_listed_and_budgeted(registry):
+    registry.get('a')
+    assert registry.reference('a') is not None
+    models = registry.stats()['models']
+    assert models['a@torch']['loaded'] and models['a@torch']['backend'] == 'torch'
+    assert registry.stats()['resident_mb'] == 2.0
+
+
+def detection(x, score=0.9):
+    return {'class': 'sugar_bag', 'confidence': score, 'bbox': [x, 100, x + 40, 140]}
+
+
+def test_tracker_keeps_ids_and_counts_each_crossing_once():
+    tracker = ObjectTracker()
+    counter = LineCounter('test', [{'name': 'door', 'p1': [0.5, 0.0], 'p2': [0.5, 1.0]}])
+    ids, crossings = set(), []
+    for step in range(30):
+        dets = [detection(100 + step * 10)]
+        tracks = tracker.update(dets, now=step * 0.1)
+        ids.add(dets[0]['track_id'])
+        crossings += counter.update(tracks, (300, 640))
+    assert len(ids) == 1
+    assert [direction for _, _, direction in crossings] == ['OUT']
+    assert counter.counts == {'door:OUT': 1}
+
+
+def test_weak_detections_extend_tracks_but_never_start_them():
+    tracker = ObjectTracker()
+    assert tracker.update([detection(100, score=0.2)], now=0.0) == []
+    first = tracker.update([detection(100)], now=0.1)
+    again = tracker.update([detection(104, score=0.2)], now=0.2)
+    assert [t.id for t in again] == [t.id for t in first]
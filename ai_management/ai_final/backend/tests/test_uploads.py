@@ -0,0 +1,93 @@
+import hashlib
+import io
+import os
+from pathlib import Path
+
+import app as backend
+
+
+def create(client, auth, size, **extra):
+    r = client.post('/api/v1/uploads', json={'filename': 'clip.mp4', 'size': size, **extra}, headers=auth)
+    assert r.status_code in (201, 503), r.json
+    return r
+
+
+def put(client, auth, upload_id, offset, data):
+    return client.put(f'/api/v1/uploads/{upload_id}', data=data, headers={**auth, 'Upload-Offset': str(offset)})
+
+
+def test_chunks_resume_from_server_offset(client, auth):
+    data = os.urandom(300_000)
+    upload_id = create(client, auth, len(data)).json['upload_id']
+    assert put(client, auth, upload_id, 0, data[:100_000]).json['offset'] == 100_000
+
+    # A client that lost track asks where to continue
+    assert client.get(f'/api/v1/uploads/{upload_id}', headers=auth).json['offset'] == 100_000
+    r = put(client, auth, upload_id, 0, data[:100_000])
+    assert r.status_code == 409 and r.json['offset'] == 100_000
+
+    done = put(client, auth, upload_id, 100_000, data[100_000:]).json
+    assert done['complete'] and done['sha256'] == hashlib.sha256(data).hexdigest()
+
+
+def test_hash_is_rebuilt_after_restart(client, auth):
+    data = os.urandom(50_000)
+    upload_id = create(client, auth, len(data)).json['upload_id']
+    put(client, auth, upload_id, 0, data[:20_000])
+    backend.db_writer.flush()
+    backend.upload_manager.states.pop(upload_id)    # what a restart forgets
+
+    assert client.get(f'/api/v1/uploads/{upload_id}', headers=auth).json['offset'] == 20_000
+    assert put(client, auth, upload_id, 20_000, data[20_000:]).json['sha256'] == hashlib.sha256(data).hexdigest()
+
+
+def test_oversized_chunk_is_rejected_before_writing(client, auth, monkeypatch):
+    # Small I/O blocks so the bad chunk spans several reads
+    monkeypatch.setattr(backend, 'UPLOAD_IO_BLOCK', 4096)
+    data = os.urandom(30_000)
+    upload_id = create(client, auth, len(data)).json['upload_id']
+    put(client, auth, upload_id, 0, data[:10_000])
+    state = backend.upload_manager.get(upload_id)
+
+    r = put(client, auth, upload_id, 10_000, data[10_000:] + b'extra')
+    assert r.status_code == 409 and r.json['offset'] == 10_000
+    assert state.path.stat().st_size == 10_000
+
+    # Without a Content-Length the overflow only shows while reading
+    error = backend.upload_manager.write(state, 10_000, io.BytesIO(data[10_000:] + b'extra'))
+    assert error == 'chunk runs past the declared size'
+    assert state.offset == 10_000 and state.path.stat().st_size == 10_000
+
+    done = put(client, auth, upload_id, 10_000, data[10_000:]).json
+    assert done['complete'] and done['sha256'] == hashlib.sha256(data).hexdigest()
+
+
+def test_duplicate_upload_reuses_the_stored_file(client, auth):
+    data = os.urandom(20_000)
+    digest = hashlib.sha256(data).hexdigest()
+    first = create(client, auth, len(data)).json['upload_id']
+    put(client, auth, first, 0, data)
+
+    again = create(client, auth, len(data), sha256=digest).json
+    assert again['duplicate'] and again['complete'] and again['upload_id'] == first
+
+    # Same bytes uploaded without announcing the hash - one copy is kept
+    second = create(client, auth, len(data)).json['upload_id']
+    put(client, auth, second, 0, data)
+    state = backend.upload_manager.get(second)
+    assert state.path == backend.upload_manager.get(first).path
+
+
+def test_full_queue_leaves_no_orphan_upload(client, auth, monkeypatch):
+    monkeypatch.setattr(backend, 'JOB_QUEUE_MAX', 0)
+    files = set(Path('uploads').iterdir())
+    conn = backend.get_db()
+    rows = conn.execute('SELECT COUNT(*) FROM uploads').fetchone()[0]
+    conn.close()
+
+    r = create(client, auth, 1000, compress='medium')
+    assert r.status_code == 503
+    conn = backend.get_db()
+    assert conn.execute('SELECT COUNT(*) FROM uploads').fetchone()[0] == rows
+    conn.close()
+    assert set(Path('uploads').iterdir()) == files
@@ -0,0 +1,426 @@
+"""
+Detection core shared by the Flask app and the offline-analysis worker
+processes: model backends (ONNX Runtime / Ultralytics), the object tracker
+and count lines. Nothing here imports the web app, so a spawned worker only
+pays for what it actually runs.
+"""
+import os
+import ast
+os.environ['TORCH_FORCE_WEIGHTS_ONLY_LOAD'] = '0'
+
+# Make torch optional
+try:
+    import torch
+    _original_load = torch.load
+    def _patched_load(*args, **kwargs):
+        kwargs['weights_only'] = False
+        return _original_load(*args, **kwargs)
+    torch.load = _patched_load
+    TORCH_AVAILABLE = True
+except ImportError:
+    TORCH_AVAILABLE = False
+    print("⚠️ torch not available - some features disabled")
+
+import cv2
+import tempfile
+import shutil
+import threading
+import time
+import numpy as np
+from pathlib import Path
+from collections import deque
+
+# Try to load YOLO
+try:
+    from ultralytics import YOLO
+    YOLO_AVAILABLE = True
+except ImportError:
+    YOLO = None
+    YOLO_AVAILABLE = False
+    print("⚠️ YOLO not available - detection disabled")
+
+# ONNX Runtime for the CPU inference backend (uses OpenVINO's execution
+# provider too when onnxruntime-openvino is installed)
+try:
+    import onnxruntime as ort
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+    print("⚠️ onnxruntime not available - using PyTorch for inference")
+
+MODEL_DIR = Path(__file__).parent.parent / 'models'
+
+# Object tracking / line counting
+TRACK_HIGH_CONF = 0.5           # detections above this start tracks; lower ones only extend them
+TRACK_MATCH_IOU = 0.3
+TRACK_MAX_AGE = 1.0             # seconds a lost track is kept for re-association
+TRACK_MIN_HITS = 2              # frames a track needs before it can count a crossing
+LINE_HYSTERESIS = 0.01          # dead band around a count line (fraction of frame size)
+DEFAULT_COUNT_LINES = [{'name': 'line1', 'p1': [0.0, 0.5], 'p2': [1.0, 0.5], 'invert': False}]
+
+# Inference backend
+ONNX_THREADS = int(os.environ.get('ONNX_THREADS', max(1, (os.cpu_count() or 2) // 2)))
+ONNX_USE_OPENVINO = True        # prefer OpenVINOExecutionProvider when onnxruntime has it
+ONNX_CACHE_DIR = MODEL_DIR / 'onnx'
+ONNX_IMGSZ = 640
+ONNX_NMS_IOU = 0.45
+
+# Inference
+INFERENCE_CONF = 0.35
+INFER_SIZE_STEP = 32            # model stride - inference sizes are rounded up to it
+
+
+def box_iou(a, b):
+    """IoU matrix between two (N, 4) / (M, 4) arrays of x1, y1, x2, y2 boxes."""
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), dtype=np.float32)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+def greedy_match(iou, threshold):
+    """Pairs (row, col) by descending IoU, each row/col used at most once."""
+    pairs = []
+    if iou.size == 0:
+        return pairs
+    used_rows, used_cols = set(), set()
+    for flat in np.argsort(-iou, axis=None):
+        r, c = divmod(int(flat), iou.shape[1])
+        if iou[r, c] < threshold:
+            break
+        if r in used_rows or c in used_cols:
+            continue
+        used_rows.add(r)
+        used_cols.add(c)
+        pairs.append((r, c))
+    return pairs
+
+
+def latency_summary(samples):
+    """avg/p50/p95/max of a sample window, rounded for JSON."""
+    if not samples:
+        return {'avg': 0, 'p50': 0, 'p95': 0, 'max': 0}
+    arr = np.fromiter(samples, dtype=np.float64)
+    return {
+        'avg': round(float(arr.mean()), 2),
+        'p50': round(float(np.percentile(arr, 50)), 2),
+        'p95': round(float(np.percentile(arr, 95)), 2),
+        'max': round(float(arr.max()), 2)
+    }
+
+
+# ===== ONNX BACKEND =====
+def stride_ceil(value):
+    return int(-(-value // INFER_SIZE_STEP) * INFER_SIZE_STEP)
+
+
+def letterbox_shape(frames, size):
+    """Smallest stride-aligned (h, w) every frame fits into once its longest
+    side is scaled to size - a wide ROI strip gets a wide, short input."""
+    h = w = 0
+    for frame in frames:
+        fh, fw = frame.shape[:2]
+        scale = min(size / fh, size / fw)
+        h, w = max(h, round(fh * scale)), max(w, round(fw * scale))
+    return stride_ceil(h), stride_ceil(w)
+
+
+def letterbox(frame, shape):
+    """Resize keeping aspect ratio and pad to shape (h, w) with Ultralytics'
+    grey 114 border. Returns (image, scale, (pad_x, pad_y))."""
+    h, w = frame.shape[:2]
+    scale = min(shape[0] / h, shape[1] / w)
+    nh, nw = int(round(h * scale)), int(round(w * scale))
+    resized = cv2.resize(frame, (nw, nh), interpolation=cv2.INTER_LINEAR) if (nh, nw) != (h, w) else frame
+    pad_x, pad_y = (shape[1] - nw) // 2, (shape[0] - nh) // 2
+    image = np.full((shape[0], shape[1], 3), 114, dtype=np.uint8)
+    image[pad_y:pad_y + nh, pad_x:pad_x + nw] = resized
+    return image, scale, (pad_x, pad_y)
+
+
+def decode_yolo(output, conf, scale, pad, shape, max_det=300):
+    """One image of a YOLOv8 head (4 + nc, anchors) -> [(xyxy, score, cls)],
+    class-aware NMS, boxes mapped back to the original frame."""
+    preds = output.T
+    class_scores = preds[:, 4:]
+    cls = class_scores.argmax(axis=1)
+    scores = class_scores[np.arange(len(cls)), cls]
+    keep = scores >= conf
+    if not keep.any():
+        return []
+    preds, cls, scores = preds[keep], cls[keep], scores[keep]
+    cx, cy, bw, bh = preds[:, 0], preds[:, 1], preds[:, 2], preds[:, 3]
+    boxes = np.stack([cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2], axis=1)
+    boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad[0]) / scale
+    boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad[1]) / scale
+    h, w = shape[:2]
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, w)
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, h)
+
+    # Offset boxes per class so one NMS pass never suppresses across classes
+    offset = cls[:, None].astype(np.float32) * (max(h, w) + 1)
+    shifted = boxes + offset
+    xywh = np.concatenate([shifted[:, :2], shifted[:, 2:] - shifted[:, :2]], axis=1)
+    idx = cv2.dnn.NMSBoxes(xywh.tolist(), scores.tolist(), conf, ONNX_NMS_IOU)
+    idx = np.array(idx).reshape(-1)[:max_det]
+    return [(boxes[i], float(scores[i]), int(cls[i])) for i in idx]
+
+
+class OnnxDetector:
+    """A YOLO .pt exported once to ONNX (cached next to the models) and run on
+    ONNX Runtime's CPU - or OpenVINO - provider, with our own letterbox, decode
+    and NMS so the Ultralytics/PyTorch stack isn't needed at inference time."""
+    backend = 'onnx'
+
+    export_lock = threading.Lock()
+
+    def __init__(self, name, pt_path=None, onnx_path=None):
+        self.name = name
+        self.pt_path = Path(pt_path) if pt_path else None
+        self.path = Path(onnx_path) if onnx_path else self.export(self.pt_path)
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = ONNX_THREADS
+        opts.inter_op_num_threads = 1
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        providers = ['CPUExecutionProvider']
+        if ONNX_USE_OPENVINO and 'OpenVINOExecutionProvider' in ort.get_available_providers():
+            providers.insert(0, 'OpenVINOExecutionProvider')
+        self.session = ort.InferenceSession(str(self.path), opts, providers=providers)
+        self.provider = self.session.get_providers()[0]
+        meta = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(meta['names']) if 'names' in meta else {}
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        self.imgsz = inp.shape[2] if isinstance(inp.shape[2], int) else ONNX_IMGSZ
+        self.dynamic_batch = not isinstance(inp.shape[0], int)
+        self.dynamic_hw = not isinstance(inp.shape[2], int)
+
+    @staticmethod
+    def export(pt_path):
+        """Path of the cached ONNX for this .pt, exporting it if missing or stale."""
+        ONNX_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        st = pt_path.stat()
+        cached = ONNX_CACHE_DIR / f"{pt_path.stem}-{ONNX_IMGSZ}-{int(st.st_mtime)}-{st.st_size}.onnx"
+        with OnnxDetector.export_lock:
+            if cached.exists():
+                return cached
+            if not YOLO_AVAILABLE:
+                raise RuntimeError(f"no cached ONNX for {pt_path.name} and ultralytics is needed to export it")
+            t0 = time.time()
+            # Ultralytics writes <stem>.onnx next to the weights; export a
+            # private copy and move the result in atomically so no other
+            # process ever opens a half-written file
+            with tempfile.TemporaryDirectory(dir=ONNX_CACHE_DIR) as tmp:
+                source = Path(tmp) / pt_path.name
+                shutil.copy2(pt_path, source)
+                exported = YOLO(str(source), task='detect').export(format='onnx', imgsz=ONNX_IMGSZ, dynamic=True)
+                os.replace(exported, cached)
+            for stale in ONNX_CACHE_DIR.glob(f"{pt_path.stem}-*.onnx"):
+                if stale != cached:
+                    stale.unlink(missing_ok=True)
+            print(f"📦 Exported {pt_path.name} to ONNX in {time.time() - t0:.1f}s")
+        return cached
+
+    def detect(self, frames, conf, imgsz=None):
+        """[[(xyxy, score, cls), ...] per frame]"""
+        if self.dynamic_hw:
+            shape = letterbox_shape(frames, imgsz or self.imgsz)
+        else:
+            shape = (self.imgsz, self.imgsz)
+        prepared = [letterbox(f, shape) for f in frames]
+        blob = np.stack([img for img, _, _ in prepared])[..., ::-1].transpose(0, 3, 1, 2)
+        blob = np.ascontiguousarray(blob, dtype=np.float32) / 255.0
+        if self.dynamic_batch:
+            outputs = self.session.run(None, {self.input_name: blob})[0]
+        else:
+            outputs = np.concatenate([self.session.run(None, {self.input_name: blob[i:i + 1]})[0]
+                                      for i in range(len(frames))])
+        return [decode_yolo(out, conf, scale, pad, frame.shape)
+                for out, (_, scale, pad), frame in zip(outputs, prepared, frames)]
+
+
+def detect_raw(model, frames, conf, imgsz=None):
+    """Backend-neutral: [[(xyxy, score, cls), ...] per frame]"""
+    if isinstance(model, OnnxDetector):
+        return model.detect(frames, conf, imgsz)
+    options = {'imgsz': stride_ceil(imgsz)} if imgsz else {}
+    results = model(frames, verbose=False, conf=conf, **options)
+    return [[(box.xyxy[0].tolist(), float(box.conf[0]), int(box.cls[0])) for box in r.boxes] for r in results]
+
+
+def detect_batch(model, model_name, frames, imgsz=None):
+    """Run a loaded model over a list of frames. Returns one detection list per frame."""
+    batch = []
+    for raw in detect_raw(model, frames, INFERENCE_CONF, imgsz):
+        detections = []
+        for xyxy, conf, cls in raw:
+            x1, y1, x2, y2 = map(int, xyxy)
+
+            detections.append({
+                'class': model.names[cls],
+                'confidence': conf,
+                'model': model_name,
+                'bbox': [x1, y1, x2, y2]
+            })
+
+        batch.append(detections)
+    return batch
+
+
+# ===== TRACKING =====
+class Track:
+    def __init__(self, track_id, box, cls, score, now):
+        self.id = track_id
+        self.box = np.asarray(box, dtype=np.float32)
+        self.velocity = np.zeros(4, dtype=np.float32)
+        self.cls = cls
+        self.score = score
+        self.hits = 1
+        self.last_seen = now
+        self.line_sides = {}
+
+    @property
+    def center(self):
+        return ((self.box[0] + self.box[2]) / 2, (self.box[1] + self.box[3]) / 2)
+
+    def predicted_box(self):
+        return self.box + self.velocity
+
+
+class ObjectTracker:
+    """ByteTrack-style IoU tracker over the detector's boxes.
+
+    Confident detections are matched to tracks first (same class, IoU on a
+    constant-velocity prediction), then low-confidence ones get a second chance
+    to extend tracks that are still unmatched - this keeps IDs through
+    partial occlusion without starting tracks from weak boxes."""
+    def __init__(self):
+        self.tracks = []
+        self.next_id = 1
+        self.update_ms = deque(maxlen=300)
+        self.objects = deque(maxlen=300)
+
+    def update(self, detections, now=None):
+        """Assign track ids to detections (adds det['track_id']) and return
+        the tracks seen in this frame."""
+        t0 = time.time()
+        now = t0 if now is None else now
+        boxes = np.array([d['bbox'] for d in detections], dtype=np.float32).reshape(-1, 4)
+        scores = np.array([d['confidence'] for d in detections], dtype=np.float32)
+        classes = [d['class'] for d in detections]
+
+        unmatched_tracks = list(range(len(self.tracks)))
+        unmatched_dets = set(range(len(detections)))
+        seen = []
+        for high in (True, False):
+            dets = [i for i in unmatched_dets if (scores[i] >= TRACK_HIGH_CONF) == high]
+            if not dets or not unmatched_tracks:
+                continue
+            track_boxes = np.array([self.tracks[t].predicted_box() for t in unmatched_tracks]).reshape(-1, 4)
+            iou = box_iou(track_boxes, boxes[dets])
+            for r, t in enumerate(unmatched_tracks):
+                for c, d in enumerate(dets):
+                    if self.tracks[t].cls != classes[d]:
+                        iou[r, c] = 0
+            matched_tracks = set()
+            for r, c in greedy_match(iou, TRACK_MATCH_IOU):
+                track = self.tracks[unmatched_tracks[r]]
+                d = dets[c]
+                track.velocity = 0.5 * track.velocity + 0.5 * (boxes[d] - track.box)
+                track.box = boxes[d]
+                track.score = float(scores[d])
+                track.hits += 1
+                track.last_seen = now
+                detections[d]['track_id'] = track.id
+                unmatched_dets.discard(d)
+                matched_tracks.add(unmatched_tracks[r])
+                seen.append(track)
+            unmatched_tracks = [t for t in unmatched_tracks if t not in matched_tracks]
+
+        for d in sorted(unmatched_dets):
+            if scores[d] < TRACK_HIGH_CONF:
+                continue
+            track = Track(self.next_id, boxes[d], classes[d], float(scores[d]), now)
+            self.next_id += 1
+            detections[d]['track_id'] = track.id
+            self.tracks.append(track)
+            seen.append(track)
+
+        self.tracks = [t for t in self.tracks if now - t.last_seen <= TRACK_MAX_AGE]
+        self.update_ms.append((time.time() - t0) * 1000)
+        self.objects.append(len(detections))
+        return seen
+
+    def keep_alive(self, now=None):
+        """Scene judged static by the motion gate - objects are still there."""
+        now = time.time() if now is None else now
+        for t in self.tracks:
+            t.last_seen = now
+
+    def stats(self):
+        return {
+            'active_tracks': len(self.tracks),
+            'next_id': self.next_id,
+            'avg_objects': round(float(np.mean(self.objects)), 1) if self.objects else 0,
+            'update_ms': latency_summary(list(self.update_ms))
+        }
+
+
+class LineCounter:
+    """Virtual count lines for one camera. Lines are in normalised (0-1)
+    coordinates; a track whose centre crosses to the right-hand side of
+    p1->p2 (as seen walking from p1 to p2) counts IN - for the default
+    left-to-right line that is moving down the frame - the other way OUT.
+    'invert' swaps the two."""
+    def __init__(self, camera_id, lines=None):
+        self.camera_id = camera_id
+        self.lines = lines if lines is not None else DEFAULT_COUNT_LINES
+        self.counts = {}
+        self.events = 0
+
+    def _side(self, line, point, shape):
+        h, w = shape[:2]
+        x1, y1 = line['p1'][0] * w, line['p1'][1] * h
+        x2, y2 = line['p2'][0] * w, line['p2'][1] * h
+        px, py = point
+        length = max(np.hypot(x2 - x1, y2 - y1), 1e-6)
+        # Signed distance from the line, and position along it (0..1)
+        dist = ((x2 - x1) * (py - y1) - (y2 - y1) * (px - x1)) / length
+        along = ((px - x1) * (x2 - x1) + (py - y1) * (y2 - y1)) / (length * length)
+        margin = LINE_HYSTERESIS * max(h, w)
+        if along < 0 or along > 1 or abs(dist) < margin:
+            return 0
+        return 1 if dist > 0 else -1
+
+    def update(self, tracks, shape):
+        """Returns [(track, line, direction)] for every crossing this frame."""
+        events = []
+        for track in tracks:
+            for line in self.lines:
+                side = self._side(line, track.center, shape)
+                if side == 0:
+                    continue
+                name = line.get('name', 'line')
+                previous = track.line_sides.get(name)
+                track.line_sides[name] = side
+                if previous is None or previous == side or track.hits < TRACK_MIN_HITS:
+                    continue
+                direction = 'IN' if side > 0 else 'OUT'
+                if line.get('invert'):
+                    direction = 'OUT' if direction == 'IN' else 'IN'
+                key = f"{name}:{direction}"
+                self.counts[key] = self.counts.get(key, 0) + 1
+                self.events += 1
+                events.append((track, line, direction))
+        return events
+
+    def stats(self):
+        return {'lines': self.lines, 'counts': self.counts, 'events': self.events}
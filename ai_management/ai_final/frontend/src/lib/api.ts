@@ -94,3 +94,59 @@ export async function apiUpload<T>(
 
     return response.json();
 }
+
+// Live updates over Server-Sent Events. EventSource can't set headers, so the
+// token goes in the query string. Returns a function that closes the stream.
+export function subscribeEvents<T = unknown>(
+    handlers: Record<string, (data: T) => void>,
+    params: Record<string, string> = {}
+): () => void {
+    const token = getToken();
+    const query = new URLSearchParams({
+        ...params,
+        topics: Object.keys(handlers).join(','),
+        ...(token ? { token } : {}),
+    });
+    const source = new EventSource(`${getApiUrl()}/api/v1/events?${query}`);
+    for (const [topic, handler] of Object.entries(handlers)) {
+        source.addEventListener(topic, (e) => handler(JSON.parse((e as MessageEvent).data)));
+    }
+    return () => source.close();
+}
+
+export interface ChunkedUpload {
+    upload_id: string;
+    offset: number;
+    size: number;
+    chunk_size: number;
+    complete: boolean;
+}
+
+// Send a file to an upload created with POST /api/v1/uploads, chunk by chunk.
+// After a failed chunk the server's offset says where to resume.
+export async function uploadChunks(
+    file: File,
+    upload: ChunkedUpload,
+    onProgress?: (sent: number) => void
+): Promise<void> {
+    let offset = upload.offset;
+    let retries = 0;
+    while (offset < file.size) {
+        const end = Math.min(offset + upload.chunk_size, file.size);
+        try {
+            const status = await request<ChunkedUpload>(`/api/v1/uploads/${upload.upload_id}`, {
+                method: 'PUT',
+                body: file.slice(offset, end),
+                headers: { 'Content-Type': 'application/octet-stream', 'Upload-Offset': String(offset) },
+            });
+            offset = status.offset;
+            retries = 0;
+        } catch (err) {
+            if (++retries > 5) throw err;
+            await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+            const status = await apiGet<ChunkedUpload>(`/api/v1/uploads/${upload.upload_id}`);
+            offset = status.offset;
+        }
+        onProgress?.(offset);
+    }
+}
@@ -11,39 +11,47 @@ interface Detection {
     detected_at: string;
 }
 
+interface AnalyticsSummary {
+    total: number;
+    in: number;
+    out: number;
+    by_type: Record<string, number>;
+    by_date: { date: string; count: number }[];
+}
+
 export default function Analytics() {
     const [detections, setDetections] = useState<Detection[]>([]);
+    const [summary, setSummary] = useState<AnalyticsSummary | null>(null);
     const [loading, setLoading] = useState(true);
 
     useEffect(() => {
-        fetchDetections();
+        fetchAnalytics();
     }, []);
 
-    async function fetchDetections() {
+    async function fetchAnalytics() {
         try {
-            const data = await apiGet<Detection[]>('/api/v1/detections?limit=100');
-            setDetections(data);
+            // Totals come from the server-side rollups; only the recent table needs raw rows
+            const [summaryData, recent] = await Promise.all([
+                apiGet<AnalyticsSummary>('/api/v1/analytics/summary?days=7'),
+                apiGet<Detection[]>('/api/v1/detections?limit=10'),
+            ]);
+            setSummary(summaryData);
+            setDetections(recent);
         } catch (err) {
-            console.error('Failed to fetch detections:', err);
+            console.error('Failed to fetch analytics:', err);
         } finally {
             setLoading(false);
         }
     }
 
-    // Group by type
-    const byType = detections.reduce((acc, d) => {
-        acc[d.type] = (acc[d.type] || 0) + 1;
-        return acc;
-    }, {} as Record<string, number>);
-
-    // Group by direction
-    const inCount = detections.filter(d => d.direction === 'IN').length;
-    const outCount = detections.filter(d => d.direction === 'OUT').length;
+    const total = summary?.total ?? 0;
+    const byType = summary?.by_type ?? {};
+    const inCount = summary?.in ?? 0;
+    const outCount = summary?.out ?? 0;
 
     // Group by date
-    const byDate = detections.reduce((acc, d) => {
-        const date = new Date(d.detected_at).toLocaleDateString();
-        acc[date] = (acc[date] || 0) + 1;
+    const byDate = (summary?.by_date ?? []).reduce((acc, d) => {
+        acc[new Date(d.date).toLocaleDateString()] = d.count;
         return acc;
     }, {} as Record<string, number>);
 
@@ -75,7 +83,7 @@ export default function Analytics() {
                     <div className="stat-icon purple"></div>
                     <div className="stat-content">
                         <div className="stat-label">Total Detections</div>
-                        <div className="stat-value">{detections.length}</div>
+                        <div className="stat-value">{total}</div>
                     </div>
                 </div>
                 <div className="stat-card">
@@ -118,7 +126,7 @@ export default function Analytics() {
                                         <div className="progress-bar-track" style={{ flex: 1 }}>
                                             <div
                                                 className="progress-bar-fill"
-                                                style={{ width: `${(count / detections.length) * 100}%` }}
+                                                style={{ width: `${(count / total) * 100}%` }}
                                             />
                                         </div>
                                         <strong style={{ width: 40, textAlign: 'right' }}>{count}</strong>
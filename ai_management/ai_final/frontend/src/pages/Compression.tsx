@@ -1,5 +1,5 @@
-import { useState, useRef } from 'react';
-import { apiUpload, API_URL } from '../lib/api';
+import { useState, useRef, useEffect } from 'react';
+import { apiGet, apiPost, uploadChunks, API_URL, type ChunkedUpload } from '../lib/api';
 import { PageHeader } from '../components/ui/PageHeader';
 import { useToast } from '../components/ui/Toast';
 
@@ -11,6 +11,9 @@ interface Job {
     compression_ratio?: number;
     download_url?: string;
     original_filename?: string;
+    progress?: number;
+    eta_seconds?: number | null;
+    queue_position?: number | null;
 }
 
 export default function Compression() {
@@ -20,20 +23,48 @@ export default function Compression() {
     const fileInputRef = useRef<HTMLInputElement>(null);
     const { addToast } = useToast();
 
+    // Jobs are kept server-side, so pick up anything still running after a reload
+    useEffect(() => {
+        apiGet<Job[]>('/api/v1/compression/jobs')
+            .then(list => {
+                setJobs(list);
+                list.filter(j => j.status === 'queued' || j.status === 'processing')
+                    .forEach(j => pollJobStatus(j.job_id));
+            })
+            .catch(err => console.error('Failed to fetch jobs:', err));
+    }, []);
+
+    async function cancelJob(jobId: string) {
+        try {
+            await apiPost(`/api/v1/compression/cancel/${jobId}`);
+        } catch (err) {
+            addToast('Cancel failed', 'error');
+        }
+    }
+
     async function handleUpload(e: React.ChangeEvent<HTMLInputElement>) {
         const file = e.target.files?.[0];
         if (!file) return;
 
         setUploading(true);
-        const formData = new FormData();
-        formData.append('file', file);
-        formData.append('level', level);
-
         try {
-            const job = await apiUpload<Job>('/api/v1/compression/upload', formData);
-            setJobs([job, ...jobs]);
+            // Chunked upload: the job is queued straight away and ffmpeg starts
+            // reading while the rest of the file is still being sent
+            const upload = await apiPost<ChunkedUpload & { job_id: string }>('/api/v1/uploads', {
+                filename: file.name,
+                size: file.size,
+                compress: level,
+            });
+            const job: Job = {
+                job_id: upload.job_id,
+                status: 'queued',
+                original_size: file.size,
+                original_filename: file.name,
+            };
+            setJobs(prev => [job, ...prev]);
             addToast(`Compression started: ${file.name}`, 'success');
             pollJobStatus(job.job_id);
+            await uploadChunks(file, upload);
         } catch (err) {
             addToast('Upload failed: ' + (err instanceof Error ? err.message : 'Unknown error'), 'error');
         } finally {
@@ -61,6 +92,8 @@ export default function Compression() {
                 } else if (job.status === 'failed') {
                     addToast('Compression failed', 'error');
                     clearInterval(interval);
+                } else if (job.status === 'cancelled') {
+                    clearInterval(interval);
                 }
             } catch (err) {
                 clearInterval(interval);
@@ -134,9 +167,25 @@ export default function Compression() {
                                     </p>
                                 </div>
                                 <div style={{ display: 'flex', alignItems: 'center', gap: 12 }}>
+                                    {job.status === 'queued' && (
+                                        <span className="badge badge-warning">
+                                            Queued{job.queue_position ? ` #${job.queue_position}` : ''}
+                                        </span>
+                                    )}
                                     {job.status === 'processing' && (
                                         <span className="badge badge-warning">
-                                            Processing
+                                            Processing {Math.round(job.progress || 0)}%
+                                            {job.eta_seconds != null && ` · ${job.eta_seconds}s left`}
+                                        </span>
+                                    )}
+                                    {(job.status === 'queued' || job.status === 'processing') && (
+                                        <button className="btn btn-secondary btn-sm" onClick={() => cancelJob(job.job_id)}>
+                                            Cancel
+                                        </button>
+                                    )}
+                                    {job.status === 'cancelled' && (
+                                        <span className="badge badge-expired">
+                                            Cancelled
                                         </span>
                                     )}
                                     {job.status === 'completed' && (
@@ -1,5 +1,5 @@
 import { useState, useEffect } from 'react';
-import { apiGet } from '../lib/api';
+import { apiGet, subscribeEvents } from '../lib/api';
 import { PageHeader } from '../components/ui/PageHeader';
 import { SkeletonStats, SkeletonTable } from '../components/ui/Skeleton';
 import {
@@ -37,8 +37,12 @@ export default function Dashboard() {
 
     useEffect(() => {
         fetchDashboard();
-        const interval = setInterval(fetchDashboard, 5000);
-        return () => clearInterval(interval);
+        // Inventory totals are pushed after each committed batch; camera
+        // status changes are rare enough to just refetch
+        return subscribeEvents({
+            inventory: (snapshot) => setData(prev => prev ? { ...prev, ...(snapshot as Partial<DashboardData>) } : prev),
+            camera: () => fetchDashboard(),
+        });
     }, []);
 
     async function fetchDashboard() {
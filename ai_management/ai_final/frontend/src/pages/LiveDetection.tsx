@@ -1,5 +1,5 @@
 import { useState, useEffect } from 'react';
-import { apiPost, API_URL } from '../lib/api';
+import { apiPost, subscribeEvents, API_URL } from '../lib/api';
 import { PageHeader } from '../components/ui/PageHeader';
 import { useToast } from '../components/ui/Toast';
 
@@ -51,12 +51,13 @@ export default function LiveDetection() {
         }
     }, [mode, models]); // Depend on mode and models loaded
 
+    // Detections and server-side line counts are pushed; no polling
     useEffect(() => {
-        let interval: ReturnType<typeof setInterval>;
-        if (isStreaming) {
-            interval = setInterval(fetchDetections, 1000);
-        }
-        return () => clearInterval(interval);
+        if (!isStreaming) return;
+        return subscribeEvents({
+            detections: (data) => setDetections((data as { detections: Detection[] }).detections),
+            counts: (data) => setSugarCount((data as { sugar_bag_count: number }).sugar_bag_count),
+        }, { camera_id: 'default' });
     }, [isStreaming]);
 
     async function fetchModels() {
@@ -90,27 +91,6 @@ export default function LiveDetection() {
         }
     }
 
-    async function fetchDetections() {
-        try {
-            const response = await fetch(`${API_URL}/api/v1/camera/detections`, {
-                headers: { 'ngrok-skip-browser-warning': 'true' }
-            });
-            const data = await response.json();
-            setDetections(data);
-
-            // Simple client-side counting visualization for demo
-            // In a real app this would come from backend session stats
-            if (mode === 'sugar') {
-                const bagCount = data.filter((d: Detection) => d.class.toLowerCase().includes('bag')).length;
-                if (bagCount > 0) {
-                    setSugarCount(prev => prev + bagCount); // Just adding current frame count for visualization demo
-                }
-            }
-        } catch (err) {
-            console.error('Failed to fetch detections:', err);
-        }
-    }
-
     // Explicit reset for counter
     function resetCounter() {
         setSugarCount(0);
@@ -412,16 +392,21 @@ function VideoPlayer() {
 
     useEffect(() => {
         let mounted = true;
+        let etag = '';
 
         const fetchFrame = async () => {
             try {
                 const token = localStorage.getItem('token');
-                const headers: HeadersInit = { 'ngrok-skip-browser-warning': 'true' };
+                const headers: Record<string, string> = { 'ngrok-skip-browser-warning': 'true' };
                 if (token) headers['Authorization'] = `Bearer ${token}`;
+                // Unchanged frame -> 304 with no body
+                if (etag) headers['If-None-Match'] = etag;
 
-                const response = await fetch(`${API_URL}/api/v1/camera/snapshot`, { headers });
+                const response = await fetch(`${API_URL}/api/v1/camera/snapshot`, { headers, cache: 'no-store' });
 
+                if (response.status === 304) return;
                 if (response.ok && mounted) {
+                    etag = response.headers.get('ETag') || '';
                     const blob = await response.blob();
                     const url = URL.createObjectURL(blob);
                     setImageSrc(prev => {